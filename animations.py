@@ -0,0 +1,259 @@
+import numpy as np
+
+# every animated cell, stored as parallel arrays with one row per animation
+# rather than one list per cell, so that a frame can advance and blend all
+# of them in a few numpy operations.
+# rows are kept packed: removing an animation moves the last row into its
+# place, and a dict maps each cell to its row.
+# colors are rgb, indices are palette indices
+
+# animation types
+FADE = 0
+GROW = 1
+
+# original index of an animation that started part way through another
+# animation. its color is a blend, so it has no palette entry
+BLENDED = -1
+
+
+class Animations:
+    def __init__(self, capacity=64):
+        self._rows = {}
+        self._n = 0
+        self._allocate(capacity)
+
+    def __len__(self):
+        return self._n
+
+    def __bool__(self):
+        return bool(self._n)
+
+    def __contains__(self, cell):
+        return cell in self._rows
+
+    def _allocate(self, capacity):
+        self.xs = np.zeros(capacity, dtype=np.int64)
+        self.ys = np.zeros(capacity, dtype=np.int64)
+        self.original_colors = np.zeros((capacity, 3), dtype=np.int64)
+        self.current_colors = np.zeros((capacity, 3), dtype=np.int64)
+        self.target_colors = np.zeros((capacity, 3), dtype=np.int64)
+        self.original_indices = np.zeros(capacity, dtype=np.int64)
+        self.target_indices = np.zeros(capacity, dtype=np.int64)
+        self.types = np.zeros(capacity, dtype=np.int8)
+        self.progress = np.zeros(capacity, dtype=np.float64)
+        self.durations = np.ones(capacity, dtype=np.float64)
+        self.deleting = np.zeros(capacity, dtype=bool)
+
+    def _arrays(self):
+        return (
+            self.xs, self.ys, self.original_colors, self.current_colors,
+            self.target_colors, self.original_indices, self.target_indices,
+            self.types, self.progress, self.durations, self.deleting
+        )
+
+    def _reserve(self, n):
+        capacity = len(self.xs)
+        if self._n + n <= capacity:
+            return
+
+        while capacity < self._n + n:
+            capacity *= 2
+        old = self._arrays()
+        self._allocate(capacity)
+        for new_array, old_array in zip(self._arrays(), old):
+            new_array[:self._n] = old_array[:self._n]
+
+    def clear(self):
+        self._rows = {}
+        self._n = 0
+
+    def get(self, cell_x, cell_y):
+        # the row of the cell's animation, or None
+        return self._rows.get((cell_x, cell_y), None)
+
+    def add(self, cell_x, cell_y, original_index, target_index,
+            original_color, target_color, duration, animation_type,
+            deleting):
+        # animates a cell that isn't animated yet
+        self._reserve(1)
+        row = self._n
+        self._n += 1
+        self._rows[(cell_x, cell_y)] = row
+        self._set(row, cell_x, cell_y, original_index, target_index,
+                  original_color, target_color, duration, animation_type,
+                  deleting)
+
+    def _set(self, row, cell_x, cell_y, original_index, target_index,
+             original_color, target_color, duration, animation_type,
+             deleting):
+        self.xs[row] = cell_x
+        self.ys[row] = cell_y
+        self.original_colors[row] = original_color
+        self.current_colors[row] = original_color
+        self.target_colors[row] = target_color
+        self.original_indices[row] = original_index
+        self.target_indices[row] = target_index
+        self.types[row] = animation_type
+        self.progress[row] = 0
+        self.durations[row] = duration
+        self.deleting[row] = deleting
+
+    def add_many(self, xs, ys, original_indices, target_indices,
+                 original_colors, target_colors, duration, animation_type,
+                 deleting):
+        # animates many cells at once. the cells must be unique, and none
+        # of them can be animated already
+        n = len(xs)
+        self._reserve(n)
+        start = self._n
+        end = start + n
+        self._n = end
+        self._rows.update(zip(
+            zip(xs.tolist(), ys.tolist()), range(start, end)
+        ))
+
+        self.xs[start:end] = xs
+        self.ys[start:end] = ys
+        self.original_colors[start:end] = original_colors
+        self.current_colors[start:end] = original_colors
+        self.target_colors[start:end] = target_colors
+        self.original_indices[start:end] = original_indices
+        self.target_indices[start:end] = target_indices
+        self.types[start:end] = animation_type
+        self.progress[start:end] = 0
+        self.durations[start:end] = duration
+        self.deleting[start:end] = deleting
+
+    def restart(self, cell_x, cell_y, target_index, target_color, duration,
+                animation_type, deleting):
+        # changes the target of a cell's animation. returns False if the
+        # cell isn't animated.
+        # animating back to where the animation started reverses it from
+        # its current progress. otherwise a new animation starts from the
+        # color the cell is currently showing
+        row = self._rows.get((cell_x, cell_y), None)
+        if row is None:
+            return False
+
+        if self.original_indices[row] == target_index:
+            self.original_colors[row], self.target_colors[row] = \
+                self.target_colors[row].copy(), target_color
+            self.original_indices[row], self.target_indices[row] = \
+                self.target_indices[row], target_index
+            perc = max(0, 1 - self.progress[row] / self.durations[row])
+            self.progress[row] = duration * perc
+            self.durations[row] = duration
+            self.deleting[row] = deleting
+
+        elif self.target_indices[row] != target_index:
+            original_color = self.current_colors[row].copy()
+            self._set(row, cell_x, cell_y, BLENDED, target_index,
+                      original_color, target_color, duration,
+                      animation_type, deleting)
+
+        return True
+
+    def remove(self, cell_x, cell_y):
+        row = self._rows.pop((cell_x, cell_y), None)
+        if row is None:
+            return
+
+        self._n -= 1
+        last = self._n
+        if row != last:
+            for array in self._arrays():
+                array[row] = array[last]
+            self._rows[(int(self.xs[row]), int(self.ys[row]))] = row
+
+    def remove_many(self, xs, ys):
+        if not self._n:
+            return
+
+        rows = self._rows
+        removed = [
+            rows[cell] for cell in zip(xs.tolist(), ys.tolist())
+            if cell in rows
+        ]
+        if removed:
+            keep = np.ones(self._n, dtype=bool)
+            keep[removed] = False
+            self._compact(keep)
+
+    def fractions(self):
+        # how far through its duration each animation is
+        return self.progress[:self._n] / self.durations[:self._n]
+
+    def blend(self, rows, perc):
+        # the color the animations in rows show at the given fractions,
+        # which is remembered as their current color.
+        # fades blend from the original to the target color, the same as
+        # utils.color_mix. growing cells show the target color
+        original = self.original_colors[rows]
+        target = self.target_colors[rows]
+        perc = perc[:, None]
+        blended = (original * (1 - perc) + target * perc).astype(np.int64)
+        colors = np.where((self.types[rows] == FADE)[:, None], blended, target)
+        self.current_colors[rows] = colors
+        return colors
+
+    def advance(self, delta):
+        # moves every clock forward, whether or not it was drawn
+        self.progress[:self._n] += delta
+
+    def shorten(self, factor):
+        # scales every animation's duration, keeping how far through it is
+        self.progress[:self._n] *= factor
+        self.durations[:self._n] *= factor
+
+    def pop_finished(self, perc):
+        # removes the animations that have reached the end of their
+        # duration. returns their xs, ys, target indices and whether they
+        # delete their cell, or None if none have finished
+        finished = perc >= 1
+        if not finished.any():
+            return None
+
+        n = self._n
+        result = (
+            self.xs[:n][finished],
+            self.ys[:n][finished],
+            self.target_indices[:n][finished],
+            self.deleting[:n][finished]
+        )
+        self._compact(~finished)
+        return result
+
+    def pop_all(self):
+        # removes every animation, returning the same as pop_finished
+        n = self._n
+        result = (
+            self.xs[:n].copy(),
+            self.ys[:n].copy(),
+            self.target_indices[:n].copy(),
+            self.deleting[:n].copy()
+        )
+        self.clear()
+        return result
+
+    def _compact(self, keep):
+        # removes the rows that aren't kept by moving rows from the end
+        # into their places, so that only the removed and moved cells have
+        # to be updated in the dict
+        n = self._n
+        new_n = int(np.count_nonzero(keep))
+        holes = np.flatnonzero(~keep[:new_n])
+        moved = np.flatnonzero(keep[new_n:]) + new_n
+
+        rows = self._rows
+        removed = ~keep
+        for cell in zip(self.xs[:n][removed].tolist(),
+                        self.ys[:n][removed].tolist()):
+            del rows[cell]
+
+        for array in self._arrays():
+            array[holes] = array[moved]
+        rows.update(zip(
+            zip(self.xs[holes].tolist(), self.ys[holes].tolist()),
+            holes.tolist()
+        ))
+        self._n = new_n
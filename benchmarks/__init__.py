@@ -0,0 +1,70 @@
+import tracemalloc
+
+from benchmarks.harness import Benchmark
+from benchmarks.scenarios import SCENARIOS, replay
+
+# metrics compared against a baseline, and whether a higher value is better
+METRICS = {
+    "frame_ms.p50": False,
+    "frame_ms.p90": False,
+    "frame_ms.p99": False,
+    "cells_per_second": True,
+    "peak_memory_bytes": False,
+}
+
+
+def run_scenario(scenario, fps=60, memory=True):
+    # times the scenario, then runs it again under tracemalloc to find its
+    # peak memory. tracemalloc slows python down too much to time with it.
+    # scenario is either the name of one in SCENARIOS, or a function
+    if not callable(scenario):
+        scenario = SCENARIOS[scenario]
+
+    bench = Benchmark(fps)
+    try:
+        scenario(bench)
+    finally:
+        bench.stop()
+    results = bench.results()
+
+    if memory:
+        tracemalloc.start()
+        bench = Benchmark(fps)
+        try:
+            scenario(bench)
+        finally:
+            bench.stop()
+            results["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    return results
+
+
+def _get_metric(results, metric):
+    for key in metric.split("."):
+        results = results.get(key, None)
+        if results is None:
+            return None
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    # returns a list of (scenario, metric, baseline, current, change) for
+    # every metric that is more than tolerance worse than the baseline
+    regressions = []
+    for name, scenario in results.items():
+        if name not in baseline:
+            continue
+
+        for metric, higher_is_better in METRICS.items():
+            old = _get_metric(baseline[name], metric)
+            new = _get_metric(scenario, metric)
+            if not old or new is None:
+                continue
+
+            change = (new - old) / old
+            if higher_is_better:
+                change = -change
+            if change > tolerance:
+                regressions.append((name, metric, old, new, change))
+    return regressions
@@ -0,0 +1,77 @@
+import argparse
+import functools
+import json
+import sys
+
+from benchmarks import SCENARIOS, run_scenario, compare, replay
+
+# python -m benchmarks [scenario ...] [--replay session.rec ...]
+#                      [--output results.json]
+#                      [--baseline baseline.json] [--tolerance 0.1]
+# results are printed as json. with a baseline, any metric more than
+# tolerance worse than it is reported, and the exit status is 1
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "scenarios", nargs="*",
+        help=f"scenarios to run, out of {', '.join(SCENARIOS)}. default all"
+    )
+    parser.add_argument(
+        "--replay", action="append", default=[], metavar="RECORDING",
+        help="also replay a session recorded with PYGRID_RECORD"
+    )
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against these results")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1,
+        help="how much worse than the baseline a metric can be, 0.1 = 10%%"
+    )
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument(
+        "--no-memory", action="store_true",
+        help="skip the second run that measures peak memory"
+    )
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+
+    scenarios = {name: SCENARIOS[name] for name in args.scenarios}
+    if not args.scenarios and not args.replay:
+        scenarios = dict(SCENARIOS)
+    for path in args.replay:
+        scenarios["replay:" + path] = functools.partial(replay, path=path)
+
+    results = {}
+    for name, scenario in scenarios.items():
+        print(f"running {name}...", file=sys.stderr)
+        results[name] = run_scenario(scenario, args.fps, not args.no_memory)
+
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name, metric, old, new, change in regressions:
+        print(f"{name} {metric}: {old} -> {new} ({change:+.1%} worse)",
+              file=sys.stderr)
+    if regressions:
+        return 1
+
+    print("no regressions", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
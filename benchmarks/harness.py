@@ -0,0 +1,97 @@
+import time
+import numpy as np
+
+# drives a headless grid frame by frame, the same way PyGrid.start() does,
+# but without waiting for the next frame. timers aren't synchronous, so
+# simulations, timer threads and the animation budget work as on screen.
+# every frame is given the same delta, so a scenario does the same work
+# no matter how fast the machine is, and only the time it takes changes.
+# scenarios with a threaded timer set paced, so that frames wait for the
+# next frame like the event loop does, otherwise the timer thread would
+# fall further and further behind.
+# cells drawn are taken from the grid's frame stats, which are read back
+# before their ring buffer wraps around
+
+STATS_FRAMES = 600
+
+
+class Benchmark:
+    def __init__(self, fps=60):
+        self.fps = fps
+        self.delta = 1000 / fps
+        self.paced = False
+        self.grid = None
+        self.frame_times = []
+        self.cells_drawn = 0
+        self._frames_counted = 0
+
+    def start(self, grid):
+        grid.start_headless(synchronous=False)
+        grid.enable_frame_stats(STATS_FRAMES)
+        self.grid = grid
+        return grid
+
+    def reset(self):
+        # forget everything measured so far, e.g. during setup
+        self.frame_times = []
+        self.cells_drawn = 0
+        self._frames_counted = 0
+        self.grid.enable_frame_stats(STATS_FRAMES)
+
+    def stop(self):
+        self._count_draws()
+        self.grid.close()
+
+    def frame(self, action=None):
+        # runs action, if given, then a single frame of the event loop.
+        # both are included in the frame time
+        grid = self.grid
+        start = time.perf_counter()
+        if action:
+            action()
+        grid._handle_events()
+        grid._handle_mouse_motion()
+        grid._update(self.delta)
+        self.frame_times.append(time.perf_counter() - start)
+        if len(self.frame_times) - self._frames_counted >= STATS_FRAMES:
+            self._count_draws()
+        if self.paced:
+            self.delta = grid._clock.tick(self.fps)
+        else:
+            grid._clock.tick()
+
+    def frames(self, n_frames, action=None):
+        for frame in range(n_frames):
+            self.frame(action)
+
+    def frames_until(self, done, max_frames=10000):
+        # runs frames until done() returns True
+        for frame in range(max_frames):
+            if done():
+                return
+            self.frame()
+
+    def results(self):
+        times = np.array(self.frame_times) * 1000
+        total = times.sum() / 1000
+        return {
+            "frames": len(times),
+            "total_s": round(float(total), 4),
+            "frame_ms": {
+                "mean": round(float(times.mean()), 4),
+                "p50": round(float(np.percentile(times, 50)), 4),
+                "p90": round(float(np.percentile(times, 90)), 4),
+                "p99": round(float(np.percentile(times, 99)), 4),
+                "max": round(float(times.max()), 4),
+            },
+            "cells_drawn": self.cells_drawn,
+            "cells_per_second": round(self.cells_drawn / total) if total else 0,
+        }
+
+    def _count_draws(self):
+        # adds up the cells drawn in the frames recorded since last time
+        stats = self.grid.get_frame_stats()
+        for frame in stats["frames"]:
+            if frame["frame"] >= self._frames_counted:
+                self.cells_drawn += frame["cells_drawn"]
+        self._frames_counted = len(self.frame_times)
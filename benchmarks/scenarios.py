@@ -0,0 +1,142 @@
+import importlib
+import numpy as np
+
+from config import config
+from pygrid import PyGrid
+from gameoflife import GameOfLifeGrid
+from input_recording import InputPlayer
+
+# each scenario sets a grid up, resets the benchmark, then runs frames.
+# only the frames are timed, but setup counts towards peak memory.
+# random data is seeded so that every run does the same work
+
+WIDTH = 1280
+HEIGHT = 720
+COLORS = [
+    config["cell_color"], config["red"], config["green"], config["blue"],
+    config["yellow"], config["magenta"], config["cyan"]
+]
+
+
+def _create_grid(**kwargs):
+    return PyGrid(
+        width=WIDTH, height=HEIGHT,
+        background_color=config["background_color"],
+        grid_color=config["grid_color"],
+        allowed_resize=False,
+        **kwargs
+    )
+
+
+def _fill(grid, size, density=1.0, seed=0, colors=COLORS):
+    # draws a size x size field of randomly colored cells, centred on 0, 0
+    rng = np.random.default_rng(seed)
+    xs, ys = np.meshgrid(np.arange(size), np.arange(size), indexing="ij")
+    cells = np.stack((xs.ravel(), ys.ravel()), axis=1) - size // 2
+    cells = cells[rng.random(len(cells)) < density]
+    choices = rng.integers(len(colors), size=len(cells))
+    for i, color in enumerate(colors):
+        grid.draw_cells(cells[choices == i], color)
+    return cells
+
+
+def pan(bench):
+    # flick-panning across a field of a million cells, in eight directions,
+    # letting each flick slow to a stop before the next
+    grid = bench.start(_create_grid(cell_size=8))
+    _fill(grid, 1000)
+    bench.reset()
+
+    for direction in range(8):
+        angle = direction * np.pi / 4
+        grid._x_vel = 4000 * np.cos(angle)
+        grid._y_vel = 4000 * np.sin(angle)
+        bench.frames_until(lambda: not (grid._x_vel or grid._y_vel))
+
+
+def zoom(bench):
+    # wheel-zooming from the largest cell size to the smallest and back,
+    # one scroll step per frame, over a field of a million cells
+    grid = bench.start(_create_grid(
+        cell_size=100, min_cell_size=1, max_cell_size=100
+    ))
+    _fill(grid, 1000, density=0.5)
+    bench.reset()
+
+    x, y = WIDTH // 2, HEIGHT // 2
+    while grid._cell_size > grid._min_cell_size:
+        bench.frame(lambda: grid._zoom(x, y, 0.9))
+    while grid._cell_size < grid._max_cell_size:
+        bench.frame(lambda: grid._zoom(x, y, 1.1))
+
+
+def fade(bench):
+    # ten thousand cells fading in, then fading back out
+    grid = bench.start(_create_grid(cell_size=6))
+    xs, ys = np.meshgrid(np.arange(-50, 50), np.arange(-50, 50))
+    cells = np.stack((xs.ravel(), ys.ravel()), axis=1)
+    bench.reset()
+
+    bench.frame(lambda: grid.draw_cells(
+        cells, config["cell_color"], animation=(0.5, 0)
+    ))
+    bench.frames_until(lambda: not grid._animated_cells)
+    bench.frame(lambda: grid.erase_cells(cells, animation=(0.5, 0)))
+    bench.frames_until(lambda: not grid._animated_cells)
+
+
+def life(bench):
+    # a game of life in a worker process, starting from a random 200 x 200
+    # soup
+    grid = bench.start(GameOfLifeGrid(
+        config["background_color"], config["grid_color"],
+        config["cell_color"], config["grid_percentage"], config["fps"]
+    ))
+    grid.speed_index = 4
+    grid.set_timer(grid.iteration_delay)
+
+    cells = _fill(
+        grid, 200, density=0.35, seed=1, colors=[config["cell_color"]]
+    )
+    for cell_x, cell_y in cells.tolist():
+        grid.add_cell(cell_x, cell_y)
+    bench.reset()
+
+    bench.paced = True
+    grid.play()
+    bench.frames(300)
+
+
+# the module each program's create_grid() lives in, for replays
+PROGRAMS = {
+    "GameOfLifeGrid": "gameoflife",
+    "PathfindingGrid": "pathfinding",
+    "SnakeGrid": "snake",
+    "TetrisGrid": "tetris",
+}
+
+
+def replay(bench, path):
+    # a session recorded from one of the programs, replayed frame by frame
+    player = InputPlayer(path, bench.delta)
+    program = player.header["program"]
+    if program not in PROGRAMS:
+        raise ValueError(f"{path} was recorded from {program}, "
+                         "which the benchmarks don't know how to create")
+
+    grid = importlib.import_module(PROGRAMS[program]).create_grid()
+    grid._prepare_replay(player)
+    bench.start(grid)
+    bench.reset()
+
+    for frame in range(player.n_frames):
+        player.frame = frame
+        bench.frame()
+
+
+SCENARIOS = {
+    "pan": pan,
+    "zoom": zoom,
+    "fade": fade,
+    "life": life,
+}
@@ -0,0 +1,71 @@
+import numpy as np
+
+# the cells the timer thread changed during one tick.
+# the thread never writes to the cell store or the draw queue itself. it
+# fills one of these, and hands it over once the tick is finished, then the
+# main thread writes every change to the store in one batch and queues the
+# visible ones to be drawn. so the main thread never sees half a tick, and
+# nothing it reads while drawing changes underneath it.
+# erased cells are recorded with index 0
+
+
+class ChangeBuffer:
+    def __init__(self):
+        self._xs = []
+        self._ys = []
+        self._indices = []
+        self._batches = []
+        self.n_changes = 0
+
+    def __len__(self):
+        return self.n_changes
+
+    def __bool__(self):
+        return bool(self.n_changes)
+
+    def add(self, cell_x, cell_y, index):
+        self._xs.append(cell_x)
+        self._ys.append(cell_y)
+        self._indices.append(index)
+        self.n_changes += 1
+
+    def add_many(self, xs, ys, indices):
+        # indices is an array, or a single index for every cell
+        if not np.ndim(indices):
+            indices = np.full(len(xs), indices, dtype=np.uint16)
+
+        # single changes made before these have to stay before them
+        self._flush()
+        self._batches.append((xs, ys, indices))
+        self.n_changes += len(xs)
+
+    def _flush(self):
+        if self._xs:
+            self._batches.append((
+                np.array(self._xs, dtype=np.int64),
+                np.array(self._ys, dtype=np.int64),
+                np.array(self._indices, dtype=np.uint16)
+            ))
+            self._xs = []
+            self._ys = []
+            self._indices = []
+
+    def arrays(self):
+        # the changes as xs, ys and indices arrays, with only the last
+        # change to each cell kept. called by the timer thread once the
+        # tick is finished, so the main thread has less to do
+        self._flush()
+        if not self._batches:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0, dtype=np.uint16)
+
+        xs, ys, indices = zip(*self._batches)
+        xs = np.concatenate(xs)
+        ys = np.concatenate(ys)
+        indices = np.concatenate(indices).astype(np.uint16)
+        self._batches = [(xs, ys, indices)]
+
+        keys = (xs << 32) | (ys & 0xFFFFFFFF)
+        _, last = np.unique(keys[::-1], return_index=True)
+        last = len(keys) - 1 - last
+        return xs[last], ys[last], indices[last]
@@ -0,0 +1,86 @@
+import mmap
+import tempfile
+import numpy as np
+
+# chunks that the chunk store pages out are kept in a memory-mapped file
+# rather than in memory. the file is split into slots of one chunk each,
+# and grows by doubling when every slot is taken. slots are reused once
+# their chunk is paged back in. each slot's cell count and version are kept
+# in memory, in arrays alongside the map.
+# the file is a temporary one, deleted when it is closed or the program
+# exits. directory is where it is made, which should be on a local disk
+
+
+class ChunkPager:
+    def __init__(self, chunk_size, directory=None, capacity=1024):
+        self._chunk_size = chunk_size
+        self._slot_bytes = chunk_size * chunk_size * 2
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self._map = None
+        self._slots = None
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._versions = np.zeros(0, dtype=np.int64)
+        self._free = []
+        self._n_slots = 0
+        self.capacity = 0
+        self._resize(capacity)
+
+    def __len__(self):
+        # the number of slots holding a chunk
+        return self._n_slots - len(self._free)
+
+    def _resize(self, capacity):
+        # the old view has to go before the map can be closed
+        self._slots = None
+        if self._map is not None:
+            self._map.close()
+
+        size = capacity * self._slot_bytes
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._slots = np.frombuffer(self._map, dtype=np.uint16).reshape(
+            capacity, self._chunk_size, self._chunk_size
+        )
+        self._counts = np.resize(self._counts, capacity)
+        self._versions = np.resize(self._versions, capacity)
+        self.capacity = capacity
+
+    def write(self, cells, count, version):
+        # stores a chunk, returning the slot it went in
+        if self._free:
+            slot = self._free.pop()
+        else:
+            if self._n_slots == self.capacity:
+                self._resize(self.capacity * 2)
+            slot = self._n_slots
+            self._n_slots += 1
+        self._slots[slot] = cells
+        self._counts[slot] = count
+        self._versions[slot] = version
+        return slot
+
+    def read(self, slot):
+        # a copy of the cells in slot, and their count and version.
+        # the slot is left as it is
+        return (
+            self._slots[slot].copy(),
+            int(self._counts[slot]),
+            int(self._versions[slot])
+        )
+
+    def free(self, slot):
+        self._free.append(slot)
+
+    def clear(self):
+        self._free = []
+        self._n_slots = 0
+
+    def file_bytes(self):
+        return self.capacity * self._slot_bytes
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._slots = None
+        self._map.close()
+        self._file.close()
@@ -0,0 +1,488 @@
+import heapq
+import threading
+import numpy as np
+
+from chunk_pager import ChunkPager
+
+# cells are grouped into square chunks of chunk_size x chunk_size.
+# each chunk is a fixed size array of palette indices rather than a dict
+# of cells, so a dense chunk costs a few hundred bytes instead of a few
+# kilobytes. index 0 means the cell is empty.
+# arrays are indexed [local_x, local_y], the same layout as pygame.surfarray.
+# with max_resident set, at most that many chunks are kept in memory once
+# page_out() has run. the least recently used chunks, other than those the
+# caller is drawing, are moved to a memory-mapped file, and paged back in
+# whenever they are used again. that happens in here, so callers never
+# see the difference.
+# once take_changes() has been called, the store records what it changes
+# for history.py. the first write to a chunk keeps the chunk as it was and
+# writes to a copy, so that the old chunk can be swapped back in later.
+# the chunks kept are never paged out, so recording stops once they pass
+# the limit take_changes() was given
+
+
+class Chunk:
+    __slots__ = ("cells", "count", "version", "used")
+
+    def __init__(self, size):
+        self.cells = np.zeros((size, size), dtype=np.uint16)
+        self.count = 0
+
+        # changes every time a cell in the chunk is written.
+        # anything derived from the chunk, such as a rendered tile,
+        # is stale once the version differs
+        self.version = 0
+
+        # the last page_out() epoch the chunk was used in
+        self.used = 0
+
+
+class ChunkStore:
+    def __init__(self, chunk_size=16, max_resident=None, page_dir=None):
+        # chunk size must be a power of two so that
+        # cell -> chunk lookups can be done with shifts and masks
+        if chunk_size & (chunk_size - 1):
+            raise ValueError("chunk_size must be a power of two")
+
+        self.chunk_size = chunk_size
+        self._shift = chunk_size.bit_length() - 1
+        self._mask = chunk_size - 1
+        self._chunks = {}
+        self._n_cells = 0
+        self._version = 0
+
+        # the slots of the chunks on disk, by key. page_out()
+        # only runs until there are low_water chunks left, so that it
+        # doesn't have to run every frame once the store is full
+        self.max_resident = max_resident
+        self._low_water = int(max_resident * 0.75) if max_resident else 0
+        self._paged = {}
+        self._pager = None
+        if max_resident is not None:
+            self._pager = ChunkPager(chunk_size, page_dir)
+        self._epoch = 0
+        self.page_ins = 0
+        self.page_outs = 0
+
+        # chunks can be read from the timer thread
+        self._paging_lock = threading.Lock()
+
+        # while recording, the chunks as they were before they were first
+        # written to, by key. chunks that didn't exist are None
+        self._before = None
+        self._before_bytes = 0
+        self._max_before_bytes = None
+
+    def __len__(self):
+        return self._n_cells
+
+    def __iter__(self):
+        # iterate over (chunk_x, chunk_y), chunk pairs.
+        # chunks on disk are read without paging them in, so that going
+        # over a large store doesn't fill memory. they are copies, so
+        # writing to them does nothing
+        yield from tuple(self._chunks.items())
+        for key, slot in tuple(self._paged.items()):
+            yield key, self._read_paged(slot)
+
+    @property
+    def paging(self):
+        return self._pager is not None
+
+    def clear(self):
+        if self._before is not None:
+            for key, chunk in self._chunks.items():
+                if self._before is None:
+                    break
+                if key not in self._before:
+                    self._keep(key, chunk)
+            for key, slot in self._paged.items():
+                if self._before is None:
+                    break
+                if key not in self._before:
+                    self._keep(key, self._read_paged(slot))
+
+        self._chunks = {}
+        self._n_cells = 0
+        self._paged = {}
+        if self._pager is not None:
+            self._pager.clear()
+
+    def _get(self, key):
+        # the chunk at key, paging it in if it's on disk.
+        # page_out() moves chunks from one dict to the other while the
+        # timer thread may be reading, so with paging on, both are only
+        # looked at with the lock held
+        if self._pager is not None:
+            with self._paging_lock:
+                return self._page_in(key)
+
+        chunk = self._chunks.get(key, None)
+        if chunk is not None:
+            chunk.used = self._epoch
+        return chunk
+
+    def _get_writable(self, key):
+        # the same as _get, for a chunk that is about to be written to
+        chunk = self._get(key)
+        before = self._before
+        if before is None or key in before:
+            return chunk
+
+        self._keep(key, chunk)
+        if chunk is not None and self._before is not None:
+            copy = Chunk.__new__(Chunk)
+            copy.cells = chunk.cells.copy()
+            copy.count = chunk.count
+            copy.version = chunk.version
+            copy.used = chunk.used
+            self._chunks[key] = copy
+            chunk = copy
+        return chunk
+
+    def _keep(self, key, chunk):
+        self._before[key] = chunk
+        if chunk is None:
+            return
+        self._before_bytes += chunk.cells.nbytes
+        if self._max_before_bytes is not None \
+                and self._before_bytes > self._max_before_bytes:
+            self.stop_recording()
+
+    @property
+    def recording(self):
+        return self._before is not None
+
+    def take_changes(self, max_bytes=None):
+        # the chunks as they were before everything written since the last
+        # call, or None the first time or if recording stopped, and starts
+        # recording again. recording stops once the chunks kept are more
+        # than max_bytes
+        before = self._before
+        self._before = {}
+        self._before_bytes = 0
+        self._max_before_bytes = max_bytes
+        return before
+
+    def stop_recording(self):
+        self._before = None
+        self._before_bytes = 0
+
+    def has_changes(self):
+        # whether any chunk written to since take_changes() is different
+        # now. a cell drawn and erased again doesn't count
+        for key, before in (self._before or {}).items():
+            chunk = self._get(key)
+            if chunk is None or before is None:
+                if chunk is not before:
+                    return True
+            elif not np.array_equal(chunk.cells, before.cells):
+                return True
+        return False
+
+    def changes_bytes(self):
+        # the size of the cells kept since take_changes()
+        return self._before_bytes
+
+    def swap_chunks(self, chunks):
+        # puts chunks, by key, in place of the ones in the store, with None
+        # removing a chunk. returns the chunks they replaced, the same way.
+        # this isn't recorded
+        replaced = {}
+        for key, chunk in chunks.items():
+            old = self._get(key)
+            replaced[key] = old
+            if old is not None:
+                self._n_cells -= old.count
+                del self._chunks[key]
+            if chunk is not None:
+                chunk.used = self._epoch
+                self._chunks[key] = chunk
+                self._n_cells += chunk.count
+        return replaced
+
+    def _page_in(self, key):
+        # called with the paging lock held
+        chunk = self._chunks.get(key, None)
+        if chunk is not None:
+            chunk.used = self._epoch
+            return chunk
+
+        slot = self._paged.pop(key, None)
+        if slot is None:
+            return None
+
+        chunk = self._read_paged(slot)
+        chunk.used = self._epoch
+        self._chunks[key] = chunk
+        self._pager.free(slot)
+        self.page_ins += 1
+        return chunk
+
+    def _read_paged(self, slot):
+        chunk = Chunk.__new__(Chunk)
+        chunk.cells, chunk.count, chunk.version = self._pager.read(slot)
+        chunk.used = 0
+        return chunk
+
+    def page_out(self, keep=None):
+        # called once a frame. starts a new epoch, and if there are more
+        # than max_resident chunks in memory, writes the least recently used
+        # ones to disk until there are low_water left. chunks overlapping
+        # keep, (x_start, x_end, y_start, y_end), stay in memory
+        self._epoch += 1
+        if self._pager is None or len(self._chunks) <= self.max_resident:
+            return
+
+        with self._paging_lock:
+            if keep is None:
+                candidates = [
+                    (chunk.used, key) for key, chunk in self._chunks.items()
+                ]
+            else:
+                x_start, x_end, y_start, y_end = keep
+                chunk_x_start = x_start >> self._shift
+                chunk_x_end = (x_end - 1) >> self._shift
+                chunk_y_start = y_start >> self._shift
+                chunk_y_end = (y_end - 1) >> self._shift
+                candidates = [
+                    (chunk.used, key) for key, chunk in self._chunks.items()
+                    if not (chunk_x_start <= key[0] <= chunk_x_end
+                            and chunk_y_start <= key[1] <= chunk_y_end)
+                ]
+
+            n_evicted = len(self._chunks) - self._low_water
+            for used, key in heapq.nsmallest(n_evicted, candidates):
+                chunk = self._chunks.pop(key)
+                self._paged[key] = self._pager.write(
+                    chunk.cells, chunk.count, chunk.version
+                )
+            self.page_outs += min(n_evicted, len(candidates))
+
+    def paging_stats(self):
+        chunk_bytes = self.chunk_size * self.chunk_size * 2
+        file_bytes = 0
+        if self._pager is not None:
+            file_bytes = self._pager.file_bytes()
+        return {
+            "resident": len(self._chunks),
+            "resident_bytes": len(self._chunks) * chunk_bytes,
+            "paged": len(self._paged),
+            "file_bytes": file_bytes,
+            "page_ins": self.page_ins,
+            "page_outs": self.page_outs,
+        }
+
+    def close(self):
+        # deletes the page file. chunks on disk are lost
+        if self._pager is not None:
+            self._pager.close()
+
+    def get_chunk(self, chunk_x, chunk_y):
+        return self._get((chunk_x, chunk_y))
+
+    def get(self, cell_x, cell_y):
+        chunk = self._get((cell_x >> self._shift, cell_y >> self._shift))
+        if chunk is None:
+            return 0
+        return int(chunk.cells[cell_x & self._mask, cell_y & self._mask])
+
+    def set(self, cell_x, cell_y, index):
+        # returns the index the cell held before
+        key = (cell_x >> self._shift, cell_y >> self._shift)
+        chunk = self._get_writable(key)
+        if chunk is None:
+            chunk = Chunk(self.chunk_size)
+            chunk.used = self._epoch
+            self._chunks[key] = chunk
+
+        local_x = cell_x & self._mask
+        local_y = cell_y & self._mask
+        old_index = int(chunk.cells[local_x, local_y])
+        if not old_index:
+            chunk.count += 1
+            self._n_cells += 1
+        chunk.cells[local_x, local_y] = index
+        self._touch(chunk)
+        return old_index
+
+    def delete(self, cell_x, cell_y):
+        # returns the index the cell held before, 0 if it was already empty
+        key = (cell_x >> self._shift, cell_y >> self._shift)
+        chunk = self._get(key)
+        if chunk is None:
+            return 0
+
+        local_x = cell_x & self._mask
+        local_y = cell_y & self._mask
+        old_index = int(chunk.cells[local_x, local_y])
+        if not old_index:
+            return 0
+
+        chunk = self._get_writable(key)
+
+        chunk.cells[local_x, local_y] = 0
+        chunk.count -= 1
+        self._n_cells -= 1
+        self._touch(chunk)
+
+        # empty chunks are dropped so that they aren't iterated when drawing
+        if not chunk.count:
+            del self._chunks[key]
+        return old_index
+
+    def _touch(self, chunk):
+        self._version += 1
+        chunk.version = self._version
+
+    def _group_by_chunk(self, xs, ys):
+        # yields (chunk key, local xs, local ys, positions) for every chunk
+        # touched by the given cells. positions index back into xs/ys and
+        # keep their original order, so later writes to a cell win
+        chunk_xs = xs >> self._shift
+        chunk_ys = ys >> self._shift
+        keys = (chunk_xs << 32) | (chunk_ys & 0xFFFFFFFF)
+
+        unique_keys, inverse, counts = np.unique(
+            keys, return_inverse=True, return_counts=True
+        )
+        order = np.argsort(inverse, kind="stable")
+        local_xs = (xs & self._mask)[order]
+        local_ys = (ys & self._mask)[order]
+
+        start = 0
+        for key, count in zip(unique_keys.tolist(), counts.tolist()):
+            end = start + count
+            chunk_y = key & 0xFFFFFFFF
+            if chunk_y >= 0x80000000:
+                chunk_y -= 0x100000000
+            yield (
+                (key >> 32, chunk_y),
+                local_xs[start:end],
+                local_ys[start:end],
+                order[start:end]
+            )
+            start = end
+
+    def get_many(self, xs, ys):
+        indices = np.zeros(len(xs), dtype=np.uint16)
+        for key, local_xs, local_ys, positions in self._group_by_chunk(xs, ys):
+            chunk = self._get(key)
+            if chunk is not None:
+                indices[positions] = chunk.cells[local_xs, local_ys]
+        return indices
+
+    def set_many(self, xs, ys, indices, unique=False):
+        # xs and ys are int64 arrays. indices is either an array the same
+        # length as xs, or a single index used for every cell.
+        # unique says that no cell appears twice, so there is no need to
+        # work out which write to each cell comes last
+        scalar = np.ndim(indices) == 0
+        for key, local_xs, local_ys, positions in self._group_by_chunk(xs, ys):
+            chunk = self._get_writable(key)
+            if chunk is None:
+                chunk = Chunk(self.chunk_size)
+                chunk.used = self._epoch
+                self._chunks[key] = chunk
+
+            if scalar:
+                chunk.cells[local_xs, local_ys] = indices
+            elif unique:
+                chunk.cells[local_xs, local_ys] = indices[positions]
+            else:
+                # numpy doesn't guarantee which of several writes to the
+                # same element wins, so only keep the last write per cell
+                flat = local_xs * self.chunk_size + local_ys
+                _, last = np.unique(flat[::-1], return_index=True)
+                last = len(flat) - 1 - last
+                chunk.cells[local_xs[last], local_ys[last]] = \
+                    indices[positions[last]]
+            self._touch(chunk)
+
+            count = np.count_nonzero(chunk.cells)
+            self._n_cells += count - chunk.count
+            chunk.count = count
+
+            if not count:
+                del self._chunks[key]
+
+    def delete_many(self, xs, ys):
+        for key, local_xs, local_ys, _ in self._group_by_chunk(xs, ys):
+            chunk = self._get_writable(key)
+            if chunk is None:
+                continue
+
+            chunk.cells[local_xs, local_ys] = 0
+            self._touch(chunk)
+
+            count = np.count_nonzero(chunk.cells)
+            self._n_cells += count - chunk.count
+            chunk.count = count
+
+            if not count:
+                del self._chunks[key]
+
+    def chunks_in_region(self, x_start, x_end, y_start, y_end):
+        # yields (chunk_x, chunk_y, chunk) for every stored chunk overlapping
+        # x_start <= cell_x < x_end and y_start <= cell_y < y_end
+        for chunk_y in range(y_start >> self._shift,
+                             ((y_end - 1) >> self._shift) + 1):
+            for chunk_x in range(x_start >> self._shift,
+                                 ((x_end - 1) >> self._shift) + 1):
+                chunk = self._get((chunk_x, chunk_y))
+                if chunk is not None:
+                    yield chunk_x, chunk_y, chunk
+
+    def cells_in_chunk(self, chunk_x, chunk_y, chunk,
+                       x_start, x_end, y_start, y_end):
+        # yields (cell_x, cell_y, index) for every stored cell in chunk
+        # that lies within the given region
+        base_x = chunk_x << self._shift
+        base_y = chunk_y << self._shift
+        local_x_start = max(x_start - base_x, 0)
+        local_x_end = min(x_end - base_x, self.chunk_size)
+        local_y_start = max(y_start - base_y, 0)
+        local_y_end = min(y_end - base_y, self.chunk_size)
+
+        cells = chunk.cells[local_x_start:local_x_end,
+                            local_y_start:local_y_end]
+        xs, ys = np.nonzero(cells)
+        if not len(xs):
+            return
+
+        base_x += local_x_start
+        base_y += local_y_start
+        for x, y, index in zip(xs.tolist(), ys.tolist(),
+                               cells[xs, ys].tolist()):
+            yield base_x + x, base_y + y, index
+
+    def count_in_region(self, x_start, x_end, y_start, y_end):
+        # the number of stored cells with x_start <= cell_x < x_end and
+        # y_start <= cell_y < y_end. chunks wholly inside the region
+        # aren't looked at
+        count = 0
+        for chunk_x, chunk_y, chunk in self.chunks_in_region(
+                x_start, x_end, y_start, y_end):
+            base_x = chunk_x << self._shift
+            base_y = chunk_y << self._shift
+            if x_start <= base_x and base_x + self.chunk_size <= x_end \
+                    and y_start <= base_y \
+                    and base_y + self.chunk_size <= y_end:
+                count += chunk.count
+            else:
+                count += np.count_nonzero(chunk.cells[
+                    max(x_start - base_x, 0):x_end - base_x,
+                    max(y_start - base_y, 0):y_end - base_y
+                ])
+        return int(count)
+
+    def cells_in_region(self, x_start, x_end, y_start, y_end):
+        # yields (cell_x, cell_y, index) for every stored cell with
+        # x_start <= cell_x < x_end and y_start <= cell_y < y_end.
+        # only the chunks overlapping the region are visited
+        for chunk_x, chunk_y, chunk in self.chunks_in_region(
+                x_start, x_end, y_start, y_end):
+            yield from self.cells_in_chunk(
+                chunk_x, chunk_y, chunk,
+                x_start, x_end, y_start, y_end
+            )
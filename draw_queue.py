@@ -0,0 +1,46 @@
+from collections import OrderedDict
+
+# cells waiting to be drawn by the main thread, in the order they were queued.
+# queueing and popping are both O(1).
+# if a cell is queued again before it has been drawn, it keeps its place in
+# the queue but takes the latest color, since the earlier one would only be
+# drawn over anyway.
+
+
+class DrawQueue:
+    def __init__(self):
+        self._cells = OrderedDict()
+        self.n_queued = 0
+        self.n_coalesced = 0
+
+    def __len__(self):
+        return len(self._cells)
+
+    def __bool__(self):
+        return bool(self._cells)
+
+    def push(self, cell_x, cell_y, color):
+        cell = (cell_x, cell_y)
+        if cell in self._cells:
+            self.n_coalesced += 1
+        self._cells[cell] = color
+        self.n_queued += 1
+
+    def extend(self, cells):
+        for cell_x, cell_y, color in cells:
+            self.push(cell_x, cell_y, color)
+
+    def pop(self):
+        (cell_x, cell_y), color = self._cells.popitem(last=False)
+        return cell_x, cell_y, color
+
+    def clear(self):
+        self._cells.clear()
+
+    def discard_chunks(self, keys, shift):
+        # drops the cells in the chunks at keys, e.g. because those chunks
+        # are about to be drawn again from the store
+        self._cells = OrderedDict(
+            (cell, color) for cell, color in self._cells.items()
+            if (cell[0] >> shift, cell[1] >> shift) not in keys
+        )
@@ -0,0 +1,171 @@
+import csv
+import json
+import time
+import numpy as np
+
+# per-frame timings of each phase of the event loop, and counts of the work
+# done in the frame, kept in a ring buffer of the most recent frames.
+# PyGrid only creates one of these while stats are enabled, and swaps timed
+# wrappers in for the phase methods, so nothing is measured otherwise.
+PHASES = (
+    "events", "mouse_motion", "velocity", "animate",
+    "draw_queue", "lod", "timer", "present", "overscan"
+)
+COUNTERS = (
+    "cells_drawn", "draw_calls", "rects", "animations", "queue_depth",
+    "degraded"
+)
+
+CELLS_DRAWN = 0
+DRAW_CALLS = 1
+RECTS = 2
+ANIMATIONS = 3
+QUEUE_DEPTH = 4
+DEGRADED = 5
+
+
+class FrameStats:
+    def __init__(self, capacity=600, dump_path=None, dump_interval=5):
+        self.capacity = capacity
+
+        # the frame being recorded. phase times are in seconds
+        self.times = [0.0] * len(PHASES)
+        self.counts = [0] * len(COUNTERS)
+
+        self._phase_times = np.zeros((capacity, len(PHASES)))
+        self._frame_times = np.zeros(capacity)
+        self._counts = np.zeros((capacity, len(COUNTERS)), dtype=np.int64)
+        self._n_frames = 0
+        self._last_frame_end = None
+
+        # the whole buffer is written to dump_path every dump_interval
+        # seconds, as csv or json depending on its extension
+        self._dump_path = dump_path
+        self._dump_interval = dump_interval
+        self._last_dump = time.perf_counter()
+
+    def __len__(self):
+        return min(self._n_frames, self.capacity)
+
+    def skip_idle(self):
+        # the time until the next frame ends was spent waiting for input,
+        # so only the work that frame does counts as its frame time
+        self._last_frame_end = None
+
+    def start_frame(self):
+        # the frame starts now, rather than when the last one ended, so
+        # its frame time doesn't include waiting for it, e.g. in a replay
+        self._last_frame_end = time.perf_counter()
+
+    def end_frame(self, animations, queue_depth):
+        # frame time is from the end of the last frame to the end of this
+        # one, so it includes waiting for the next frame
+        now = time.perf_counter()
+        if self._last_frame_end is None:
+            frame_time = sum(self.times)
+        else:
+            frame_time = now - self._last_frame_end
+        self._last_frame_end = now
+
+        self.counts[ANIMATIONS] = animations
+        self.counts[QUEUE_DEPTH] = queue_depth
+
+        row = self._n_frames % self.capacity
+        self._phase_times[row] = self.times
+        self._frame_times[row] = frame_time
+        self._counts[row] = self.counts
+        self._n_frames += 1
+
+        self.times = [0.0] * len(PHASES)
+        self.counts = [0] * len(COUNTERS)
+
+        if self._dump_path and now - self._last_dump >= self._dump_interval:
+            self._last_dump = now
+            self.dump(self._dump_path)
+
+    def _ordered(self, array):
+        # rows of a ring buffer array, oldest first
+        n = len(self)
+        if self._n_frames <= self.capacity:
+            return array[:n]
+        return np.roll(array, -(self._n_frames % self.capacity), axis=0)
+
+    def frames(self):
+        # every recorded frame as a dict, oldest first. times are in ms
+        first = self._n_frames - len(self)
+        phase_times = self._ordered(self._phase_times) * 1000
+        frame_times = self._ordered(self._frame_times) * 1000
+        counts = self._ordered(self._counts)
+
+        frames = []
+        for i in range(len(self)):
+            frame = {"frame": first + i, "frame_ms": float(frame_times[i])}
+            for phase, value in zip(PHASES, phase_times[i].tolist()):
+                frame[phase + "_ms"] = value
+            for counter, value in zip(COUNTERS, counts[i].tolist()):
+                frame[counter] = value
+            frames.append(frame)
+        return frames
+
+    def summary(self, n_frames=None):
+        # mean and percentiles of each phase, over the last n_frames
+        n = len(self) if n_frames is None else min(n_frames, len(self))
+        if not n:
+            return {"frames": 0}
+
+        phase_times = self._ordered(self._phase_times)[-n:] * 1000
+        frame_times = self._ordered(self._frame_times)[-n:] * 1000
+        counts = self._ordered(self._counts)[-n:]
+
+        def describe(values):
+            return {
+                "mean": float(values.mean()),
+                "p50": float(np.percentile(values, 50)),
+                "p99": float(np.percentile(values, 99)),
+                "max": float(values.max()),
+            }
+
+        return {
+            "frames": n,
+            "frame_ms": describe(frame_times),
+            "phases_ms": {
+                phase: describe(phase_times[:, i])
+                for i, phase in enumerate(PHASES)
+            },
+            "counters": {
+                counter: float(counts[:, i].mean())
+                for i, counter in enumerate(COUNTERS)
+            },
+        }
+
+    def dump(self, path):
+        frames = self.frames()
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=[
+                    "frame", "frame_ms", *(phase + "_ms" for phase in PHASES),
+                    *COUNTERS
+                ])
+                writer.writeheader()
+                writer.writerows(frames)
+        else:
+            with open(path, "w") as f:
+                json.dump(
+                    {"summary": self.summary(), "frames": frames}, f, indent=4
+                )
+
+    def hud_lines(self, n_frames=30):
+        # a short text summary of the last n_frames, for drawing on screen
+        summary = self.summary(n_frames)
+        if not summary["frames"]:
+            return []
+
+        frame_ms = summary["frame_ms"]
+        lines = [
+            f"frame {frame_ms['mean']:6.2f} ms  p99 {frame_ms['p99']:6.2f}"
+        ]
+        for phase, times in summary["phases_ms"].items():
+            lines.append(f"{phase:<13}{times['mean']:6.2f} ms")
+        for counter, mean in summary["counters"].items():
+            lines.append(f"{counter:<13}{mean:9.1f}")
+        return lines
@@ -1,73 +1,24 @@
+import os
 from draw_grid import DrawGrid
+from simulation import Simulation
+from timers import CATCH_UP
 from collections import defaultdict
 from keycodes import *
 
 
-class GameOfLifeGrid(DrawGrid):
-    def __init__(self, background_color, grid_color, cell_color, grid_percentage, fps):
-        DrawGrid.__init__(
-            self,
-            draw_buttons=(LEFT_MOUSE, RIGHT_MOUSE),
-            background_color=background_color,
-            grid_color=grid_color,
-            grid_percentage=grid_percentage,
-            fps=fps
-        )
-
-        self.animation = (0.1, 1)
-        self.paused = True
-        self.resetting = False
+class LifeSimulation(Simulation):
+    # the universe, which lives in a worker process while the simulation
+    # is running, so a big one doesn't slow down panning and zooming
+    def __init__(self, cell_color):
         self.cell_color = cell_color
-
-        # rather than a high speed just having a low delay,
-        # it can have a fairly low delay but combined with multiple iterations
-
-        # the iterations_per_tick are odd to make the animations seem less blocky
-        # this is because game of life repititions are generally even
-        self.speed_index = 3
-        self.iteration_delays     = [1, 0.5, 0.25, 0.1, 0.05, 0.04, 0.04, 0.04, 0.05]
-        self.iterations_per_ticks = [1, 1,   1,    1,      1,    3,    5,    11,  15]
-
-        self.set_timer(self.iteration_delay)
-
-        self.change_list = []
-        self.alive_cells = set()
-        self.neighbours = defaultdict(int)
-
-    def on_timer_end(self):
-        if self.resetting:
-            self.reset()
-        self.paused = True
+        self.iterations_per_tick = 1
+        self.reset()
 
     def reset(self):
-        self.clear()
-        self.resetting = False
         self.change_list = []
         self.alive_cells = set()
         self.neighbours = defaultdict(int)
 
-    @property
-    def iteration_delay(self):
-        return self.iteration_delays[self.speed_index]
-
-    @property
-    def iterations_per_tick(self):
-        return self.iterations_per_ticks[self.speed_index]
-
-    def on_mouse_event(self, cell_x, cell_y, button, pressed):
-        if not self.paused:
-            return
-
-        if button == LEFT_MOUSE:
-            if (cell_x, cell_y) not in self.alive_cells:
-                self.draw_cell(cell_x, cell_y, self.cell_color, animation=self.animation)
-                self.add_cell(cell_x, cell_y)
-
-        elif button == RIGHT_MOUSE:
-            if (cell_x, cell_y) in self.alive_cells:
-                self.erase_cell(cell_x, cell_y, animation=self.animation)
-                self.delete_cell(cell_x, cell_y)
-
     def do_iteration(self):
         cells_to_delete = set()
         cells_to_add = set()
@@ -90,7 +41,7 @@ class GameOfLifeGrid(DrawGrid):
     def on_timer(self, n_ticks):
         cells_to_draw = {}
 
-        for iteration in range(self.iterations_per_tick):
+        for iteration in range(self.iterations_per_tick * n_ticks):
             cells_to_add, cells_to_delete = self.do_iteration()
 
             self.change_list = []
@@ -103,11 +54,13 @@ class GameOfLifeGrid(DrawGrid):
                 self.delete_cell(cell_x, cell_y)
                 cells_to_draw[(cell_x, cell_y)] = None
 
-        for (cell_x, cell_y), color in cells_to_draw.items():
-            if color:
-                self.draw_cell(cell_x, cell_y, color)
-            else:
-                self.erase_cell(cell_x, cell_y)
+        self.draw_cells(
+            [cell for cell, color in cells_to_draw.items() if color],
+            self.cell_color
+        )
+        self.erase_cells(
+            [cell for cell, color in cells_to_draw.items() if not color]
+        )
 
     def add_cell(self, cell_x, cell_y):
         self.change_list.append((cell_x, cell_y))
@@ -143,10 +96,93 @@ class GameOfLifeGrid(DrawGrid):
         self.neighbours[(cell_x,     cell_y + 1)] -= 1
         self.neighbours[(cell_x + 1, cell_y + 1)] -= 1
 
+
+class GameOfLifeGrid(DrawGrid):
+    def __init__(self, background_color, grid_color, cell_color, grid_percentage, fps):
+        DrawGrid.__init__(
+            self,
+            draw_buttons=(LEFT_MOUSE, RIGHT_MOUSE),
+            background_color=background_color,
+            grid_color=grid_color,
+            grid_percentage=grid_percentage,
+            fps=fps,
+            min_cell_size=1,
+            lod_levels=12
+        )
+
+        self.animation = (0.1, 1)
+        self.paused = True
+        self.resetting = False
+        self.cell_color = cell_color
+
+        # rather than a high speed just having a low delay,
+        # it can have a fairly low delay but combined with multiple iterations
+
+        # the iterations_per_tick are odd to make the animations seem less blocky
+        # this is because game of life repititions are generally even
+        self.speed_index = 3
+        self.iteration_delays     = [1, 0.5, 0.25, 0.1, 0.05, 0.04, 0.04, 0.04, 0.05]
+        self.iterations_per_ticks = [1, 1,   1,    1,      1,    3,    5,    11,  15]
+
+        self.set_timer(self.iteration_delay)
+
+        # when a generation takes longer than the delay, the ones that
+        # were missed are caught up on, a few at a time
+        self.set_catch_up(CATCH_UP, max_ticks=3)
+
+        self.life = LifeSimulation(cell_color)
+        self.save_path = "gameoflife.grid"
+
+    def on_timer_end(self):
+        if self.resetting:
+            self.reset()
+        self.paused = True
+
+    def reset(self):
+        self.clear()
+        self.resetting = False
+        self.life.reset()
+
+    @property
+    def alive_cells(self):
+        return self.life.alive_cells
+
+    @property
+    def iteration_delay(self):
+        return self.iteration_delays[self.speed_index]
+
+    @property
+    def iterations_per_tick(self):
+        return self.iterations_per_ticks[self.speed_index]
+
+    def on_mouse_event(self, cell_x, cell_y, button, pressed):
+        if not self.paused:
+            return
+
+        # each stroke can be undone on its own
+        if not pressed:
+            self.snapshot()
+
+        if button == LEFT_MOUSE:
+            if (cell_x, cell_y) not in self.alive_cells:
+                self.draw_cell(cell_x, cell_y, self.cell_color, animation=self.animation)
+                self.add_cell(cell_x, cell_y)
+
+        elif button == RIGHT_MOUSE:
+            if (cell_x, cell_y) in self.alive_cells:
+                self.erase_cell(cell_x, cell_y, animation=self.animation)
+                self.delete_cell(cell_x, cell_y)
+
+    def add_cell(self, cell_x, cell_y):
+        self.life.add_cell(cell_x, cell_y)
+
+    def delete_cell(self, cell_x, cell_y):
+        self.life.delete_cell(cell_x, cell_y)
+
     def on_key_down(self, key):
         if key == KEY_SPACE:
             if self.paused:
-                if self.change_list:
+                if self.life.change_list:
                     self.play()
             else:
                 self.pause()
@@ -154,6 +190,9 @@ class GameOfLifeGrid(DrawGrid):
         elif KEY_1 <= key <= KEY_9:
             self.speed_index = key - KEY_1
             self.set_timer(self.iteration_delay)
+            self.update_simulation(
+                iterations_per_tick=self.iterations_per_tick
+            )
 
         elif key == KEY_DELETE:
             if self.paused:
@@ -162,21 +201,69 @@ class GameOfLifeGrid(DrawGrid):
                 self.resetting = True
                 self.stop_timer()
 
+        elif key == KEY_S:
+            if self.paused:
+                self.save(self.save_path)
+
+        elif key == KEY_L:
+            if self.paused and os.path.exists(self.save_path):
+                self.load(self.save_path)
+
+        elif key == KEY_U:
+            if self.paused:
+                self.undo()
+
+        elif key == KEY_R:
+            if self.paused:
+                self.redo()
+
+    def on_save(self):
+        # the universe is the cells themselves
+        return {"speed_index": self.speed_index}
+
+    def on_load(self, state):
+        self.life.reset()
+        self.on_restore(state, self.get_cells())
+
+    def on_restore(self, state, cells):
+        # only the cells that changed are added to or removed from the
+        # universe. they are added to the change list as well, so the
+        # cells around them are looked at on the next iteration
+        alive_cells = self.alive_cells
+        for cell_x, cell_y, color in cells:
+            if color is None:
+                if (cell_x, cell_y) in alive_cells:
+                    self.delete_cell(cell_x, cell_y)
+            elif (cell_x, cell_y) not in alive_cells:
+                self.add_cell(cell_x, cell_y)
+
+        if state:
+            self.speed_index = state["speed_index"]
+            self.set_timer(self.iteration_delay)
+
     def pause(self):
         self.stop_timer()
 
     def play(self):
+        # so that undo goes back to the seed the run started from
+        self.snapshot()
         self.paused = False
-        self.start_timer(multithreaded=True)
+        self.life.iterations_per_tick = self.iterations_per_tick
+        self.start_timer(simulation=self.life)
 
-if __name__ == "__main__":
+
+def create_grid():
+    # the grid as the program runs it, also used by the benchmarks
     from config import config
 
-    grid = GameOfLifeGrid(
+    return GameOfLifeGrid(
         background_color = config["background_color"],
         cell_color       = config["cell_color"],
         grid_color       = config["grid_color"],
         grid_percentage  = config["grid_percentage"],
         fps              = config["fps"]
     )
-    grid.start()
+
+
+if __name__ == "__main__":
+    create_grid().start()
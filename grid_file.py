@@ -0,0 +1,191 @@
+import json
+import lzma
+import struct
+import zlib
+import numpy as np
+
+# grids are saved as a small binary file:
+#   header   magic, version, compression, chunk size, number of colors,
+#            number of blocks and the length of the state
+#   palette  the rgb of every color, from index 1. index 0 is empty
+#   state    whatever the program saved alongside the cells, as json
+#   index    for every block, its position, where it is in the file, its
+#            compressed length and how many chunks it holds
+#   blocks   the chunks, compressed one block at a time
+# a block is BLOCK_CHUNKS x BLOCK_CHUNKS chunks. a single chunk is too small
+# for zlib or lzma to do much with, but a block is still small enough that
+# loading part of the grid only reads the blocks that overlap it.
+# a block holds the local position of each of its chunks, then a bitmap of
+# which cells in each chunk are set, then the palette index of every set
+# cell. bitmaps and indices are stored for all chunks at once rather than
+# chunk by chunk, as that compresses better.
+# indices are a byte each when the palette is small enough
+MAGIC = b"PYGRID"
+VERSION = 1
+
+# compression
+ZLIB = 0
+LZMA = 1
+
+BLOCK_SHIFT = 4
+BLOCK_CHUNKS = 1 << BLOCK_SHIFT
+
+HEADER = struct.Struct("<6sBBHIIQ")
+INDEX_ENTRY = struct.Struct("<qqQII")
+
+_COMPRESS = {
+    ZLIB: lambda data: zlib.compress(data, 6),
+    LZMA: lzma.compress,
+}
+_DECOMPRESS = {
+    ZLIB: zlib.decompress,
+    LZMA: lzma.decompress,
+}
+
+
+def save_grid(path, store, palette, state=None, compression=ZLIB):
+    if compression not in _COMPRESS:
+        raise ValueError(f"unknown compression {compression!r}")
+    compress = _COMPRESS[compression]
+
+    chunk_size = store.chunk_size
+    colors = palette.colors[1:]
+    index_dtype = _index_dtype(len(palette))
+    state = json.dumps(state).encode()
+
+    blocks = {}
+    for (chunk_x, chunk_y), chunk in store:
+        key = (chunk_x >> BLOCK_SHIFT, chunk_y >> BLOCK_SHIFT)
+        blocks.setdefault(key, []).append((chunk_x, chunk_y, chunk.cells))
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(
+            MAGIC, VERSION, compression, chunk_size, len(colors),
+            len(blocks), len(state)
+        ))
+        f.write(np.array(colors, dtype=np.uint8).tobytes())
+        f.write(state)
+
+        # the index is written once every block's offset is known
+        index_start = f.tell()
+        f.seek(index_start + INDEX_ENTRY.size * len(blocks))
+
+        index = []
+        for (block_x, block_y), chunks in blocks.items():
+            positions = np.array(
+                [(chunk_x, chunk_y) for chunk_x, chunk_y, _ in chunks],
+                dtype=np.int64
+            ) & (BLOCK_CHUNKS - 1)
+            cells = np.stack([cells for _, _, cells in chunks])
+            occupied = cells != 0
+            data = compress(
+                positions.astype(np.uint8).tobytes()
+                + np.packbits(occupied).tobytes()
+                + cells[occupied].astype(index_dtype).tobytes()
+            )
+            index.append((block_x, block_y, f.tell(), len(data), len(chunks)))
+            f.write(data)
+
+        f.seek(index_start)
+        for entry in index:
+            f.write(INDEX_ENTRY.pack(*entry))
+
+
+def _index_dtype(n_colors):
+    return np.uint8 if n_colors <= 256 else np.dtype("<u2")
+
+
+class GridReader:
+    # reads the header, palette, state and index when opened. blocks are
+    # only read once cells() asks for them
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        try:
+            self._read_header(path)
+        except Exception:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _read_header(self, path):
+        f = self._file
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a saved grid")
+
+        magic, version, compression, chunk_size, n_colors, n_blocks, \
+            state_length = HEADER.unpack(header)
+        if version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} grid")
+        if compression not in _DECOMPRESS:
+            raise ValueError(f"{path} has unknown compression {compression}")
+
+        self.compression = compression
+        self.chunk_size = chunk_size
+        self.colors = [
+            tuple(color) for color in np.frombuffer(
+                f.read(n_colors * 3), dtype=np.uint8
+            ).reshape(-1, 3).tolist()
+        ]
+        self.state = json.loads(f.read(state_length))
+        self.index = [
+            INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+            for block in range(n_blocks)
+        ]
+
+    def cells(self, region=None):
+        # yields the xs, ys and file palette indices of every set cell, a
+        # block at a time. region is (x_start, x_end, y_start, y_end), and
+        # only the blocks overlapping it are read
+        decompress = _DECOMPRESS[self.compression]
+        chunk_size = self.chunk_size
+        chunk_shift = chunk_size.bit_length() - 1
+        block_cells = chunk_size << BLOCK_SHIFT
+        index_dtype = _index_dtype(len(self.colors) + 1)
+
+        # blocks are read in the order they are in the file
+        for block_x, block_y, offset, length, n_chunks in sorted(
+                self.index, key=lambda entry: entry[2]):
+            base_x = block_x * block_cells
+            base_y = block_y * block_cells
+            if region is not None:
+                x_start, x_end, y_start, y_end = region
+                if base_x >= x_end or base_x + block_cells <= x_start \
+                        or base_y >= y_end or base_y + block_cells <= y_start:
+                    continue
+
+            self._file.seek(offset)
+            data = decompress(self._file.read(length))
+
+            positions = np.frombuffer(
+                data, np.uint8, n_chunks * 2
+            ).reshape(-1, 2).astype(np.int64)
+            n_bits = n_chunks * chunk_size * chunk_size
+            bitmap_end = n_chunks * 2 + (n_bits + 7) // 8
+            occupied = np.unpackbits(
+                np.frombuffer(data, np.uint8, bitmap_end - n_chunks * 2,
+                              n_chunks * 2),
+                count=n_bits
+            ).reshape(n_chunks, chunk_size, chunk_size).view(bool)
+            indices = np.frombuffer(data, index_dtype, offset=bitmap_end)
+
+            chunks, local_xs, local_ys = np.nonzero(occupied)
+            xs = base_x + (positions[chunks, 0] << chunk_shift) + local_xs
+            ys = base_y + (positions[chunks, 1] << chunk_shift) + local_ys
+            indices = indices.astype(np.uint16)
+
+            if region is not None:
+                inside = (xs >= x_start) & (xs < x_end) \
+                    & (ys >= y_start) & (ys < y_end)
+                xs, ys, indices = xs[inside], ys[inside], indices[inside]
+
+            if len(xs):
+                yield xs, ys, indices
@@ -0,0 +1,143 @@
+# undo and redo for the cell store, built on the store recording the chunks
+# it changes. taking a snapshot costs nothing up front. the first write to a
+# chunk after it copies that chunk, and only the old chunks are kept, so the
+# store can be put back the way it was by swapping them back in. the chunks
+# that swaps out are kept in turn, to redo it.
+# each snapshot also keeps a state of the program's own, e.g. whatever
+# PyGrid.on_save() returns.
+# the chunks kept are bounded by max_bytes. the oldest snapshots are
+# forgotten first, then the redos furthest away. if the chunks changed since
+# the current snapshot pass max_bytes on their own, the store stops
+# recording and every snapshot is forgotten, since they are all kept
+# relative to the current one
+
+
+class History:
+    def __init__(self, store, max_bytes):
+        self._store = store
+        self.max_bytes = max_bytes
+
+        # entries are (snapshot, state, chunks, n_bytes), where chunks
+        # take the store from the current snapshot to that one
+        self._undo = []
+        self._redo = []
+        self._bytes = 0
+
+        self.snapshot_id = None
+        self.state = None
+        self._next_id = 0
+
+    def snapshot(self, state):
+        # returns the id of the new snapshot, or of the current one if
+        # nothing has changed since it
+        self._check_recording()
+        store = self._store
+        if self.snapshot_id is not None and not store.has_changes():
+            store.take_changes(self.max_bytes)
+            self.state = state
+            return self.snapshot_id
+
+        changes = store.take_changes(self.max_bytes)
+        if self.snapshot_id is not None:
+            self._push(self._undo, self.snapshot_id, self.state, changes)
+            while self._redo:
+                self._pop(self._redo, 0)
+
+        self.snapshot_id = self._next_id
+        self._next_id += 1
+        self.state = state
+        self._trim()
+        return self.snapshot_id
+
+    def __contains__(self, snapshot_id):
+        self._check_recording()
+        return snapshot_id == self.snapshot_id or any(
+            entry[0] == snapshot_id for entry in self._undo + self._redo
+        )
+
+    def undo(self):
+        # goes back a snapshot, returning the chunks put in the store and
+        # the ones they replaced, or None at the oldest snapshot.
+        # anything changed since the current snapshot is thrown away, so
+        # the caller should snapshot it first if it matters
+        return self._move(self._undo, self._redo)
+
+    def redo(self):
+        return self._move(self._redo, self._undo)
+
+    def restore(self, snapshot_id):
+        # undoes or redoes until the store is at snapshot_id, returning
+        # every chunk put in the store and the ones it replaced, once each
+        if snapshot_id not in self:
+            raise ValueError(f"snapshot {snapshot_id} is not in the history")
+
+        forward = any(entry[0] == snapshot_id for entry in self._redo)
+        installed = {}
+        replaced = {}
+        while self.snapshot_id != snapshot_id:
+            put, taken = self.redo() if forward else self.undo()
+            for key, chunk in taken.items():
+                replaced.setdefault(key, chunk)
+            installed.update(put)
+        return installed, replaced
+
+    def _move(self, source, destination):
+        self._check_recording()
+        if not source:
+            return None
+
+        self._store.take_changes(self.max_bytes)
+        snapshot_id, state, chunks, n_bytes = self._pop(source, -1)
+        replaced = self._store.swap_chunks(chunks)
+        self._push(destination, self.snapshot_id, self.state, replaced)
+        self.snapshot_id = snapshot_id
+        self.state = state
+        self._trim()
+        return chunks, replaced
+
+    def _check_recording(self):
+        if self.snapshot_id is not None and not self._store.recording:
+            self.clear()
+
+    def _push(self, entries, snapshot_id, state, chunks):
+        n_bytes = sum(
+            chunk.cells.nbytes for chunk in chunks.values()
+            if chunk is not None
+        )
+        entries.append((snapshot_id, state, chunks, n_bytes))
+        self._bytes += n_bytes
+
+    def _pop(self, entries, position):
+        entry = entries.pop(position)
+        self._bytes -= entry[3]
+        return entry
+
+    def _trim(self):
+        pending = self._store.changes_bytes()
+        while self._undo and self._bytes + pending > self.max_bytes:
+            self._pop(self._undo, 0)
+        while self._redo and self._bytes + pending > self.max_bytes:
+            self._pop(self._redo, 0)
+
+    def n_bytes(self):
+        # the cells kept by every snapshot, and since the current one
+        self._check_recording()
+        return self._bytes + self._store.changes_bytes()
+
+    def clear(self):
+        self._undo = []
+        self._redo = []
+        self._bytes = 0
+        self.snapshot_id = None
+        self.state = None
+        self._store.stop_recording()
+
+    def stats(self):
+        self._check_recording()
+        return {
+            "snapshot": self.snapshot_id,
+            "undo": len(self._undo),
+            "redo": len(self._redo),
+            "bytes": self.n_bytes(),
+            "max_bytes": self.max_bytes,
+        }
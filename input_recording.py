@@ -0,0 +1,119 @@
+import gzip
+import json
+
+# ignore startup message
+import contextlib
+with contextlib.redirect_stdout(None):
+    import pygame
+
+# a session is recorded as gzipped json lines. the first line is a header
+# describing the grid, every line after it is a frame that had input:
+# [frame, time_ms, mouse_rel, events], with events as [name, attributes].
+# frames without input aren't written, except for the very last one,
+# so that the length of the session is known.
+# only the attributes pygrid and its programs read are kept
+RECORDED_EVENTS = {
+    "MOUSEMOTION": ("pos", "rel", "buttons"),
+    "MOUSEBUTTONDOWN": ("pos", "button"),
+    "MOUSEBUTTONUP": ("pos", "button"),
+    "MOUSEWHEEL": ("x", "y"),
+    "KEYDOWN": ("key", "mod", "unicode", "scancode"),
+    "KEYUP": ("key", "mod", "unicode", "scancode"),
+    "VIDEORESIZE": ("w", "h", "size"),
+}
+EVENT_NAMES = {getattr(pygame, name): name for name in RECORDED_EVENTS}
+VERSION = 1
+
+
+class InputRecorder:
+    def __init__(self, path, header):
+        self._file = gzip.open(path, "wt")
+        self._file.write(json.dumps({"version": VERSION, **header}) + "\n")
+        self._start = pygame.time.get_ticks()
+        self._frame = 0
+        self._events = []
+        self._mouse_rel = None
+
+    def get_events(self):
+        events = pygame.event.get()
+        self.record(events)
+        return events
+
+    def record(self, events):
+        # for events the grid takes from pygame other than by get_events
+        for event in events:
+            name = EVENT_NAMES.get(event.type, None)
+            if name:
+                self._events.append([name, {
+                    attr: getattr(event, attr, None)
+                    for attr in RECORDED_EVENTS[name]
+                }])
+
+    def get_mouse_rel(self):
+        self._mouse_rel = pygame.mouse.get_rel()
+        return self._mouse_rel
+
+    def end_frame(self):
+        # a frame where the mouse was read but didn't move has no input
+        if self._events or self._mouse_rel not in (None, (0, 0)):
+            self._write_frame()
+        self._mouse_rel = None
+        self._frame += 1
+
+    def _write_frame(self):
+        self._file.write(json.dumps([
+            self._frame,
+            pygame.time.get_ticks() - self._start,
+            self._mouse_rel,
+            self._events
+        ], separators=(",", ":")) + "\n")
+        self._events = []
+        self._mouse_rel = None
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._write_frame()
+        self._file.close()
+
+
+class InputPlayer:
+    def __init__(self, path, timestep=None):
+        self.frames = {}
+        with gzip.open(path, "rt") as f:
+            self.header = json.loads(f.readline())
+            if self.header.get("version", None) != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} recording")
+            for line in f:
+                frame, time, mouse_rel, events = json.loads(line)
+                self.frames[frame] = (time, mouse_rel, events)
+
+        self.n_frames = max(self.frames, default=-1) + 1
+        self.timestep = timestep or 1000 / self.header["fps"]
+        self.frame = 0
+
+    def get_events(self):
+        # events that aren't input, such as a timer ending or the window
+        # being exposed, still come from pygame. input from the real mouse
+        # and keyboard is ignored
+        events = [
+            event for event in pygame.event.get()
+            if event.type not in EVENT_NAMES
+        ]
+        _, _, recorded = self.frames.get(self.frame, (None, None, ()))
+        for name, attributes in recorded:
+            events.append(pygame.event.Event(getattr(pygame, name), attributes))
+        return events
+
+    def get_mouse_rel(self):
+        _, mouse_rel, _ = self.frames.get(self.frame, (None, None, ()))
+        return mouse_rel or (0, 0)
+
+    def get_ticks(self):
+        # ticks are only read while handling input, e.g. to work out how
+        # fast the grid was flicked, so the recorded time is used when there
+        # is one. that way a flick replays at the speed it was recorded at
+        time, _, _ = self.frames.get(self.frame, (None, None, ()))
+        if time is None:
+            return int(self.frame * self.timestep)
+        return time
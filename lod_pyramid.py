@@ -0,0 +1,170 @@
+import numpy as np
+
+# a mipmap style pyramid of the cell store, used to draw the grid when it is
+# zoomed out so far that a single pixel covers many cells.
+# at level n, each element summarises a block of 2^n x 2^n cells: how many of
+# them are alive, and the sum of their rgb colors.
+# each level is stored as square tiles of TILE_SIZE x TILE_SIZE elements,
+# keyed by tile coordinate, so only the populated parts of the grid use memory.
+# a tile is dropped once none of its cells are alive.
+# counts and sums are uint32, which holds a block full of white cells up to
+# level 12. deeper pyramids use int64. changes are added as uint32 as well,
+# so a negative change wraps around to the right total
+# levels are updated incrementally whenever a cell changes, so drawing a level
+# only costs as much as the number of pixels on the screen.
+TILE_SHIFT = 4
+TILE_SIZE = 1 << TILE_SHIFT
+TILE_MASK = TILE_SIZE - 1
+
+
+class LodPyramid:
+    def __init__(self, n_levels, palette):
+        self.n_levels = n_levels
+        self._palette = palette
+
+        # self._levels[n - 1] holds the tiles of level n
+        self._levels = [{} for level in range(n_levels)]
+        self._dtype = np.uint32 if n_levels <= 12 else np.int64
+
+    def clear(self):
+        self._levels = [{} for level in range(self.n_levels)]
+
+    def _get_tile(self, level, key):
+        tiles = self._levels[level - 1]
+        tile = tiles.get(key, None)
+        if tile is None:
+            tile = (
+                np.zeros((TILE_SIZE, TILE_SIZE), dtype=self._dtype),
+                np.zeros((TILE_SIZE, TILE_SIZE, 3), dtype=self._dtype)
+            )
+            tiles[key] = tile
+        return tile
+
+    def update_cell(self, cell_x, cell_y, old_index, new_index):
+        # a single cell changed from old_index to new_index
+        if old_index == new_index:
+            return
+
+        colors = self._palette.colors
+        count = (new_index != 0) - (old_index != 0)
+        new_color = colors[new_index] or (0, 0, 0)
+        old_color = colors[old_index] or (0, 0, 0)
+        color = np.array((
+            new_color[0] - old_color[0],
+            new_color[1] - old_color[1],
+            new_color[2] - old_color[2]
+        )).astype(self._dtype)
+        count_delta = np.array(count).astype(self._dtype)
+
+        for level in range(1, self.n_levels + 1):
+            block_x = cell_x >> level
+            block_y = cell_y >> level
+            key = (block_x >> TILE_SHIFT, block_y >> TILE_SHIFT)
+            counts, sums = self._get_tile(level, key)
+            position = (block_x & TILE_MASK, block_y & TILE_MASK)
+            np.add.at(counts, position, count_delta)
+            sums[position] += color
+            if count < 0 and not counts[position] and not counts.any():
+                del self._levels[level - 1][key]
+
+    def update(self, xs, ys, old_indices, new_indices):
+        # many cells changed. each cell must only appear once
+        rgb = self._palette.rgb_array()
+        counts = (new_indices != 0).astype(np.int64) - (old_indices != 0)
+        colors = rgb[new_indices] - rgb[old_indices]
+
+        changed = (counts != 0) | colors.any(axis=1)
+        if not changed.all():
+            xs = xs[changed]
+            ys = ys[changed]
+            counts = counts[changed]
+            colors = colors[changed]
+        if not len(xs):
+            return
+
+        # the changes are summed per block, and each level's blocks are
+        # summed again for the level above, so every level after the first
+        # few only has a handful of blocks to update
+        for level in range(1, self.n_levels + 1):
+            keys = ((xs >> 1) << 32) | ((ys >> 1) & 0xFFFFFFFF)
+            order = np.argsort(keys)
+            keys = keys[order]
+            starts = np.flatnonzero(
+                np.concatenate(([True], keys[1:] != keys[:-1]))
+            )
+            counts = np.add.reduceat(counts[order], starts)
+            colors = np.add.reduceat(colors[order], starts)
+
+            keys = keys[starts]
+            xs = keys >> 32
+            ys = keys & 0xFFFFFFFF
+            ys[ys >= 0x80000000] -= 0x100000000
+            self._add_blocks(level, xs, ys, counts, colors)
+
+    def _add_blocks(self, level, xs, ys, counts, colors):
+        # adds to the blocks of a level. each block must only appear once
+        keys = ((xs >> TILE_SHIFT) << 32) | ((ys >> TILE_SHIFT) & 0xFFFFFFFF)
+        order = np.argsort(keys)
+        keys = keys[order]
+        local_xs = (xs & TILE_MASK)[order]
+        local_ys = (ys & TILE_MASK)[order]
+        shrinks = counts[order] < 0
+        counts = counts[order].astype(self._dtype)
+        colors = colors[order].astype(self._dtype)
+
+        # the blocks of each tile are now next to each other
+        bounds = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        starts = [0] + bounds.tolist()
+        ends = bounds.tolist() + [len(keys)]
+        for key, start, end in zip(keys[starts].tolist(), starts, ends):
+            tile_y = key & 0xFFFFFFFF
+            if tile_y >= 0x80000000:
+                tile_y -= 0x100000000
+
+            tile_key = (key >> 32, tile_y)
+            tile_counts, tile_sums = self._get_tile(level, tile_key)
+            positions = (local_xs[start:end], local_ys[start:end])
+            np.add.at(tile_counts, positions, counts[start:end])
+            np.add.at(tile_sums, positions, colors[start:end])
+            if shrinks[start:end].any() and not tile_counts.any():
+                del self._levels[level - 1][tile_key]
+
+    def render(self, level, block_x, block_y, width, height, background):
+        # returns a (width, height, 3) rgb array of the blocks at level,
+        # starting at block_x, block_y. each pixel is the average color of
+        # the cells in its block, blended with the background by how many
+        # of them are alive
+        counts = np.zeros((width, height), dtype=np.int64)
+        sums = np.zeros((width, height, 3), dtype=np.int64)
+
+        tiles = self._levels[level - 1]
+        for tile_y in range(block_y >> TILE_SHIFT,
+                            ((block_y + height - 1) >> TILE_SHIFT) + 1):
+            y = (tile_y << TILE_SHIFT) - block_y
+            y_start = max(y, 0)
+            y_end = min(y + TILE_SIZE, height)
+
+            for tile_x in range(block_x >> TILE_SHIFT,
+                                ((block_x + width - 1) >> TILE_SHIFT) + 1):
+                tile = tiles.get((tile_x, tile_y), None)
+                if tile is None:
+                    continue
+
+                x = (tile_x << TILE_SHIFT) - block_x
+                x_start = max(x, 0)
+                x_end = min(x + TILE_SIZE, width)
+
+                counts[x_start:x_end, y_start:y_end] = tile[0][
+                    x_start - x:x_end - x, y_start - y:y_end - y
+                ]
+                sums[x_start:x_end, y_start:y_end] = tile[1][
+                    x_start - x:x_end - x, y_start - y:y_end - y
+                ]
+
+        # the square root keeps sparse regions visible,
+        # otherwise a lone glider would vanish a few levels out
+        density = np.sqrt(counts / float(1 << (2 * level)))[..., None]
+        average = sums / np.maximum(counts, 1)[..., None]
+        pixels = np.asarray(background, dtype=np.float64) * (1 - density) \
+            + average * density
+        return pixels.astype(np.uint8)
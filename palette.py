@@ -0,0 +1,113 @@
+import threading
+import numpy as np
+
+# ignore startup message
+import contextlib
+with contextlib.redirect_stdout(None):
+    import pygame
+
+# cells store a small integer index into the palette rather than an rgb tuple.
+# index 0 is reserved for empty cells.
+# colors are mapped to the screen's pixel format once, when they are
+# registered, so drawing a stored cell never has to convert its color again.
+EMPTY = 0
+MAX_COLORS = 65536
+
+
+class Palette:
+    def __init__(self):
+        self.colors = [None]
+        self.mapped = [None]
+        self._indices = {}
+        self._surface = None
+        self._mapped_array = None
+        self._rgb_array = None
+
+        # registering can happen from the timer thread
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.colors)
+
+    def index(self, color):
+        try:
+            return self._indices[color]
+        except (KeyError, TypeError):
+            return self._register(color)
+
+    def _register(self, color):
+        # colors can be given as lists, pygame colors, or anything
+        # else pygame accepts, so normalize them before looking them up
+        rgb = tuple(pygame.Color(color))[:3]
+
+        with self._lock:
+            index = self._indices.get(rgb, None)
+            if index is None:
+                index = len(self.colors)
+                if index >= MAX_COLORS:
+                    raise ValueError("palette cannot hold more than "
+                                     f"{MAX_COLORS - 1} colors")
+
+                # until a screen exists, the rgb tuple is used as-is
+                if self._surface is None:
+                    mapped = rgb
+                else:
+                    mapped = self._surface.map_rgb(rgb)
+
+                self.colors.append(rgb)
+                self.mapped.append(mapped)
+                self._indices[rgb] = index
+
+            try:
+                self._indices[color] = index
+            except TypeError:
+                # unhashable, e.g. a list
+                pass
+
+        return index
+
+    def map_surface(self, surface):
+        # convert every registered color to the pixel format of surface
+        self._surface = surface
+        self._mapped_array = None
+        self.mapped = [None] + [
+            surface.map_rgb(color) for color in self.colors[1:]
+        ]
+
+    def mapped_array(self, empty_index):
+        # mapped colors as a numpy lookup table, so an array of indices can
+        # be converted to pixels in one step. empty cells are given the
+        # color of empty_index. rebuilt only when new colors are registered
+        cached = self._mapped_array
+        if cached is not None and len(cached) == len(self.mapped) \
+                and cached[0] == self.mapped[empty_index]:
+            return cached
+
+        mapped = self.mapped.copy()
+        mapped[0] = mapped[empty_index]
+        self._mapped_array = np.array(mapped, dtype=np.uint32)
+        return self._mapped_array
+
+    def map_rgb_array(self, rgb):
+        # map_rgb for an (n, 3) array of colors that aren't in the palette,
+        # such as blends, converting them all to pixels in one step
+        surface = self._surface
+        r_shift, g_shift, b_shift, _ = surface.get_shifts()
+        r_loss, g_loss, b_loss, _ = surface.get_losses()
+        alpha_mask = surface.get_masks()[3]
+        rgb = rgb.astype(np.uint32)
+        return ((rgb[:, 0] >> r_loss) << r_shift) \
+            | ((rgb[:, 1] >> g_loss) << g_shift) \
+            | ((rgb[:, 2] >> b_loss) << b_shift) \
+            | np.uint32(alpha_mask)
+
+    def rgb_array(self):
+        # registered colors as an (n, 3) numpy array. empty cells are black
+        cached = self._rgb_array
+        if cached is not None and len(cached) == len(self.colors):
+            return cached
+
+        self._rgb_array = np.array(
+            [(0, 0, 0)] + self.colors[1:], dtype=np.int64
+        ).reshape(-1, 3)
+        return self._rgb_array
@@ -1,3 +1,4 @@
+import os
 from draw_grid import DrawGrid
 from keycodes import *
 
@@ -38,6 +39,10 @@ class PathfindingGrid(DrawGrid):
         self.queue = []
         self.explored_cells = {}
         self.walls = set()
+        self.save_path = "pathfinding.grid"
+
+        # cells drawn during a tick are collected and drawn together
+        self.cells_to_draw = []
 
         self.heuristics = [
             self.heuristic_dijkstra,
@@ -93,6 +98,10 @@ class PathfindingGrid(DrawGrid):
         if self.solving_started:
             self.clear_solve()
 
+        # each stroke can be undone on its own
+        if not pressed:
+            self.snapshot()
+
         if button == LEFT_MOUSE:
             self.on_left_mouse(cell_x, cell_y, pressed)
 
@@ -157,6 +166,27 @@ class PathfindingGrid(DrawGrid):
                 self.resetting = True
                 self.stop_timer()
 
+        elif key == KEY_S:
+            if self.paused:
+                # the search isn't saved
+                self.clear_solve()
+                self.save(self.save_path)
+
+        elif key == KEY_L:
+            if self.paused and os.path.exists(self.save_path):
+                self.clear_solve()
+                self.load(self.save_path)
+
+        elif key == KEY_U:
+            if self.paused:
+                self.clear_solve()
+                self.undo()
+
+        elif key == KEY_R:
+            if self.paused:
+                self.clear_solve()
+                self.redo()
+
         elif KEY_A <= key <= KEY_C:
             if not self.paused:
                 return
@@ -168,6 +198,26 @@ class PathfindingGrid(DrawGrid):
             self.speed_index = key - KEY_1
             self.set_timer(self.iteration_delay)
 
+    def on_save(self):
+        # the walls are the cells that aren't the start or end
+        return {
+            "start_cell": self.start_cell,
+            "end_cell": self.end_cell,
+            "heuristic": self.heuristics.index(self.heuristic),
+            "speed_index": self.speed_index
+        }
+
+    def on_load(self, state):
+        self.start_cell = state["start_cell"] and tuple(state["start_cell"])
+        self.end_cell = state["end_cell"] and tuple(state["end_cell"])
+        self.walls = {
+            (cell_x, cell_y) for cell_x, cell_y, color in self.get_cells()
+            if not self.is_special_cell(cell_x, cell_y)
+        }
+        self.set_heuristic(state["heuristic"])
+        self.speed_index = state["speed_index"]
+        self.set_timer(self.iteration_delay)
+
     def clear_solve(self):
         self.clearing = False
         self.solving_started = False
@@ -175,8 +225,7 @@ class PathfindingGrid(DrawGrid):
         self.stop_timer()
         if self.explored_cells:
             del self.explored_cells[self.start_cell]
-            for cell in self.explored_cells:
-                self.erase_cell(*cell)
+            self.erase_cells(self.explored_cells)
         self.queue = []
         self.explored_cells = {}
 
@@ -217,6 +266,9 @@ class PathfindingGrid(DrawGrid):
         for i in range(self.iterations_per_tick):
             self.do_iteration()
 
+        self.draw_cells(self.cells_to_draw)
+        self.cells_to_draw = []
+
     def do_iteration(self):
         if self.found_end_cell:
             self.backtrack()
@@ -266,7 +318,7 @@ class PathfindingGrid(DrawGrid):
             self.stop_timer()
             self.solving_finished = True
         else:
-            self.draw_cell(*self.chosen_cell, self.trace_color)
+            self.cells_to_draw.append((*self.chosen_cell, self.trace_color))
             self.trace_cell = self.chosen_cell
 
     def search_neighbour(self, cell):
@@ -284,7 +336,7 @@ class PathfindingGrid(DrawGrid):
 
             # save the path length so we can use it for backtracking later
             self.explored_cells[cell] = self.counter
-            self.draw_cell(*cell, self.scan_color)
+            self.cells_to_draw.append((*cell, self.scan_color))
 
     def insert_on_heuristic(self, cell, heuristic):
         if not self.queue:
@@ -322,7 +374,7 @@ class PathfindingGrid(DrawGrid):
         (cell_x, cell_y), heuristic = self.queue.pop(0)
 
         if (cell_x, cell_y) != self.start_cell:
-            self.draw_cell(cell_x, cell_y, self.scanned_color)
+            self.cells_to_draw.append((cell_x, cell_y, self.scanned_color))
 
         self.counter = self.explored_cells[(cell_x, cell_y)] + 1
 
@@ -332,7 +384,8 @@ class PathfindingGrid(DrawGrid):
         self.search_neighbour((cell_x, cell_y - 1))
 
 
-if __name__ == "__main__":
+def create_grid():
+    # the grid as the program runs it, also used by the benchmarks
     from config import config
     from utils import color_mix
 
@@ -353,7 +406,7 @@ if __name__ == "__main__":
         0.5
     ),
 
-    grid = PathfindingGrid(
+    return PathfindingGrid(
         background_color = config["background_color"],
         cell_color       = config["cell_color"],
         grid_color       = config["grid_color"],
@@ -365,5 +418,7 @@ if __name__ == "__main__":
         grid_percentage  = config["grid_percentage"],
         fps              = config["fps"]
     )
-        
-    grid.start()
+
+
+if __name__ == "__main__":
+    create_grid().start()
@@ -1,10 +1,28 @@
 import math
+import os
 import random
 import sys
-from collections import defaultdict
-from utils import color_mix
+import time
+from utils import merge_rects
+from chunk_store import ChunkStore
+from animations import Animations, FADE
+from palette import Palette, EMPTY
+from tile_cache import TileCache
+from lod_pyramid import LodPyramid
+from draw_queue import DrawQueue
+from timers import Timer, BATCH
+from change_buffer import ChangeBuffer
+from simulation import SimulationWorker
+from grid_file import save_grid, GridReader, ZLIB
+from history import History
+from frame_stats import FrameStats, CELLS_DRAWN, DRAW_CALLS, RECTS, \
+    DEGRADED
+from input_recording import InputRecorder, InputPlayer
 from keycodes import MOUSE_SCROLL_UP, MOUSE_SCROLL_DOWN, MIDDLE_MOUSE
 import threading
+import queue
+import numpy as np
+from collections import OrderedDict
 
 # ignore startup message
 import contextlib
@@ -16,26 +34,27 @@ TIMER_INACTIVE = 0
 TIMER_ACTIVE   = 1
 TIMER_ENDING   = 2
 
-# animation index enum
-ORIGINAL_COLOR = 0
-CURRENT_COLOR = 1
-TARGET_COLOR = 2
-ANIMATION_TYPE = 3
-PROGRESS = 4
-DURATION = 5
-DELETING = 6
-
 class PyGrid:
     def __init__(self, n_rows=20, n_columns=20, width=0, height=0,
                  background_color=(255, 255, 255), grid_color=(50, 50, 50),
                  grid_fade_start=33, grid_fade_end=8, grid_percentage=0.1,
                  min_cell_size=4, cell_size=40, max_cell_size=1000,
                  pan_button=MIDDLE_MOUSE, fps=60, default_grid_alpha=255,
-                 allowed_zoom=True, allowed_pan=True, allowed_resize=True):
-
-        # grid demensions
+                 allowed_zoom=True, allowed_pan=True, allowed_resize=True,
+                 tile_cache_bytes=32 * 1024 * 1024,
+                 framebuffer_threshold=20000, lod_levels=0,
+                 dirty_threshold=0.5, max_animations=50000,
+                 animation_budget=0.5, overscan=0, idle=True,
+                 idle_timeout=1000, max_ticks_ahead=2,
+                 max_resident_chunks=None, page_dir=None,
+                 history_bytes=64 * 1024 * 1024):
+
+        # grid demensions. the screen's can be larger than the window's
+        # with overscan
         self._n_rows = n_rows
         self._n_columns = n_columns
+        self._screen_rows = n_rows
+        self._screen_columns = n_columns
 
         # user's location on grid (top left corner)
         self._pos_x = 0.0
@@ -60,7 +79,7 @@ class PyGrid:
         self._min_cell_size = min_cell_size
 
         self._fps = fps
-        self._frame_delta = int((1 / self._fps) * 900)
+        self._frame_period = 1000 / self._fps
 
         self._background_color = background_color
         self._grid_color = grid_color
@@ -81,8 +100,19 @@ class PyGrid:
         # only update screen if changes have occurred
         self._screen_changed = True
 
-        self._timer_progress = 0
-        self._timer_duration = 1000  # milliseconds
+        # only the parts of the screen that were drawn to are presented,
+        # unless the whole screen changed (a pan, zoom or redraw), or the
+        # changed area is more than dirty_threshold of the screen
+        self._full_redraw = True
+        self._dirty_rects = []
+        self._dirty_threshold = dirty_threshold
+        self._dirty_block_size = 32
+        self._max_dirty_rects = 4096
+
+        # the timer that calls on_timer, and any named timers added with
+        # add_timer(). see timers.py
+        self._timer = Timer(1000, catch_up=BATCH)
+        self._timers = {}
 
         # current velocity of the grid.
         # allows user to flick it around and have it slide
@@ -108,14 +138,62 @@ class PyGrid:
         # mouse events are only sent per cell
         self._last_cell = (-1, -1)
 
-        # rows and columns have duplicated data
-        # when panning a column, instead of checking every cell in that column
-        # we iterate over a smaller number of chunks.
-        # every cell in a chunk is drawn.
+        # cells are stored in fixed size chunks indexed by chunk coordinate.
+        # when panning a row or column, instead of checking every cell in it
+        # we only visit the chunks that overlap the newly exposed region.
         self._chunk_size = 16
-        self._rows = defaultdict(lambda: defaultdict(dict))
-        self._columns = defaultdict(lambda: defaultdict(dict))
 
+        # with max_resident_chunks set, chunks that haven't been used for a
+        # while are paged out to a file in page_dir once there are more
+        # than that many in memory. chunks in the render zone never are
+        self._store = ChunkStore(
+            self._chunk_size, max_resident_chunks, page_dir
+        )
+
+        # snapshot() starts keeping the chunks changed after it, so that
+        # it can be restored. at most history_bytes of them are kept
+        self._history = History(self._store, history_bytes)
+
+        # every color drawn is registered in the palette.
+        # cells store the palette index rather than the rgb tuple
+        self._palette = Palette()
+        self._background_index = self._palette.index(background_color)
+
+        # chunks are rendered to surfaces so that newly exposed regions can
+        # be filled with one blit per chunk rather than one rect per cell.
+        # chunks with only a few cells are cheaper to draw cell by cell
+        self._tile_cache = TileCache(tile_cache_bytes)
+        self._tile_min_cells = 8
+
+        # zooming in and out keeps revisiting the same few cell sizes, so
+        # the grid line surfaces of recent sizes are kept, least recently
+        # used first. each one covers the whole screen, so they are bounded
+        # by bytes rather than count. the current one is always kept
+        self._grid_lines_cache = OrderedDict()
+        self._grid_lines_cache_bytes = 16 * 1024 * 1024
+        self._grid_lines_bytes = 0
+
+        # when more cells than this are visible, full screen redraws
+        # rasterise the visible cells into an array with numpy rather than
+        # drawing them individually
+        self._framebuffer_threshold = framebuffer_threshold
+
+        # zooming out past min_cell_size enters level of detail mode,
+        # where every pixel covers 2^lod_level x 2^lod_level cells.
+        # the grid is drawn from a pyramid of downsampled cells, which is
+        # only maintained if lod_levels is set
+        self._lod_levels = lod_levels
+        self._lod_level = 0
+        self._lod_dirty = False
+
+        # animations are skipped, and cells drawn instantly, when nothing
+        # would show them: in level of detail mode, or headless without
+        # rendering
+        self._animations_enabled = True
+        if lod_levels:
+            self._lod_pyramid = LodPyramid(lod_levels, self._palette)
+        else:
+            self._lod_pyramid = None
 
         # what percentage of a cell should be designated for the grid lines?
         self._grid_percentage = grid_percentage
@@ -124,31 +202,126 @@ class PyGrid:
         # what cell size does grid disappear at?
         self._grid_fade_end = grid_fade_end
 
-        self._animated_cells = {}
-
-        self._animation_funcs = [
-            [self._fade_animation, self._fade_animation],
-            [self._grow_in_animation, self._grow_out_animation]
-        ]
+        # every animation is advanced, blended and drawn in bulk each frame
+        self._animated_cells = Animations()
+
+        # under load, animations are degraded so that they never take more
+        # than animation_budget of a frame. new animations are drawn
+        # instantly once there are max_animations, or once as many as the
+        # budget allows based on their measured cost. if a frame goes over
+        # budget anyway, running animations are shortened, and if it goes
+        # far over, they are all finished at once
+        self._max_animations = max_animations
+        self._animation_budget = self._frame_period * animation_budget
+        self._animation_time = 0
+        self._animation_cost = 0
+
+        # the cost per animation is only measured on frames with at least
+        # this many, since a handful of animations is mostly fixed overhead
+        self._animation_cost_sample = 1000
+
+        self._animations_degraded = 0
+        self._animations_shortened = 0
+        self._animations_finished_early = 0
+        self._animation_degrade_events = 0
+
+        # with overscan, the grid is drawn to a back buffer larger than the
+        # window by overscan pixels on every side, and the window shows the
+        # part of it at the view. panning within the margin only moves the
+        # view. the margin is drawn a strip at a time in the frame time left
+        # over, keeping more of it ahead of the view when the grid is moving.
+        # the valid rect is the part of the back buffer that has been drawn
+        self._overscan = overscan
+        self._view_x = overscan
+        self._view_y = overscan
+        self._overscan_valid = None
+        self._overscan_step = 32
+        self._overscan_work = 0
+        self._overscan_time = 0
+        self._overscan_filled = False
+
+        # when nothing is moving, animating, queued or timed, the event loop
+        # stops running frames and waits for input instead, waking after
+        # idle_timeout milliseconds at the latest
+        self._idle = idle
+        self._idle_timeout = idle_timeout
+        self._waking_event = None
 
         self._generate_window_size()
+        self._set_window_size(self._width, self._height)
         self._calc_offsets()
         self._calc_alt_offsets()
 
-        # threading stuff
-        self._timer_thread_busy = False
+        # headless grids draw to an in-memory surface and are driven by
+        # run_ticks() rather than the event loop
+        self._headless = False
+        self._rendering = True
+
+        # headless grids and replays run every timer on the main thread,
+        # so that they are deterministic
+        self._synchronous_timers = False
+        self._ticking = False
+        self._timer_end_pending = False
+
+        # all input is read through these, so that a session can be
+        # recorded, and replayed by swapping in recorded input
+        self._get_events = pygame.event.get
+        self._get_mouse_rel = pygame.mouse.get_rel
+        self._get_ticks = pygame.time.get_ticks
+        self._recorder = None
+
+        # threading stuff.
+        # a threaded timer runs ticks ahead of time, up to max_ticks_ahead
+        # of them, and publishes the cells each one changed. the main thread
+        # applies one published tick for every tick that comes due
         self._timer_status = TIMER_INACTIVE
         self._timer_ended_in_thread = False
         self._timer_is_threaded = False
         self._main_thread = threading.currentThread()
-        self._timer_event = threading.Event()
-        self._draw_queue = []
-        self._next_draw_queue = []
+        self._max_ticks_ahead = max_ticks_ahead
+        self._published_ticks = queue.Queue(max_ticks_ahead)
+        self._tick_changes = ChangeBuffer()
+
+        # a timer started with a simulation runs it in a worker process
+        # instead, which publishes its ticks the same way. the process is
+        # started the first time, and kept for later runs
+        self._simulation = None
+        self._simulation_worker = None
+        self._simulation_lookup = [0]
+
+        # how many cells load() reads before writing them to the store
+        self._load_batch = 1 << 16
+
+        self._draw_queue = DrawQueue()
+
+        # the draw queue is drained for as long as the frame has time left.
+        # the time the rest of the frame takes is measured and smoothed
+        self._frame_work = 0
+        self._draw_queue_time = 0
+        self._draw_queue_budget = self._frame_period * 0.9
+        self._draw_queue_drawn = 0
+        self._draw_queue_rate = 0
         self._timer_end_event = pygame.event.Event(pygame.USEREVENT)
+        self._wake_event = pygame.event.Event(pygame.USEREVENT + 1)
 
         self.draw_cell = self._draw_cell_threadless
         self.erase_cell = self._erase_cell_threadless
-
+        self.draw_cells = self._draw_cells_threadless
+        self.erase_cells = self._erase_cells_threadless
+
+        # pre-rendered cell surfaces, including their grid borders,
+        # keyed by palette index. used when drawing cells in bulk.
+        # they are recreated whenever the cell size or grid changes
+        self._cell_tiles = {}
+
+        # frame stats are off by default. enabling them swaps timed wrappers
+        # in for the methods of each phase of the event loop, and disabling
+        # them puts the originals back
+        self._frame_stats = None
+        self._frame_stats_hud = False
+        self._hud_surface = None
+        self._hud_updated = 0
+        self._uninstrumented = {}
 
         
     #
@@ -161,9 +334,11 @@ class PyGrid:
         # useful for drawing cells right away
         pass
 
-    def on_timer(self):
-        # called every time the timer ticks
-        # see start_timer(), stop_timer(), and set_timer()
+    def on_timer(self, n_ticks):
+        # called every time the timer ticks. n_ticks is how many ticks the
+        # call stands for, which is more than one when the timer fell behind
+        # and batches the ticks it missed.
+        # see start_timer(), stop_timer(), set_timer() and set_catch_up()
         pass
 
     def on_timer_end(self):
@@ -197,47 +372,305 @@ class PyGrid:
         # called when a key is released.
         pass
 
+    def on_save(self):
+        # called by save() and snapshot(). whatever it returns is kept
+        # alongside the cells, and must be something json can encode
+        return None
+
+    def on_load(self, state):
+        # called by load() once the cells are loaded, with what on_save
+        # returned when the file was saved
+        pass
+
+    def on_restore(self, state, cells):
+        # called by undo(), redo() and restore() once the cells are put
+        # back, with what on_save returned when the snapshot was taken and
+        # the (x, y, color) of every cell that changed, where the color of
+        # an erased cell is None. calls on_load unless overridden
+        self.on_load(state)
+
     def clear(self):
         # delete all cells and wipe the screen
-        self._draw_queue = []
-        self._rows = defaultdict(lambda: defaultdict(dict))
-        self._columns = defaultdict(lambda: defaultdict(dict))
-        self._animated_cells = {}
+        self._draw_queue.clear()
+        self._store.clear()
+        self._tile_cache.clear()
+        if self._lod_pyramid:
+            self._lod_pyramid.clear()
+        self._animated_cells.clear()
         self._draw_screen()
 
+    def get_tile_cache_stats(self):
+        # hits, misses, evictions and memory usage of the chunk tile cache
+        return self._tile_cache.stats()
+
+    def get_draw_queue_stats(self):
+        # depth is the number of cells waiting to be drawn.
+        # drawn is how many were drawn last frame, within budget_ms.
+        # rate is a smoothed cells per second while draining.
+        # queued and coalesced count the writes to the batch being drawn,
+        # and how many of them replaced a cell that was already queued
+        return {
+            "depth": len(self._draw_queue),
+            "drawn": self._draw_queue_drawn,
+            "budget_ms": self._draw_queue_budget,
+            "rate": self._draw_queue_rate,
+            "queued": self._draw_queue.n_queued,
+            "coalesced": self._draw_queue.n_coalesced,
+        }
+
+    def get_animation_stats(self):
+        # live is the number of running animations, and room is how many
+        # more can start before new ones are drawn instantly.
+        # time_ms is the smoothed time animating takes each frame, and
+        # cost_ms is the measured time per animation.
+        # degraded counts the animations drawn instantly because of load,
+        # shortened and finished_early count running animations that were
+        # sped up or ended, and events counts each time any of them happened
+        return {
+            "live": len(self._animated_cells),
+            "room": self._animation_room(),
+            "max_animations": self._max_animations,
+            "budget_ms": self._animation_budget,
+            "time_ms": self._animation_time,
+            "cost_ms": self._animation_cost,
+            "degraded": self._animations_degraded,
+            "shortened": self._animations_shortened,
+            "finished_early": self._animations_finished_early,
+            "events": self._animation_degrade_events,
+        }
+
+    def enable_frame_stats(self, capacity=600, hud=False,
+                           dump_path=None, dump_interval=5):
+        # record how long each phase of the event loop takes, and how many
+        # cells, draw calls, dirty rects, animations and queued cells each
+        # frame has, for the last capacity frames.
+        # if hud is True, a summary is drawn in the top left of the screen.
+        # if dump_path is given, the frames are written to it every
+        # dump_interval seconds, as csv if it ends in .csv, otherwise json
+        self.disable_frame_stats()
+        self._frame_stats = FrameStats(capacity, dump_path, dump_interval)
+        self._frame_stats_hud = hud
+        self._instrument()
+
+    def disable_frame_stats(self):
+        if not self._frame_stats:
+            return
+
+        self._uninstrument()
+        self._frame_stats = None
+
+        # wipe the hud off the screen
+        if self._hud_surface:
+            self._hud_surface = None
+            self._draw_screen()
+
+    def get_frame_stats(self):
+        # every recorded frame, oldest first, along with the mean and
+        # percentiles of each phase. times are in milliseconds
+        if not self._frame_stats:
+            return None
+        return {
+            "summary": self._frame_stats.summary(),
+            "frames": self._frame_stats.frames()
+        }
+
+    def dump_frame_stats(self, path):
+        # write the recorded frames to path, as csv or json
+        if self._frame_stats:
+            self._frame_stats.dump(path)
+
+    def snapshot(self):
+        # a checkpoint of every cell, and of what on_save returns, which
+        # undo(), redo() and restore() can go back to. returns its id.
+        # only the chunks written to after it are copied, so it is cheap
+        # to take one before every change
+        self._finish_animations()
+        return self._history.snapshot(self.on_save())
+
+    def undo(self):
+        # goes back to the last snapshot, or the one before it if nothing
+        # has changed since, then calls on_restore. what is
+        # undone can be redone until something else changes.
+        # returns False if there was nothing to undo.
+        # the timer should be stopped first
+        self._finish_animations()
+        if self._store.has_changes():
+            self.snapshot()
+        changes = self._history.undo()
+        if changes is None:
+            return False
+        self._restore_chunks(*changes)
+        return True
+
+    def redo(self):
+        # goes forward a snapshot that was undone. returns False if there
+        # is none, or if anything changed since the undo
+        self._finish_animations()
+        if self._store.has_changes():
+            self.snapshot()
+        changes = self._history.redo()
+        if changes is None:
+            return False
+        self._restore_chunks(*changes)
+        return True
+
+    def restore(self, snapshot):
+        # undoes or redoes until the grid is back at snapshot. raises
+        # ValueError if it has been forgotten
+        self._finish_animations()
+        if self._store.has_changes():
+            self.snapshot()
+        self._restore_chunks(*self._history.restore(snapshot))
+
+    def clear_history(self):
+        # forgets every snapshot, and stops keeping changed chunks
+        self._history.clear()
+
+    def get_history_stats(self):
+        # the current snapshot, how many can be undone and redone, and the
+        # bytes of cells kept for them, which is at most max_bytes other
+        # than those changed since the current snapshot
+        return self._history.stats()
+
+    def get_paging_stats(self):
+        # resident is the number of chunks in memory, and resident_bytes
+        # the size of their cells. paged is the number on disk, in a file
+        # of file_bytes. page_ins and page_outs count every chunk read back
+        # from or written to it
+        return self._store.paging_stats()
+
     def get_cell(self, cell_x, cell_y, return_bg=True):
         # get the cell at point cell_x, cell_y
         # if return_bg is True, then the background color will be returned
         # when a cell doesn't exist, rather than None
 
-        default_color = self._background_color if return_bg else None
+        index = self._store.get(cell_x, cell_y)
+        if not index:
+            return self._background_color if return_bg else None
+        return self._palette.colors[index]
+
+    def get_cells(self, region=None):
+        # a list of (cell_x, cell_y, color) for every cell, or only those
+        # in region, which is (x_start, x_end, y_start, y_end)
+        if region is None:
+            cells = []
+            for (chunk_x, chunk_y), chunk in self._store:
+                xs, ys = np.nonzero(chunk.cells)
+                indices = chunk.cells[xs, ys]
+                xs += chunk_x * self._store.chunk_size
+                ys += chunk_y * self._store.chunk_size
+                cells.extend(zip(xs.tolist(), ys.tolist(), indices.tolist()))
+        else:
+            cells = self._store.cells_in_region(*region)
+
+        colors = self._palette.colors
+        return [(cell_x, cell_y, colors[index])
+                for cell_x, cell_y, index in cells]
+
+    def save(self, path, compression=ZLIB):
+        # writes every cell to path, along with what on_save returns.
+        # cells that are animating are saved as they will end up.
+        # see grid_file.py for the format
+        self._finish_animations()
+        save_grid(path, self._store, self._palette, self.on_save(),
+                  compression)
+
+    def load(self, path, region=None, clear=True):
+        # reads cells saved with save(), then calls on_load. only the parts
+        # of the file overlapping region, (x_start, x_end, y_start, y_end),
+        # are read. if clear is False the cells are added to the grid
+        # rather than replacing it.
+        # the cells are written to the store a block at a time as they are
+        # read, and the screen is drawn once they are all in. the timer
+        # should be stopped first, and the grid started, e.g. from on_start
+        with GridReader(path) as reader:
+            lookup = np.array(
+                [EMPTY] + [self._palette.index(color)
+                           for color in reader.colors],
+                dtype=np.uint16
+            )
 
-        row = self._rows.get(cell_y, None)
-        if row:
-            chunk = row.get(cell_x // self._chunk_size, None)
-            if chunk:
-                return chunk.get(cell_x, default_color)
+            self._draw_queue.clear()
+            if clear:
+                self._store.clear()
+                self._tile_cache.clear()
+                if self._lod_pyramid:
+                    self._lod_pyramid.clear()
+                self._animated_cells.clear()
+            else:
+                self._finish_animations()
+
+            # blocks are small, so they are written in batches of
+            # at least load_batch cells
+            batch = []
+            n_batched = 0
+            for cells in reader.cells(region):
+                batch.append(cells)
+                n_batched += len(cells[0])
+                if n_batched >= self._load_batch:
+                    self._load_cells(batch, lookup)
+                    batch = []
+                    n_batched = 0
+            if batch:
+                self._load_cells(batch, lookup)
+
+            state = reader.state
 
-        return default_color
+        self._draw_screen()
+        self.on_load(state)
 
     def set_timer(self, duration):
         # duration is in seconds, multiply by 1000 for milliseconds
-        self._timer_duration = duration * 1000
+        self._timer.period = duration * 1000
+
+    def set_catch_up(self, policy, max_ticks=4):
+        # what the timer does with the ticks it falls behind on, one of
+        # timers.DROP, BATCH or CATCH_UP. BATCH is the default
+        self._timer.set_catch_up(policy, max_ticks)
+
+    def add_timer(self, name, duration, callback, catch_up=BATCH,
+                  max_ticks=4):
+        # calls callback(n_ticks) every duration seconds on the main thread,
+        # alongside the timer and any other named timers. it runs until
+        # remove_timer() is called
+        if name in self._timers:
+            raise ValueError(f"a timer named {name!r} already exists")
+        self._timers[name] = Timer(
+            duration * 1000, callback, catch_up, max_ticks
+        )
 
-    def start_timer(self, multithreaded=False):
+    def remove_timer(self, name):
+        self._timers.pop(name, None)
+
+    def get_timer_stats(self):
+        # ticks run and missed, the calls that ran them, and how late they
+        # ran (drift_ms, smoothed, and max_drift_ms) for the timer and each
+        # named timer. behind_ms is the time towards the next tick, and
+        # ready is how many ticks a threaded timer has run ahead
+        stats = {"timer": self._timer.stats()}
+        stats["timer"]["ready"] = self._published_ticks.qsize()
+        for name, timer in self._timers.items():
+            stats[name] = timer.stats()
+        return stats
+
+    def start_timer(self, multithreaded=False, simulation=None):
+        # if a simulation is given, its on_timer runs in a worker process
+        # rather than the grid's. see simulation.py
         if not self._timer_status == TIMER_INACTIVE:
             return
         self._timer_is_threaded = multithreaded
         self._timer_status = TIMER_ACTIVE
-        self._timer_progress = 0
-        if multithreaded:
+        self._timer.reset()
+        if simulation is not None:
+            self._start_simulation(simulation)
+        elif multithreaded and not self._synchronous_timers:
             self.draw_cell = self._draw_cell_threaded
             self.erase_cell = self._erase_cell_threaded
+            self.draw_cells = self._draw_cells_threaded
+            self.erase_cells = self._erase_cells_threaded
 
-            self._n_ticks = 1
             self._finish_animations()
-            self._timer_thread_busy = True
-            self._timer_event.clear()
+            self._published_ticks = queue.Queue(self._max_ticks_ahead)
             self._timer_thread = threading.Thread(target=self._timer_thread_func)
             self._timer_thread.start()
 
@@ -245,58 +678,647 @@ class PyGrid:
         if not self._timer_status == TIMER_ACTIVE:
             return
 
-        if self._timer_is_threaded:
+        if self._synchronous_timers:
+            # a threaded timer or a simulation would have called
+            # on_timer_end once it finished, so do the same after the
+            # current tick
+            self._timer_status = TIMER_INACTIVE
+            ends_later = self._timer_is_threaded \
+                or self._simulation is not None
+            if ends_later and self._ticking:
+                self._timer_end_pending = True
+            elif ends_later:
+                self._end_timer()
+
+        elif self._simulation is not None:
+            self._simulation_worker.stop()
+            self._timer_status = TIMER_ENDING
+
+        elif self._timer_is_threaded:
             self.draw_cell = self._draw_cell_mixed
             self.erase_cell = self._erase_cell_mixed
-            self._timer_event.set()
+            self.draw_cells = self._draw_cells_mixed
+            self.erase_cells = self._erase_cells_mixed
             self._timer_status = TIMER_ENDING
         else:
             self._timer_status = TIMER_INACTIVE
 
-    def start(self):
+    def update_simulation(self, **attributes):
+        # sets attributes of the running simulation, taking effect from
+        # its next tick, e.g. a speed setting. does nothing if there isn't
+        # one running, or it has been stopped
+        if self._simulation is None or self._timer_status != TIMER_ACTIVE:
+            return
+        if self._synchronous_timers:
+            self._simulation.__dict__.update(attributes)
+        else:
+            self._simulation_worker.update(attributes)
+
+    def wake(self):
+        # an idle grid only draws once something wakes it. input and the
+        # timer wake it by themselves, but other threads that change the
+        # grid should call this afterwards
+        pygame.event.post(self._wake_event)
+
+    def start(self, record=None):
+        # if record is a path, the session's input is recorded to it,
+        # to be replayed later with replay(). any program can be recorded
+        # by setting the PYGRID_RECORD environment variable to a path
+        record = record or os.environ.get("PYGRID_RECORD", None)
         pygame.init()
 
         self._create_screen()
+        if record:
+            # programs using random make the same choices when replayed
+            seed = random.randrange(1 << 32)
+            random.seed(seed)
+            self._recorder = InputRecorder(record, {
+                "program": type(self).__name__,
+                "width": self._window_width,
+                "height": self._window_height,
+                "fps": self._fps,
+                "seed": seed,
+            })
+            self._get_events = self._recorder.get_events
+            self._get_mouse_rel = self._recorder.get_mouse_rel
+        self._setup()
+
+        self._clock = pygame.time.Clock()
+        delta = 0
+
+        try:
+            while True:
+                self._handle_events()
+                self._handle_mouse_motion()
+                self._update(delta)
+                if self._recorder:
+                    self._recorder.end_frame()
+
+                if self._idle and self._is_idle():
+                    self._wait_for_input()
+                    delta = 0
+                else:
+                    delta = self._clock.tick(self._fps)
+        finally:
+            # a session that crashed is the one most worth replaying, so
+            # the recording is finished however the loop ends
+            if self._recorder:
+                self._recorder.close()
+
+    def replay(self, path, headless=False, timestep=None, realtime=False):
+        # run the grid through a session recorded with start(record=path),
+        # feeding it the recorded input frame by frame. every frame advances
+        # by timestep milliseconds, 1000 / fps by default, rather than by the
+        # time it actually took, and timers run on the main thread, so a
+        # replay does the same work every time.
+        # frames aren't waited for unless realtime is True.
+        # returns the frame stats of the replay, see get_frame_stats().
+        # each frame is timed from when it starts, so its frame time is the
+        # work it did, without the wait for it or anything else in between
+        player = InputPlayer(path, timestep)
+        inputs = (self._get_events, self._get_mouse_rel, self._get_ticks)
+        self._prepare_replay(player)
+        try:
+            if headless:
+                self.start_headless()
+            else:
+                pygame.init()
+                self._create_screen()
+                self._setup()
+            self._clock = pygame.time.Clock()
+
+            if not self._frame_stats:
+                self.enable_frame_stats(max(player.n_frames, 1))
+
+            delta = 0
+            for frame in range(player.n_frames):
+                player.frame = frame
+                self._frame_stats.start_frame()
+                self._handle_events()
+                self._handle_mouse_motion()
+                self._update(delta)
+                delta = player.timestep
+                self._clock.tick(self._fps if realtime else 0)
+        finally:
+            # the grid reads real input again afterwards
+            self._get_events, self._get_mouse_rel, self._get_ticks = inputs
+
+        return self.get_frame_stats()
+
+    def _is_idle(self):
+        # whether the next frame would do nothing unless there is input
+        return not (
+            self._x_vel or self._y_vel or self._animated_cells
+            or self._draw_queue or self._timer_status != TIMER_INACTIVE
+            or self._timers
+            or self._mouse_moved or self._lod_dirty or self._screen_changed
+            or (self._overscan and not self._lod_level
+                and not self._overscan_filled)
+        )
+
+    def _wait_for_input(self):
+        # blocks until there is input, another thread posts an event, or
+        # idle_timeout passes. the next frame handles the event that woke
+        # the loop first, then any that followed. posting it back would put
+        # it behind those, since waiting has already pumped them
+        event = pygame.event.wait(self._idle_timeout)
+        if event.type != pygame.NOEVENT:
+            self._waking_event = event
+            if self._recorder:
+                self._recorder.record([event])
+
+        # the time spent waiting isn't part of any frame, so the clock
+        # starts again rather than counting it towards the next one
+        self._clock = pygame.time.Clock()
+        if self._frame_stats is not None:
+            self._frame_stats.skip_idle()
+
+    def _prepare_replay(self, player):
+        header = player.header
+        size = (header["width"], header["height"])
+        if (self._window_width, self._window_height) != size:
+            self._set_window_size(*size)
+            self._calc_offsets()
+            self._calc_alt_offsets()
+
+        random.seed(header["seed"])
+        self._synchronous_timers = True
+        self._get_events = player.get_events
+        self._get_mouse_rel = player.get_mouse_rel
+        self._get_ticks = player.get_ticks
+
+    def _update(self, delta):
+        # everything the event loop does each frame, other than input
+        if self._x_vel or self._y_vel:
+            self._apply_velocity(delta / 1000)
+
+        if self._animated_cells:
+            self._animate_cells(delta / 1000)
+
+        if self._draw_queue:
+            self._process_draw_queue()
+        else:
+            self._draw_queue_time = 0
+
+        if self._lod_dirty:
+            self._lod_dirty = False
+            self._draw_lod()
+
+        if self._timer_status == TIMER_ACTIVE or self._timers:
+            self._increment_timer(delta)
+        elif self._timer_status == TIMER_ENDING:
+            # a stopped thread or worker may still be waiting to publish
+            # its last tick
+            self._apply_published_ticks()
+        if self._simulation is not None and self._timer_status != \
+                TIMER_INACTIVE and not self._synchronous_timers:
+            self._check_simulation_end()
+
+        if self._screen_changed:
+            self._screen_changed = False
+            self._present()
+
+        if self._overscan and not self._lod_level:
+            self._fill_overscan()
+
+        if self._store.paging:
+            self._store.page_out(self._working_set())
+
+    def _working_set(self):
+        # the cells of the render zone, whose chunks are kept in memory.
+        # in level of detail mode chunks aren't drawn, so none are kept
+        if self._lod_level:
+            return None
+
+        return (
+            math.floor(self._pos_x
+                       + self._render_bound_left / self._cell_size),
+            math.ceil(self._pos_x
+                      + self._render_bound_right / self._cell_size) + 1,
+            math.floor(self._pos_y
+                       + self._render_bound_top / self._cell_size),
+            math.ceil(self._pos_y
+                      + self._render_bound_bottom / self._cell_size) + 1
+        )
+
+    def start_headless(self, render=True, synchronous=True):
+        # set the grid up without a window, for servers, tests and benchmarks.
+        # cells are drawn to an in-memory surface, or not at all if render
+        # is False, in which case only the cell store is kept up to date.
+        # the grid is then driven by calling run_ticks().
+        # if synchronous is False, timers and simulations run on their own
+        # thread or process and animations are budgeted by the clock, as
+        # they are on screen. the grid is then driven frame by frame, as
+        # the benchmarks do, rather than by run_ticks()
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        pygame.init()
+
+        # frame stats enabled beforehand wrap the methods being replaced,
+        # so they are taken off and then wrapped around the replacements
+        instrumented = self._frame_stats is not None
+        if instrumented:
+            self._uninstrument()
+
+        self._headless = True
+        self._rendering = render
+        if synchronous:
+            self._synchronous_timers = True
+        self._present = self._present_headless
+        self._clock = pygame.time.Clock()
+        self._create_screen()
+
+        if not render:
+            self._animations_enabled = False
+            self._draw_cell = self._draw_nothing
+            self._draw_cells = self._draw_nothing
+            self._draw_screen = self._draw_nothing
+            self._draw_lod = self._draw_nothing
+
+        if instrumented:
+            self._instrument()
+
+        self._setup()
+
+    def run_ticks(self, n_ticks=None):
+        # call on_timer as fast as possible, until the timer is stopped or
+        # n_ticks have passed. animations advance by the timer duration each
+        # tick. returns the number of ticks run
+        ticks = 0
+        while self._timer_status == TIMER_ACTIVE:
+            if n_ticks is not None and ticks >= n_ticks:
+                break
+
+            if self._animated_cells:
+                self._animate_cells(self._timer.period / 1000)
+
+            self._tick(1)
+            ticks += 1
+            if self._timers:
+                self._run_named_timers(self._timer.period)
+
+            while self._draw_queue:
+                self._draw_cell(*self._draw_queue.pop())
+
+            if self._lod_dirty:
+                self._lod_dirty = False
+                self._draw_lod()
+
+            # a tick stands in for a frame, so the store is kept within
+            # max_resident_chunks the same way
+            if self._store.paging:
+                self._store.page_out(self._working_set())
+
+        return ticks
+
+    def run_headless(self, n_ticks=None, render=True):
+        self.start_headless(render)
+        return self.run_ticks(n_ticks)
+
+    def _setup(self):
         self._apply_grid_effects()
         self._create_grid_lines()
+        if self._overscan:
+            self._start_view()
         self._calc_n_rows()
         self._calc_n_columns()
         self._calc_render_zone()
         self.on_start()
-        self._left_offset = self._grid_thickness // 2
-        self._top_offset = self._grid_thickness // 2
+        if not self._overscan:
+            self._left_offset = self._grid_thickness // 2
+            self._top_offset = self._grid_thickness // 2
         self._draw_screen()
 
-        self._clock = pygame.time.Clock()
-        delta = 0
+    def _start_view(self):
+        # the window starts overscan pixels into the back buffer, so the
+        # back buffer starts that far above and to the left of the grid's
+        # origin. the window then shows the same cells it would without
+        # overscan, including the half grid line it starts with
+        nudge = self._grid_thickness // 2
+        self._view_x = self._overscan
+        self._view_y = self._overscan
+        self._pos_x = -self._view_x / self._cell_size
+        self._pos_y = -self._view_y / self._cell_size
+        self._left_offset = -self._view_x % self._cell_size + nudge
+        self._top_offset = -self._view_y % self._cell_size + nudge
+        self._calc_alt_offsets()
 
-        while True:
-            self._handle_events()
-            self._handle_mouse_motion()
+    def _draw_nothing(self, *args, **kwargs):
+        pass
 
-            if self._x_vel or self._y_vel:
-                self._apply_velocity(delta / 1000)
+    def _present_headless(self):
+        # there is no window to show the screen on
+        self._dirty_rects = []
+        self._full_redraw = False
 
-            if self._animated_cells:
-                self._animate_cells(delta / 1000)
+    def _tick(self, n_ticks):
+        # call on_timer on the main thread
+        self._ticking = True
+        try:
+            if self._simulation is not None:
+                self._tick_simulation(n_ticks)
+            else:
+                self.on_timer(n_ticks)
+        finally:
+            self._ticking = False
+
+        if self._timer_end_pending:
+            self._timer_end_pending = False
+            self._end_timer()
+
+    def _end_timer(self):
+        # a timer that runs its ticks elsewhere has finished them all
+        if self._simulation is not None:
+            if self._synchronous_timers:
+                self._simulation._end_run()
+            self._simulation = None
+        self.on_timer_end()
+
+    def _start_simulation(self, simulation):
+        self._simulation = simulation
+        if self._synchronous_timers:
+            # replays and headless grids tick the simulation themselves
+            simulation._begin_run()
+            self._simulation_lookup = [0]
+            return
 
-            if self._draw_queue:
-                self._process_draw_queue()
+        if self._simulation_worker is None:
+            self._simulation_worker = SimulationWorker(
+                self._palette, n_records=max(self._max_ticks_ahead, 1)
+            )
+        self._finish_animations()
+        self._simulation_worker.start(simulation)
+        self._published_ticks = self._simulation_worker
+
+    def _tick_simulation(self, n_ticks):
+        simulation = self._simulation
+        simulation.on_timer(n_ticks)
+        (xs, ys, ids), new_colors = simulation._take_tick()
+
+        lookup = self._simulation_lookup
+        lookup.extend(self._palette.index(color) for color in new_colors)
+        self._apply_changes((xs, ys, np.array(lookup, np.uint16)[ids]))
+        if simulation._stopped:
+            self.stop_timer()
+
+    def _check_simulation_end(self):
+        # once the worker has ended and every tick it published has been
+        # applied, the timer ends the same way a thread's does
+        # if the worker process died, the timer still ends, and then the
+        # error is raised here as it would be from on_timer
+        worker = self._simulation_worker
+        if worker.ended and worker.empty():
+            self._timer_status = TIMER_INACTIVE
+            self._published_ticks = queue.Queue(self._max_ticks_ahead)
+            pygame.event.post(self._timer_end_event)
+            if worker.error:
+                raise RuntimeError(
+                    f"the simulation's worker process failed:\n{worker.error}"
+                )
 
-            if self._timer_status == TIMER_ACTIVE:
-                self._increment_timer(delta)
+    def _draw_screen(self):
+        if self._lod_level:
+            self._draw_lod()
+            return
 
-            if self._screen_changed:
-                self._screen_changed = False
-                pygame.display.flip()
+        if self._overscan:
+            # only the part of the back buffer the window shows is drawn
+            # now. the margin around it is filled in over the next frames
+            view = self._view_rect()
+            self._draw_area(view)
+            self._overscan_valid = view
+        else:
+            if self._screen_rows * self._screen_columns \
+                    > self._framebuffer_threshold \
+                    and self._screen.get_bytesize() == 4:
+                self._draw_screen_framebuffer()
+            else:
+                self._draw_rows_cells(0, self._screen_rows)
+            self._draw_grid()
+        self._screen_changed = True
+        self._full_redraw = True
 
-            delta = self._clock.tick(self._fps)
+    def _present(self):
+        rects = self._dirty_rects
+        self._dirty_rects = []
 
+        if self._full_redraw or not rects \
+                or len(rects) > self._max_dirty_rects:
+            self._full_redraw = False
+            self._show_view()
+            pygame.display.flip()
+            return
 
-    def _draw_screen(self):
-        self._draw_rows_cells(0, self._n_rows)
-        self._draw_grid()
+        if self._overscan:
+            rects = self._view_rects(rects)
+        rects = merge_rects(rects, self._dirty_block_size)
+        area = sum(w * h for x, y, w, h in rects)
+        if area > self._window_width * self._window_height \
+                * self._dirty_threshold:
+            self._show_view()
+            pygame.display.flip()
+        else:
+            self._show_view(rects)
+            pygame.display.update(rects)
+
+    def _show_view(self, rects=None):
+        # with overscan, copies the part of the back buffer at the view to
+        # the window, or only the given rects of the window
+        if not self._overscan:
+            return
+
+        x, y = self._view_origin()
+        if rects is None:
+            self._display.blit(
+                self._screen, (0, 0),
+                (x, y, self._window_width, self._window_height)
+            )
+        else:
+            self._display.blits([
+                (self._screen, rect, pygame.Rect(rect).move(x, y))
+                for rect in rects
+            ], False)
+
+    def _view_rects(self, rects):
+        # moves rects of the back buffer into window coordinates, leaving
+        # out the parts in the margin
+        x, y = self._view_origin()
+        window = self._display.get_rect()
+        moved = []
+        for rect in rects:
+            rect = pygame.Rect(rect).move(-x, -y).clip(window)
+            if rect.width and rect.height:
+                moved.append(rect)
+        return moved
+
+    def _instrument(self):
+        stats = self._frame_stats
+
+        def wrap(name, wrapper):
+            # the instance may already have its own version of a method,
+            # e.g. when headless, so remember exactly what to restore
+            if name not in self._uninstrumented:
+                self._uninstrumented[name] = self.__dict__.get(name, None)
+            setattr(self, name, wrapper(getattr(self, name)))
+
+        def timed(phase):
+            def wrapper(method):
+                def timed_method(*args, **kwargs):
+                    start = time.perf_counter()
+                    result = method(*args, **kwargs)
+                    stats.times[phase] += time.perf_counter() - start
+                    return result
+                return timed_method
+            return wrapper
+
+        def counted(count):
+            def wrapper(method):
+                def counted_method(*args, **kwargs):
+                    stats.counts[CELLS_DRAWN] += count(*args)
+                    stats.counts[DRAW_CALLS] += 1
+                    return method(*args, **kwargs)
+                return counted_method
+            return wrapper
+
+        # methods are wrapped for counting first, so that time spent
+        # counting is included in the phase that drew the cells
+        wrap("_draw_cell", counted(lambda *args: 1))
+        wrap("_draw_cells", counted(lambda xs, ys, indices: len(xs)))
+        wrap("_draw_region_cells", counted(self._store.count_in_region))
+        wrap("_draw_screen_framebuffer", counted(
+            lambda rect=None:
+                (self._screen_rows + 1) * (self._screen_columns + 1)
+            if rect is None else (rect[2] // self._cell_size + 2)
+            * (rect[3] // self._cell_size + 2)
+        ))
+        wrap("_draw_animation_frames", counted(
+            lambda rows, perc, colors: len(rows)
+        ))
+
+        phase_methods = (
+            "_handle_events", "_handle_mouse_motion", "_apply_velocity",
+            "_animate_cells", "_process_draw_queue", "_draw_lod",
+            "_increment_timer", "_present", "_fill_overscan"
+        )
+        for phase, name in enumerate(phase_methods):
+            wrap(name, timed(phase))
+
+        def present_with_hud(present):
+            def wrapper():
+                stats.counts[RECTS] += len(self._dirty_rects)
+                if not self._frame_stats_hud:
+                    present()
+                    return
+
+                # the hud is only drawn for as long as it is presented,
+                # so that panning never scrolls it into the grid
+                rect = self._draw_frame_stats_hud()
+                under = self._screen.subsurface(rect).copy()
+                self._screen.blit(self._hud_surface, rect)
+                present()
+                self._screen.blit(under, rect)
+            return wrapper
+        wrap("_present", present_with_hud)
+
+        def update_with_stats(update):
+            def wrapper(delta):
+                if self._frame_stats_hud:
+                    self._screen_changed = True
+                update(delta)
+                stats.end_frame(
+                    len(self._animated_cells), len(self._draw_queue)
+                )
+            return wrapper
+        wrap("_update", update_with_stats)
+
+    def _uninstrument(self):
+        for name, method in self._uninstrumented.items():
+            if method is None:
+                delattr(self, name)
+            else:
+                setattr(self, name, method)
+        self._uninstrumented = {}
+
+    def _draw_frame_stats_hud(self):
+        # re-render the hud text a few times a second. returns its rect
+        now = time.perf_counter()
+        if self._hud_surface is None or now - self._hud_updated >= 0.25:
+            self._hud_updated = now
+            font = pygame.font.Font(None, 18)
+            lines = [
+                font.render(line, True, (255, 255, 255))
+                for line in self._frame_stats.hud_lines()
+            ]
+            width = max((line.get_width() for line in lines), default=0)
+            height = sum(line.get_height() for line in lines)
+
+            # the hud never shrinks, so it always covers what it drew before
+            if self._hud_surface:
+                width = max(width, self._hud_surface.get_width())
+                height = max(height, self._hud_surface.get_height())
+            width = min(width + 8, self._window_width)
+            height = min(height + 8, self._window_height)
+
+            self._hud_surface = pygame.Surface((width, height))
+            y = 4
+            for line in lines:
+                self._hud_surface.blit(line, (4, y))
+                y += line.get_height()
+
+        rect = self._hud_surface.get_rect(topleft=self._view_origin())
+        self._dirty_rects.append(rect)
+        return rect
+
+    def _draw_lod(self):
+        scale = 1 << self._lod_level
+        pixels = self._lod_pyramid.render(
+            self._lod_level,
+            math.floor(self._pos_x / scale),
+            math.floor(self._pos_y / scale),
+            self._width, self._height,
+            self._background_color
+        )
+        pygame.surfarray.blit_array(self._screen, pixels)
         self._screen_changed = True
+        self._full_redraw = True
+
+    def _draw_screen_framebuffer(self, rect=None):
+        # draws the whole screen, or only rect of it
+        x, y, width, height = rect or (0, 0, self._width, self._height)
+        left = x + self._left_offset
+        top = y + self._top_offset
+        origin_x = math.floor(self._pos_x) + left // self._cell_size
+        origin_y = math.floor(self._pos_y) + top // self._cell_size
+        left %= self._cell_size
+        top %= self._cell_size
+        n_columns = (width + left) // self._cell_size + 1
+        n_rows = (height + top) // self._cell_size + 1
+
+        # copy the visible part of every chunk into one array of
+        # palette indices, with one element per visible cell
+        cells = np.zeros((n_columns, n_rows), dtype=np.uint16)
+        for chunk_x, chunk_y, chunk in self._store.chunks_in_region(
+                origin_x, origin_x + n_columns,
+                origin_y, origin_y + n_rows):
+            x = chunk_x * self._chunk_size - origin_x
+            y = chunk_y * self._chunk_size - origin_y
+            x_start = max(x, 0)
+            y_start = max(y, 0)
+            x_end = min(x + self._chunk_size, n_columns)
+            y_end = min(y + self._chunk_size, n_rows)
+            cells[x_start:x_end, y_start:y_end] = chunk.cells[
+                x_start - x:x_end - x, y_start - y:y_end - y
+            ]
+
+        # convert indices to pixels, then scale each cell up to its size
+        colors = self._palette.mapped_array(self._background_index)[cells]
+        pixels = np.repeat(
+            np.repeat(colors, self._cell_size, axis=0),
+            self._cell_size, axis=1
+        )
+        pygame.surfarray.blit_array(
+            self._screen if rect is None else self._screen.subsurface(rect),
+            pixels[left:left + width, top:top + height]
+        )
 
     def _calc_render_zone(self):
         self._render_bound_left = -self._width * 0.2
@@ -305,6 +1327,10 @@ class PyGrid:
         self._render_bound_bottom = self._height * 1.2
 
     def _in_render_zone(self, cell_x, cell_y):
+        # cells aren't drawn individually in level of detail mode
+        if self._lod_level:
+            return False
+
         x = (cell_x - self._pos_x) * self._cell_size
         if self._render_bound_left < x < self._render_bound_right:
 
@@ -314,46 +1340,164 @@ class PyGrid:
 
         return False
 
+    def _render_zone_mask(self, xs, ys):
+        # vectorised _in_render_zone for arrays of cells
+        if self._lod_level:
+            return np.zeros(len(xs), dtype=bool)
+
+        x = (xs - self._pos_x) * self._cell_size
+        y = (ys - self._pos_y) * self._cell_size
+        return (self._render_bound_left < x) & (x < self._render_bound_right) \
+            & (self._render_bound_top < y) & (y < self._render_bound_bottom)
+
     def _increment_timer(self, delta):
-        self._timer_progress += delta
-        if self._timer_progress >= self._timer_duration:
-            if not self._timer_thread_busy and not self._draw_queue:
-                self._n_ticks = int(self._timer_progress / self._timer_duration)
-                self._timer_progress %= self._timer_duration
-                if self._timer_is_threaded:
-                    self._timer_thread_busy = True
-                    self._timer_event.set()
-                    self._timer_event.clear()
-                else:
-                    self.on_timer(self._n_ticks)
+        if self._timers:
+            self._run_named_timers(delta)
+        if self._timer_status != TIMER_ACTIVE:
+            return
 
-    def _timer_thread_func(self):
-        while self._timer_status == TIMER_ACTIVE:
-            self.on_timer(self._n_ticks)
+        # ticks that come due before the timer thread has finished one, or
+        # while the last tick's cells are still being drawn, wait for them,
+        # and are then dealt with by the catch-up policy
+        timer = self._timer
+        timer.advance(delta)
+        threaded = (self._timer_is_threaded or self._simulation is not None) \
+            and not self._synchronous_timers
+        if not timer.due() or self._draw_queue \
+                or (threaded and self._published_ticks.empty()):
+            return
 
-            self._draw_queue = self._next_draw_queue
-            self._next_draw_queue = []
+        calls = timer.take()
+        if threaded:
+            timer.settle(calls, self._apply_published_ticks(sum(calls)))
+        else:
+            for n_ticks in calls:
+                if self._timer_status != TIMER_ACTIVE:
+                    break
+                self._tick(n_ticks)
+
+    def _run_named_timers(self, delta):
+        # a callback can add or remove timers, including its own
+        for timer in list(self._timers.values()):
+            timer.advance(delta)
+            if timer.due():
+                for n_ticks in timer.take():
+                    timer.callback(n_ticks)
 
-            self._timer_thread_busy = False
-            self._timer_event.wait()
+    def _timer_thread_func(self):
+        # runs ticks until the timer is stopped, blocking whenever
+        # max_ticks_ahead of them are waiting to be applied
+        while self._timer_status == TIMER_ACTIVE:
+            self._tick_changes = ChangeBuffer()
+            self.on_timer(1)
+            self._publish_tick(self._tick_changes.arrays())
 
         self.draw_cell = self._draw_cell_threadless
         self.erase_cell = self._erase_cell_threadless
+        self.draw_cells = self._draw_cells_threadless
+        self.erase_cells = self._erase_cells_threadless
         pygame.event.post(self._timer_end_event)
         self._timer_status = TIMER_INACTIVE
 
+    def _publish_tick(self, changes):
+        # a tick that was run has to be applied, even once the timer is
+        # stopped, unless the grid is exiting.
+        # changes are the xs, ys and indices of the cells the tick changed
+        while True:
+            try:
+                self._published_ticks.put(changes, timeout=0.1)
+                return
+            except queue.Full:
+                if self._timer_status == TIMER_INACTIVE:
+                    return
+
+    def _apply_published_ticks(self, n_ticks=None):
+        # applies up to n_ticks of the ticks the timer thread has
+        # published, or all of them, returning how many were applied
+        applied = 0
+        while n_ticks is None or applied < n_ticks:
+            try:
+                changes = self._published_ticks.get_nowait()
+            except queue.Empty:
+                break
+            self._apply_changes(changes)
+            applied += 1
+        return applied
+
+    def _apply_changes(self, changes):
+        # writes a tick's changes to the store in one batch, and queues the
+        # ones in the render zone to be drawn. erased cells are written as
+        # index 0, which the store deletes
+        xs, ys, indices = changes
+        if not len(xs):
+            return
+
+        self._end_animations(xs, ys)
+        if self._lod_pyramid:
+            old_indices = self._store.get_many(xs, ys)
+        self._store.set_many(xs, ys, indices, unique=True)
+        if self._lod_pyramid:
+            self._lod_pyramid.update(xs, ys, old_indices, indices)
+            self._lod_dirty = bool(self._lod_level)
+
+        indices = np.where(indices == EMPTY, self._background_index, indices)
+        self._queue_cells(xs, ys, indices)
+
+    def _join_timer_thread(self):
+        # waits for a stopped timer thread to finish, applying what it
+        # publishes so that it never waits on the main thread for room
+        while self._timer_thread.is_alive():
+            self._apply_published_ticks()
+            self._timer_thread.join(0.001)
+        self._apply_published_ticks()
+
+    def _join_simulation(self):
+        # the same for a stopped simulation's worker, which has ended once
+        # it has written its last tick
+        worker = self._simulation_worker
+        while not worker.ended:
+            self._apply_published_ticks()
+            time.sleep(0.001)
+        self._check_simulation_end()
+
     def _process_draw_queue(self):
-        max_tick = pygame.time.get_ticks() + self._frame_delta
+        # work out how much of the frame is left over once everything other
+        # than the draw queue has run, based on the previous frames.
+        # drawing the overscan margin only uses what the queue leaves over
+        frame_work = max(
+            self._clock.get_rawtime() - self._draw_queue_time
+            - self._overscan_time, 0
+        )
+        self._frame_work = self._frame_work * 0.9 + frame_work * 0.1
+        self._draw_queue_budget = max(
+            (self._frame_period - self._frame_work) * 0.9, 1
+        )
 
-        while pygame.time.get_ticks() < max_tick:
-            for i in range(min(len(self._draw_queue), 100)):
-                cell_x, cell_y, color = self._draw_queue.pop(0)
-                self._draw_cell(cell_x, cell_y, color)
+        queue = self._draw_queue
+        start = time.perf_counter()
+        deadline = start + self._draw_queue_budget / 1000
+        n_drawn = 0
 
-            if not self._draw_queue:
+        while True:
+            n = min(len(queue), 100)
+            for i in range(n):
+                self._draw_cell(*queue.pop())
+            n_drawn += n
+
+            if not queue:
                 self._screen_changed = True
                 break
 
+            if time.perf_counter() >= deadline:
+                break
+
+        elapsed = time.perf_counter() - start
+        self._draw_queue_time = elapsed * 1000
+        self._draw_queue_drawn = n_drawn
+        if elapsed:
+            self._draw_queue_rate = self._draw_queue_rate * 0.9 \
+                + n_drawn / elapsed * 0.1
+
     def _generate_window_size(self):
         # if screen width and height is already set, use those
         if self._width and self._height:
@@ -371,15 +1515,38 @@ class PyGrid:
             self._width = 800
             self._height = 600
 
+    def _set_window_size(self, w, h):
+        # with overscan, the screen everything is drawn to is larger than
+        # the window by the margin on every side
+        self._window_width = w
+        self._window_height = h
+        self._width = w + self._overscan * 2
+        self._height = h + self._overscan * 2
+
     def _create_screen(self):
-        if self._allowed_resize:
-            self._screen = pygame.display.set_mode(
-                (self._width, self._height), pygame.RESIZABLE
+        size = (self._window_width, self._window_height)
+        if self._headless:
+            self._display = pygame.Surface(size)
+        elif self._allowed_resize:
+            self._display = pygame.display.set_mode(size, pygame.RESIZABLE)
+        else:
+            self._display = pygame.display.set_mode(size)
+        self._create_back_buffer()
+
+    def _create_back_buffer(self):
+        if self._overscan:
+            self._screen = pygame.Surface(
+                (self._width, self._height), 0, self._display
             )
         else:
-            self._screen = pygame.display.set_mode((self._width, self._height))
+            self._screen = self._display
+        self._palette.map_surface(self._screen)
 
     def _draw_cell(self, cell_x, cell_y, color, draw_grid=True):
+        # in level of detail mode, changed cells mark the pyramid dirty instead
+        if self._lod_level:
+            return
+
         x = (cell_x - math.floor(self._pos_x)) * \
             self._cell_size - self._left_offset
         y = (cell_y - math.floor(self._pos_y)) * \
@@ -390,50 +1557,192 @@ class PyGrid:
             color,
             (x, y, self._cell_size, self._cell_size)
         )
+        self._dirty_rects.append((x, y, self._cell_size, self._cell_size))
 
         if draw_grid and self._grid_thickness:
             self._screen.blit(self._cell_borders, (x, y))
 
-    def _add_cell(self, cell_x, cell_y, color):
-        chunk_x, chunk_y = self._get_chunk(cell_x, cell_y)
-        self._columns[cell_x][chunk_y][cell_y] = color
-        self._rows[cell_y][chunk_x][cell_x] = color
+    def _add_cell(self, cell_x, cell_y, index):
+        old_index = self._store.set(cell_x, cell_y, index)
+        if self._lod_pyramid:
+            self._lod_pyramid.update_cell(cell_x, cell_y, old_index, index)
+            self._lod_dirty = bool(self._lod_level)
+
+    def _add_cells(self, xs, ys, indices):
+        if not self._lod_pyramid:
+            self._store.set_many(xs, ys, indices)
+            return
+
+        # the pyramid needs each cell's old and new index, so only the
+        # last write to each cell is kept
+        xs, ys, indices = self._last_writes(xs, ys, indices)
+        old_indices = self._store.get_many(xs, ys)
+        self._store.set_many(xs, ys, indices, unique=True)
+        self._lod_pyramid.update(xs, ys, old_indices, indices)
+        self._lod_dirty = bool(self._lod_level)
+
+    def _delete_cells(self, xs, ys):
+        if not self._lod_pyramid:
+            self._store.delete_many(xs, ys)
+            return
+
+        xs, ys, _ = self._last_writes(xs, ys, 0)
+        old_indices = self._store.get_many(xs, ys)
+        self._store.delete_many(xs, ys)
+        self._lod_pyramid.update(
+            xs, ys, old_indices, np.zeros_like(old_indices)
+        )
+        self._lod_dirty = bool(self._lod_level)
+
+    def _restore_chunks(self, installed, replaced):
+        # the store has had the chunks that were replaced swapped for the
+        # installed ones. the pyramid is updated with the cells that
+        # differ, and only the chunks on the screen that changed are drawn
+        shift = self._store._shift
+        empty = np.zeros((self._chunk_size, self._chunk_size), np.uint16)
+        changed = []
+        xs, ys, old_indices, new_indices = [], [], [], []
+        for key, chunk in installed.items():
+            old = replaced[key]
+            new_cells = empty if chunk is None else chunk.cells
+            old_cells = empty if old is None else old.cells
+            local_xs, local_ys = np.nonzero(new_cells != old_cells)
+            if not len(local_xs):
+                continue
+
+            changed.append(key)
+            xs.append((key[0] << shift) + local_xs)
+            ys.append((key[1] << shift) + local_ys)
+            old_indices.append(old_cells[local_xs, local_ys])
+            new_indices.append(new_cells[local_xs, local_ys])
+
+        cells = []
+        if changed:
+            xs, ys = np.concatenate(xs), np.concatenate(ys)
+            new_indices = np.concatenate(new_indices)
+            if self._lod_pyramid:
+                self._lod_pyramid.update(
+                    xs, ys, np.concatenate(old_indices), new_indices
+                )
+            colors = self._palette.colors
+            cells = list(zip(
+                xs.tolist(), ys.tolist(),
+                [colors[index] for index in new_indices.tolist()]
+            ))
+
+        if self._draw_queue:
+            self._draw_queue.discard_chunks(set(changed), shift)
+        self._redraw_chunks(changed)
+        self.on_restore(self._history.state, cells)
+
+    def _redraw_chunks(self, keys):
+        if self._lod_level:
+            self._lod_dirty = self._lod_dirty or bool(keys)
+            return
+
+        screen = self._screen.get_rect()
+        chunk_pixels = self._chunk_size * self._cell_size
+        origin_x = math.floor(self._pos_x)
+        origin_y = math.floor(self._pos_y)
+        rects = []
+        for chunk_x, chunk_y in keys:
+            rect = pygame.Rect(
+                (chunk_x * self._chunk_size - origin_x) * self._cell_size
+                - self._left_offset,
+                (chunk_y * self._chunk_size - origin_y) * self._cell_size
+                - self._top_offset,
+                chunk_pixels, chunk_pixels
+            ).clip(screen)
+            if rect.width and rect.height:
+                rects.append(rect)
+
+        # past a point, drawing the chunks one by one is slower than
+        # drawing the whole screen
+        area = sum(rect.width * rect.height for rect in rects)
+        if area > screen.width * screen.height * self._dirty_threshold:
+            self._draw_screen()
+            return
+
+        for rect in rects:
+            self._draw_area(rect)
+        self._dirty_rects.extend(rects)
+        self._screen_changed = bool(rects) or self._screen_changed
+
+    def _load_cells(self, batch, lookup):
+        # writes a batch of cells read by load() to the store
+        xs, ys, indices = (np.concatenate(arrays) for arrays in zip(*batch))
+        indices = lookup[indices]
+        if self._lod_pyramid:
+            old_indices = self._store.get_many(xs, ys)
+        self._store.set_many(xs, ys, indices, unique=True)
+        if self._lod_pyramid:
+            self._lod_pyramid.update(xs, ys, old_indices, indices)
+
+    def _last_writes(self, xs, ys, indices):
+        keys = (xs << 32) | (ys & 0xFFFFFFFF)
+        _, last = np.unique(keys[::-1], return_index=True)
+        last = len(keys) - 1 - last
+        if np.ndim(indices):
+            return xs[last], ys[last], indices[last]
+        return xs[last], ys[last], np.full(len(last), indices, np.uint16)
 
     def _end_animation(self, cell_x, cell_y):
-        try:
-            del self._animated_cells[(cell_x, cell_y)]
-        except KeyError:
-            pass
-
-    def _start_animation(self, cell_x, cell_y, target_color, duration, animation_type=0, erase_on_complete=False):
-        current_animation = self._animated_cells.get((cell_x, cell_y), None)
-        if current_animation:
-            if current_animation[ORIGINAL_COLOR] == target_color:
-                current_animation[ORIGINAL_COLOR], current_animation[TARGET_COLOR] = \
-                    current_animation[TARGET_COLOR], target_color
-                perc = max(0, 1 - current_animation[PROGRESS] / current_animation[DURATION])
-                current_animation[PROGRESS] = duration * perc
-                current_animation[DURATION] = duration
-                current_animation[DELETING] = erase_on_complete
-                return
-            elif current_animation[TARGET_COLOR] == target_color:
-                return
+        self._animated_cells.remove(cell_x, cell_y)
 
-            else:
-                original_color = current_animation[CURRENT_COLOR]
+    def _start_animation(self, cell_x, cell_y, target_index, duration, animation_type=0, erase_on_complete=False):
+        target_color = self._palette.colors[target_index]
+        if self._animated_cells.restart(cell_x, cell_y, target_index,
+                                        target_color, duration,
+                                        animation_type, erase_on_complete):
+            return
 
-                self._animated_cells[(cell_x, cell_y)] = [
-                    original_color, original_color, target_color,
-                    animation_type, 0, duration, erase_on_complete
-                ]
-                return
+        original_index = self._store.get(cell_x, cell_y) or self._background_index
+        if original_index != target_index:
+            self._animated_cells.add(
+                cell_x, cell_y, original_index, target_index,
+                self._palette.colors[original_index], target_color,
+                duration, animation_type, erase_on_complete
+            )
+
+    def _start_animations(self, xs, ys, target_indices, duration,
+                          animation_type=0, erase_on_complete=False):
+        # _start_animation for many cells. cells that are already animated
+        # are restarted one by one, the rest are added in one step
+        animated = self._animated_cells
+        if animated:
+            target_indices = np.broadcast_to(target_indices, xs.shape)
+            restarted = np.fromiter(
+                (
+                    animated.restart(cell_x, cell_y, index,
+                                     self._palette.colors[index], duration,
+                                     animation_type, erase_on_complete)
+                    for cell_x, cell_y, index in zip(
+                        xs.tolist(), ys.tolist(), target_indices.tolist()
+                    )
+                ),
+                bool, len(xs)
+            )
+            xs = xs[~restarted]
+            ys = ys[~restarted]
+            target_indices = target_indices[~restarted]
+
+        xs, ys, target_indices = self._last_writes(xs, ys, target_indices)
+        original_indices = self._store.get_many(xs, ys)
+        original_indices[original_indices == 0] = self._background_index
+        changed = original_indices != target_indices
+        if not changed.any():
+            return
 
-        original_color = self.get_cell(cell_x, cell_y)
-        if original_color != target_color:
-            self._animated_cells[(cell_x, cell_y)] = [
-                    original_color, original_color, target_color,
-                    animation_type, 0, duration, erase_on_complete
-                ]
+        xs = xs[changed]
+        ys = ys[changed]
+        original_indices = original_indices[changed]
+        target_indices = target_indices[changed]
+        rgb = self._palette.rgb_array()
+        animated.add_many(
+            xs, ys, original_indices, target_indices,
+            rgb[original_indices], rgb[target_indices],
+            duration, animation_type, erase_on_complete
+        )
 
     def _draw_cell_mixed(self, cell_x, cell_y, color, animate=False):
         if threading.current_thread() is self._main_thread:
@@ -442,18 +1751,57 @@ class PyGrid:
             self._draw_cell_threaded(cell_x, cell_y, color)
 
     def _draw_cell_threadless(self, cell_x, cell_y, color, animation=None):
-        if animation:
-            self._start_animation(cell_x, cell_y, color, *animation)
+        index = self._palette.index(color)
+        if animation and self._animates(cell_x, cell_y):
+            self._start_animation(cell_x, cell_y, index, *animation)
         else:
             self._end_animation(cell_x, cell_y)
             self._screen_changed = True
-            self._add_cell(cell_x, cell_y, color)
-            self._draw_cell(cell_x, cell_y, color)
+            self._add_cell(cell_x, cell_y, index)
+            self._draw_cell(cell_x, cell_y, self._palette.mapped[index])
+
+    def _animates(self, cell_x, cell_y):
+        # cells outside the render zone skip straight to their target, since
+        # an animation nobody can see would only cost time
+        if not self._animations_enabled \
+                or not self._in_render_zone(cell_x, cell_y):
+            return False
+
+        # restarting an animation doesn't add to the load
+        if (cell_x, cell_y) in self._animated_cells \
+                or self._animation_room():
+            return True
+
+        self._degrade_animations(1)
+        return False
+
+    def _admit_animations(self, animate):
+        # of the cells in the animate mask, only as many as there is room
+        # for are animated. the rest are drawn instantly
+        wanted = np.flatnonzero(animate)
+        room = self._animation_room()
+        if len(wanted) > room:
+            animate[wanted[room:]] = False
+            self._degrade_animations(len(wanted) - room)
+        return animate
+
+    def _animation_room(self):
+        limit = self._max_animations
+        if self._animation_cost:
+            limit = min(limit, int(self._animation_budget / self._animation_cost))
+        return max(limit - len(self._animated_cells), 0)
+
+    def _degrade_animations(self, n):
+        self._animations_degraded += n
+        self._count_degrade_event(n)
+
+    def _count_degrade_event(self, n):
+        self._animation_degrade_events += 1
+        if self._frame_stats is not None:
+            self._frame_stats.counts[DEGRADED] += n
 
     def _draw_cell_threaded(self, cell_x, cell_y, color):
-        self._add_cell(cell_x, cell_y, color)
-        if self._in_render_zone(cell_x, cell_y):
-            self._next_draw_queue.append((cell_x, cell_y, color))
+        self._tick_changes.add(cell_x, cell_y, self._palette.index(color))
 
     def _erase_cell_mixed(self, cell_x, cell_y, animation=None):
         if threading.current_thread() is self._main_thread:
@@ -462,10 +1810,10 @@ class PyGrid:
             self._erase_cell_threaded(cell_x, cell_y)
 
     def _erase_cell_threadless(self, cell_x, cell_y, animation=None):
-        if animation:
+        if animation and self._animates(cell_x, cell_y):
             self._start_animation(
                 cell_x, cell_y,
-                self._background_color,
+                self._background_index,
                 erase_on_complete=True,
                 *animation
             )
@@ -473,20 +1821,174 @@ class PyGrid:
             self._end_animation(cell_x, cell_y)
             self._screen_changed = True
             self._delete_cell(cell_x, cell_y)
-            self._draw_cell(cell_x, cell_y, self._background_color)
+            self._draw_cell(
+                cell_x, cell_y,
+                self._palette.mapped[self._background_index]
+            )
 
     def _erase_cell_threaded(self, cell_x, cell_y):
-        self._delete_cell(cell_x, cell_y)
-        if self._in_render_zone(cell_x, cell_y):
-            self._next_draw_queue.append((cell_x, cell_y, self._background_color))
+        self._tick_changes.add(cell_x, cell_y, EMPTY)
+
+    def _cell_arrays(self, cells, color):
+        # converts cells to coordinate arrays and palette indices.
+        # if color is given, cells are (x, y) pairs drawn in that color,
+        # otherwise they are (x, y, color) triples
+        if color is None:
+            cells = list(cells)
+            xs = np.fromiter((cell[0] for cell in cells), np.int64, len(cells))
+            ys = np.fromiter((cell[1] for cell in cells), np.int64, len(cells))
+            index = self._palette.index
+            indices = np.fromiter(
+                (index(cell[2]) for cell in cells), np.uint16, len(cells)
+            )
+            return xs, ys, indices
+
+        if not isinstance(cells, np.ndarray):
+            cells = list(cells)
+        coords = np.asarray(cells, dtype=np.int64).reshape(-1, 2)
+        return coords[:, 0], coords[:, 1], self._palette.index(color)
+
+    def _draw_cells_mixed(self, cells, color=None, animation=None):
+        if threading.current_thread() is self._main_thread:
+            self._draw_cells_threadless(cells, color, animation)
+        else:
+            self._draw_cells_threaded(cells, color)
+
+    def _draw_cells_threadless(self, cells, color=None, animation=None):
+        xs, ys, indices = self._cell_arrays(cells, color)
+        if not len(xs):
+            return
+
+        if animation and self._animations_enabled:
+            animate = self._admit_animations(self._render_zone_mask(xs, ys))
+            if animate.any():
+                self._start_animations(
+                    xs[animate], ys[animate],
+                    indices[animate] if np.ndim(indices) else indices,
+                    *animation
+                )
+            if animate.all():
+                return
+
+            xs = xs[~animate]
+            ys = ys[~animate]
+            if np.ndim(indices):
+                indices = indices[~animate]
+
+        self._end_animations(xs, ys)
+        self._add_cells(xs, ys, indices)
+        self._draw_cells(xs, ys, indices)
+
+    def _draw_cells_threaded(self, cells, color=None):
+        xs, ys, indices = self._cell_arrays(cells, color)
+        if len(xs):
+            self._tick_changes.add_many(xs, ys, indices)
+
+    def _erase_cells_mixed(self, cells, animation=None):
+        if threading.current_thread() is self._main_thread:
+            self._erase_cells_threadless(cells, animation)
+        else:
+            self._erase_cells_threaded(cells)
+
+    def _erase_cells_threadless(self, cells, animation=None):
+        xs, ys, _ = self._cell_arrays(cells, self._background_color)
+        if not len(xs):
+            return
+
+        if animation and self._animations_enabled:
+            animate = self._admit_animations(self._render_zone_mask(xs, ys))
+            if animate.any():
+                self._start_animations(
+                    xs[animate], ys[animate],
+                    self._background_index,
+                    erase_on_complete=True,
+                    *animation
+                )
+            if animate.all():
+                return
+
+            xs = xs[~animate]
+            ys = ys[~animate]
+
+        self._end_animations(xs, ys)
+        self._delete_cells(xs, ys)
+        self._draw_cells(xs, ys, self._background_index)
+
+    def _erase_cells_threaded(self, cells):
+        xs, ys, _ = self._cell_arrays(cells, self._background_color)
+        if len(xs):
+            self._tick_changes.add_many(xs, ys, EMPTY)
+
+    def _queue_cells(self, xs, ys, indices):
+        # queue the cells within the render zone to be drawn
+        visible = self._render_zone_mask(xs, ys)
+        mapped = self._palette.mapped
+        if np.ndim(indices):
+            self._draw_queue.extend(
+                (cell_x, cell_y, mapped[index]) for cell_x, cell_y, index in zip(
+                    xs[visible].tolist(),
+                    ys[visible].tolist(),
+                    indices[visible].tolist()
+                )
+            )
+        else:
+            color = mapped[indices]
+            self._draw_queue.extend(
+                (cell_x, cell_y, color) for cell_x, cell_y in zip(
+                    xs[visible].tolist(), ys[visible].tolist()
+                )
+            )
+
+    def _end_animations(self, xs, ys):
+        self._animated_cells.remove_many(xs, ys)
+
+    def _get_cell_tile(self, index):
+        tile = self._cell_tiles.get(index, None)
+        if tile is None:
+            tile = pygame.Surface(
+                (self._cell_size, self._cell_size), 0, self._screen
+            )
+            tile.fill(self._palette.mapped[index])
+            if self._grid_thickness:
+                tile.blit(self._cell_borders, (0, 0))
+            self._cell_tiles[index] = tile
+        return tile
+
+    def _draw_cells(self, xs, ys, indices):
+        # draws many cells, including their grid borders.
+        # cells outside of the screen are culled in one step, and the
+        # remaining cells are blitted from pre-rendered tiles in one call
+        if self._lod_level:
+            return
+
+        xs = (xs - math.floor(self._pos_x)) * self._cell_size - self._left_offset
+        ys = (ys - math.floor(self._pos_y)) * self._cell_size - self._top_offset
+        visible = (xs > -self._cell_size) & (xs < self._width) \
+            & (ys > -self._cell_size) & (ys < self._height)
+        if not visible.any():
+            return
+
+        positions = zip(xs[visible].tolist(), ys[visible].tolist())
+        if np.ndim(indices):
+            get_tile = self._get_cell_tile
+            rects = self._screen.blits(
+                [(get_tile(index), position) for index, position
+                 in zip(indices[visible].tolist(), positions)]
+            )
+        else:
+            tile = self._get_cell_tile(indices)
+            rects = self._screen.blits(
+                [(tile, position) for position in positions]
+            )
+        self._dirty_rects.extend(rects)
+
+        self._screen_changed = True
 
     def _delete_cell(self, cell_x, cell_y):
-        chunk_x, chunk_y = self._get_chunk(cell_x, cell_y)
-        try:
-            del self._columns[cell_x][chunk_y][cell_y]
-            del self._rows[cell_y][chunk_x][cell_x]
-        except KeyError:
-            pass
+        old_index = self._store.delete(cell_x, cell_y)
+        if old_index and self._lod_pyramid:
+            self._lod_pyramid.update_cell(cell_x, cell_y, old_index, 0)
+            self._lod_dirty = bool(self._lod_level)
 
     def _clear_region(self, x, y, w, h):
         pygame.draw.rect(
@@ -495,12 +1997,79 @@ class PyGrid:
             (x, y, w, h)
         )
 
-    def _chunk_range(self, a, b):
-        chunk_start = math.floor(a) // self._chunk_size
-        chunk_end = math.ceil(
-            (math.floor(a) + b / self._cell_size) / self._chunk_size
-        ) + 1
-        return chunk_start, chunk_end
+    def _draw_region_cells(self, x_start, x_end, y_start, y_end, clip=None):
+        # draw every stored cell inside the given cell coordinates.
+        # chunks are blitted from the tile cache where possible, clipped to
+        # the region so that the cells around it are left untouched.
+        # if clip is given, the region is clipped to that rect of the screen
+        origin_x = math.floor(self._pos_x)
+        origin_y = math.floor(self._pos_y)
+        chunk_pixels = self._chunk_size * self._cell_size
+        use_tiles = chunk_pixels * chunk_pixels * self._screen.get_bytesize() \
+            <= self._tile_cache.max_bytes // 4
+
+        region = pygame.Rect(
+            (x_start - origin_x) * self._cell_size - self._left_offset,
+            (y_start - origin_y) * self._cell_size - self._top_offset,
+            (x_end - x_start) * self._cell_size,
+            (y_end - y_start) * self._cell_size
+        )
+        if clip is not None:
+            region = region.clip(clip)
+        self._screen.set_clip(region)
+
+        mapped = self._palette.mapped
+        for chunk_x, chunk_y, chunk in self._store.chunks_in_region(
+                x_start, x_end, y_start, y_end):
+
+            if use_tiles and chunk.count >= self._tile_min_cells:
+                self._screen.blit(
+                    self._get_chunk_tile(chunk_x, chunk_y, chunk),
+                    (
+                        (chunk_x * self._chunk_size - origin_x)
+                        * self._cell_size - self._left_offset,
+                        (chunk_y * self._chunk_size - origin_y)
+                        * self._cell_size - self._top_offset
+                    )
+                )
+                continue
+
+            for cell_x, cell_y, index in self._store.cells_in_chunk(
+                    chunk_x, chunk_y, chunk,
+                    x_start, x_end, y_start, y_end):
+                self._draw_cell(
+                    cell_x, cell_y,
+                    mapped[index],
+                    draw_grid=False
+                )
+
+        self._screen.set_clip(None)
+
+    def _get_chunk_tile(self, chunk_x, chunk_y, chunk):
+        key = (chunk_x, chunk_y, self._cell_size)
+        version = chunk.version
+        tile = self._tile_cache.get(key, version)
+        if tile is not None:
+            return tile
+
+        cells = chunk.cells
+
+        size = self._chunk_size * self._cell_size
+        tile = pygame.Surface((size, size), 0, self._screen)
+
+        mapped = self._palette.mapped
+        tile.fill(mapped[self._background_index])
+        xs, ys = np.nonzero(cells)
+        for x, y, index in zip(xs.tolist(), ys.tolist(),
+                               cells[xs, ys].tolist()):
+            tile.fill(
+                mapped[index],
+                (x * self._cell_size, y * self._cell_size,
+                 self._cell_size, self._cell_size)
+            )
+
+        self._tile_cache.put(key, version, tile)
+        return tile
 
     def _draw_rows_cells(self, row_start, row_span):
         self._clear_region(
@@ -510,26 +2079,12 @@ class PyGrid:
             row_span * self._cell_size
         )
 
-        chunk_start, chunk_end = self._chunk_range(self._pos_x, self._width)
-
-        self.cell_y = math.floor(self._pos_y)
-        for row_n in range(self.cell_y + row_start,
-                           self.cell_y + row_start + row_span):
-            row = self._rows.get(row_n, None)
-            if not row:
-                continue
-
-            for chunk_n in range(chunk_start, chunk_end):
-                chunk = row.get(chunk_n, None)
-                if not chunk:
-                    continue
-
-                for column_n, cell in chunk.items():
-                    self._draw_cell(
-                        column_n, row_n,
-                        cell,
-                        draw_grid=False
-                    )
+        cell_x = math.floor(self._pos_x)
+        cell_y = math.floor(self._pos_y) + row_start
+        self._draw_region_cells(
+            cell_x, cell_x + self._width // self._cell_size + 2,
+            cell_y, cell_y + row_span
+        )
 
     def _draw_columns_cells(self, column_start, column_span):
         self._clear_region(
@@ -539,52 +2094,84 @@ class PyGrid:
             self._height
         )
 
-        chunk_start, chunk_end = self._chunk_range(self._pos_y, self._height)
-
-        self.cell_x = math.floor(self._pos_x)
-        for column_n in range(self.cell_x + column_start,
-                              self.cell_x + column_start + column_span):
-            column = self._columns.get(column_n, None)
-            if not column:
-                continue
+        cell_x = math.floor(self._pos_x) + column_start
+        cell_y = math.floor(self._pos_y)
+        self._draw_region_cells(
+            cell_x, cell_x + column_span,
+            cell_y, cell_y + self._height // self._cell_size + 2
+        )
 
-            for chunk_n in range(chunk_start, chunk_end):
-                chunk = column.get(chunk_n, None)
-                if not chunk:
-                    continue
+    def _draw_area(self, rect):
+        # draws the cells and grid inside a rect of the screen, which
+        # needn't line up with the cells, leaving the pixels around it alone
+        rect = pygame.Rect(rect).clip(self._screen.get_rect())
+        if not rect.width or not rect.height:
+            return
 
-                for row_n, cell in chunk.items():
-                    self._draw_cell(
-                        column_n, row_n,
-                        cell, draw_grid=False
-                    )
+        x, y, w, h = rect
+        cell_size = self._cell_size
+        if (w // cell_size + 2) * (h // cell_size + 2) \
+                > self._framebuffer_threshold \
+                and self._screen.get_bytesize() == 4:
+            self._draw_screen_framebuffer(rect)
+        else:
+            self._clear_region(x, y, w, h)
+            left = x + self._left_offset
+            top = y + self._top_offset
+            cell_x = math.floor(self._pos_x)
+            cell_y = math.floor(self._pos_y)
+            self._draw_region_cells(
+                cell_x + left // cell_size,
+                cell_x + (left + w - 1) // cell_size + 1,
+                cell_y + top // cell_size,
+                cell_y + (top + h - 1) // cell_size + 1,
+                clip=rect
+            )
+        self._draw_grid(rect)
 
-    def _draw_grid(self):
+    def _draw_grid(self, rect=None):
+        # the grid overlay starts at the edge of the first cell, which is
+        # less than a cell above and to the left of the screen, so that it
+        # lines up with the cells at any offset.
+        # if rect is given, only that part of the screen gets the grid
         if not self._grid_thickness:
             return
 
-        x = -self._left_offset - self._grid_thickness + self._grid_thickness // 2
-        y = -self._top_offset - self._grid_thickness + self._grid_thickness // 2
-
-        # draw grid rows
-        for row in range(self._n_rows + 1):
-            self._screen.blit(self._grid_row, (-self._left_offset, y))
-            y += self._cell_size
+        x = -(self._left_offset % self._cell_size)
+        y = -(self._top_offset % self._cell_size)
+        if rect is None:
+            self._screen.blit(self._grid_overlay, (x, y))
+            return
 
-        # draw grid columns
-        for column in range(self._n_columns + 1):
-            self._screen.blit(self._grid_column, (x, 0))
-            x += self._cell_size
+        rect = pygame.Rect(rect).clip(self._screen.get_rect())
+        if rect.width and rect.height:
+            self._screen.blit(self._grid_overlay, rect, rect.move(-x, -y))
 
-    def _on_exit(self):
-        if self._timer_status == TIMER_ACTIVE:
+    def close(self):
+        # stops the timer and releases the simulation's worker process,
+        # the page file and pygame. the grid can't be used afterwards.
+        # the timer thread gives up on publishing once the timer is
+        # inactive, so it finishes its tick and exits
+        if self._timer_status != TIMER_INACTIVE:
             self._timer_status = TIMER_INACTIVE
-            self._timer_event.set()
+        if self._simulation_worker is not None:
+            self._simulation_worker.close()
+        self._store.close()
+        if self._recorder:
+            self._recorder.close()
         pygame.quit()
+
+    def _on_exit(self):
+        self.close()
         sys.exit()
 
     def _handle_events(self):
-        for event in pygame.event.get():
+        events = self._get_events()
+        if self._waking_event is not None:
+            events = [self._waking_event, *events]
+            self._waking_event = None
+
+        for event in events:
             if event.type == pygame.QUIT:
                 self._on_exit()
 
@@ -612,12 +2199,15 @@ class PyGrid:
             elif event.type == pygame.KEYUP:
                 self.on_key_up(event.key)
 
-            # self._thread_end_event
+            # self._timer_end_event. the ticks the thread published before
+            # it ended are applied first
             elif event.type == pygame.USEREVENT:
-                self.on_timer_end()
+                self._apply_published_ticks()
+                self._end_timer()
 
             elif event.type == pygame.VIDEOEXPOSE:
                 self._screen_changed = True
+                self._full_redraw = True
 
 
     def _calc_alt_offsets(self):
@@ -631,8 +2221,14 @@ class PyGrid:
         self._top_offset = math.floor((self._pos_y % 1) * self._cell_size)
 
     def _on_resize(self, w, h):
-        self._width = w
-        self._height = h
+        self._set_window_size(w, h)
+
+        # a window resizes its own surface, but a replayed or headless one
+        # has to be recreated. the back buffer always does
+        if self._display.get_size() != (w, h):
+            self._create_screen()
+        elif self._overscan:
+            self._create_back_buffer()
 
         # calculating left/top offset is not needed since pygame seems expand from bottom right
         # recalculating anyway, incase this is different per window manager/operating system
@@ -648,7 +2244,7 @@ class PyGrid:
 
     def _on_mouse_down(self, x, y, button):
         if button == self._pan_button and self._allowed_pan:
-            t = pygame.time.get_ticks()
+            t = self._get_ticks()
             self._scroll_positions = [
                 [x, y, t] for i in range(self._n_scroll_positions)
             ]
@@ -684,21 +2280,71 @@ class PyGrid:
         self._mouse_moved = True
 
     def _get_cell_at_point(self, x, y):
+        # points are in the window, which shows the screen from the view
+        view_x, view_y = self._view_origin()
+        x += view_x
+        y += view_y
+
+        if self._lod_level:
+            scale = 1 << self._lod_level
+            return (
+                math.floor(self._pos_x + x * scale),
+                math.floor(self._pos_y + y * scale),
+            )
+
         return (
             math.floor(self._pos_x) + (x + self._left_offset) // self._cell_size,
             math.floor(self._pos_y) + (y + self._top_offset) // self._cell_size,
         )
 
     def _get_pos_at_point(self, x, y):
+        view_x, view_y = self._view_origin()
+        x += view_x
+        y += view_y
+
+        if self._lod_level:
+            scale = 1 << self._lod_level
+            return (self._pos_x + x * scale, self._pos_y + y * scale)
+
         return (
             self._pos_x + x / self._cell_size,
             self._pos_y + y / self._cell_size,
         )
 
-    def _get_chunk(self, cell_x, cell_y):
-        return cell_x // self._chunk_size, cell_y // self._chunk_size
-
     def _pan(self, x, y):
+        # in level of detail mode the screen is drawn from the pyramid,
+        # which costs the same however far the grid has moved
+        if self._lod_level:
+            scale = 1 << self._lod_level
+            self._pos_x += x * scale
+            self._pos_y += y * scale
+            self._lod_dirty = True
+            self._full_redraw = True
+            self._mouse_moved = True
+            return
+
+        if self._overscan:
+            # the view moves over the back buffer, which is only drawn to
+            # if the view moves past the part of it that has been drawn
+            view = self._view_origin()
+            self._view_x += x
+            self._view_y += y
+            if self._view_origin() == view:
+                return
+            self._cover_view()
+            self._calc_window_cells()
+        else:
+            x_pan, y_pan = self._scroll(x, y)
+            if not x_pan and not y_pan:
+                return
+
+        # even though the mouse hasn't moved, its position on the grid has changed
+        # this is justification for a mouse event
+        self._mouse_moved = True
+        self._screen_changed = True
+        self._full_redraw = True
+
+    def _scroll(self, x, y):
         # this method is complicated...
         # python is a pretty slow language, but the grid needs to be performant
         # so, instead of redrawing the entire screen every time it moves, we
@@ -715,6 +2361,8 @@ class PyGrid:
         # the grid lines have to be drawn after both rows and columns are drawn since drawing a column
         # would erase some row grid lines and vice versa
 
+        # returns how many pixels the screen scrolled by, which is zero if
+        # it moved less than a pixel
 
         # calculate how many pixels the grid has panned
         # this could be zero if the grid panned -1 > n > 1
@@ -730,7 +2378,7 @@ class PyGrid:
 
         # if the pan is smaller than a pixel, no screen drawing will occur, return
         if not x_pan and not y_pan:
-            return
+            return 0, 0
 
         # translate/pan the screen the given amount
         # this will leave a portion of the screen needing to be drawn
@@ -750,24 +2398,24 @@ class PyGrid:
             traversed_columns, self._left_offset = divmod(
                 self._left_offset + x_pan, self._cell_size
             )
-            self._n_columns -= traversed_columns
+            self._screen_columns -= traversed_columns
             column_span, self._right_offset = divmod(
                 self._right_offset - x_pan, self._cell_size
             )
-            self._n_columns -= column_span
+            self._screen_columns -= column_span
             column_span = abs(column_span) + 1
-            column_start = self._n_columns - column_span
+            column_start = self._screen_columns - column_span
 
         # calculate column start and column span if panning left
         elif x_pan < 0:
             traversed_columns, self._right_offset = divmod(
                 self._right_offset - x_pan, self._cell_size
             )
-            self._n_columns -= traversed_columns
+            self._screen_columns -= traversed_columns
             column_span, self._left_offset = divmod(
                 self._left_offset + x_pan, self._cell_size
             )
-            self._n_columns -= column_span
+            self._screen_columns -= column_span
             column_span = abs(column_span) + 1
 
         # calculate row start and row span if panning down
@@ -775,24 +2423,24 @@ class PyGrid:
             traversed_rows, self._top_offset = divmod(
                 self._top_offset + y_pan, self._cell_size
             )
-            self._n_rows -= traversed_rows
+            self._screen_rows -= traversed_rows
             row_span, self._bottom_offset = divmod(
                 self._bottom_offset - y_pan, self._cell_size
             )
-            self._n_rows -= row_span
+            self._screen_rows -= row_span
             row_span = abs(row_span) + 1
-            row_start = self._n_rows - row_span
+            row_start = self._screen_rows - row_span
 
         # calculate row start and row span if panning up
         elif y_pan < 0:
             traversed_rows, self._bottom_offset = divmod(
                 self._bottom_offset - y_pan, self._cell_size
             )
-            self._n_rows -= traversed_rows
+            self._screen_rows -= traversed_rows
             row_span, self._top_offset = divmod(
                 self._top_offset + y_pan, self._cell_size
             )
-            self._n_rows -= row_span
+            self._screen_rows -= row_span
             row_span = abs(row_span) + 1
 
         # now that the rows/columns needing to be drawn are found, draw them
@@ -808,141 +2456,231 @@ class PyGrid:
         # the rows and columns overlap in the corner. this means sometimes
         # cells in the corner would be missing a vertical or horizontal grid line
         if self._grid_thickness:
+            # the grid is only drawn over the introduced rows and columns,
+            # since the existing cells already have theirs. the grid is
+            # translucent, so drawing it over them again would darken it.
+            # for the same reason, the corner where the introduced rows and
+            # columns overlap is only covered by the columns
+            column_x = column_start * self._cell_size - self._left_offset
+            column_width = column_span * self._cell_size
+            row_x = 0
+            row_width = self._width
+
             if x_pan:
-                # when panning left/right, we do not need to draw the entire
-                # horizontal grid. we only need to draw a section of the horizontal
-                # grid that covers the columns introducted since the existing
-                # columns already have theirs
-                self._draw_partial_rows_grids(
-                    row_start, row_span,
-                    column_start, column_span
-                )
-            else:
-                # however, if there is no panning left/right, we can just draw the entire
-                # horizontal grids rows for the introducted rows
-                self._draw_rows_grids(row_start, row_span)
+                self._draw_grid((column_x, 0, column_width, self._height))
+                if column_start == 0:
+                    row_x = column_x + column_width
+                    row_width = self._width - row_x
+                else:
+                    row_width = column_x
 
             if y_pan:
-                # the same applies for vertical grids introduced rows.
-                self._draw_partial_columns_grids(
-                    column_start, column_span,
-                    row_start, row_span
-                )
-            else:
-                self._draw_columns_grids(column_start, column_span)
-
-        # even though the mouse hasn't moved, its position on the grid has changed
-        # this is justification for a mouse event
-        self._mouse_moved = True
-        self._screen_changed = True
-
-    def _draw_columns_grids(self, column_start, column_span):
-        x = -self._left_offset + column_start * self._cell_size
-        for column in range(column_start, column_start + column_span):
-            self._screen.blit(
-                self._grid_column_left,
-                (x, -self._top_offset)
-            )
-            self._screen.blit(
-                self._grid_column_right,
-                (x + self._grid_offset, -self._top_offset)
-            )
-            x += self._cell_size
-
-    def _draw_rows_grids(self, row_start, row_span):
-        y = -self._top_offset + row_start * self._cell_size
-        for row in range(row_start, row_start + row_span):
-            self._screen.blit(
-                self._grid_row_top,
-                (-self._left_offset, y)
-            )
-            self._screen.blit(
-                self._grid_row_bottom,
-                (-self._left_offset, y + self._grid_offset)
-            )
-            y += self._cell_size
-
-    def _draw_partial_columns_grids(self, column_start, column_span,
-                                   row_start, row_span):
-        if row_start == 0:
-            grid_offset = -self._column_grid_length + row_span \
-                * self._cell_size - self._top_offset
-        else:
-            grid_offset = self._height - (row_span - 1) * self._cell_size \
-                - (self._cell_size - self._bottom_offset)
-
+                self._draw_grid((
+                    row_x, row_start * self._cell_size - self._top_offset,
+                    row_width, row_span * self._cell_size
+                ))
+
+        self._calc_window_cells()
+        return x_pan, y_pan
+
+    def _view_origin(self):
+        # the top left of the window on the screen, which is always 0, 0
+        # without overscan.
+        # the view and the screen's position both keep their fractions of a
+        # pixel, so the origin is where the two add up to, rather than the
+        # view rounded down on its own
+        if not self._overscan:
+            return 0, 0
+        if self._lod_level:
+            return math.floor(self._view_x), math.floor(self._view_y)
+
+        x = self._pos_x * self._cell_size
+        y = self._pos_y * self._cell_size
+        return (
+            math.floor(x + self._view_x) - math.floor(x),
+            math.floor(y + self._view_y) - math.floor(y)
+        )
 
-        x = -self._left_offset
+    def _view_rect(self):
+        return pygame.Rect(
+            self._view_origin(), (self._window_width, self._window_height)
+        )
 
-        for column in range(self._n_columns):
-            if column_start <= column < column_start + column_span:
-                self._screen.blit(
-                    self._grid_column_left,
-                    (x, -self._top_offset)
-                )
-                self._screen.blit(
-                    self._grid_column_right,
-                    (x + self._grid_offset, -self._top_offset)
-                )
-            else:
-                self._screen.blit(
-                    self._grid_column_left,
-                    (x, grid_offset)
-                )
-                self._screen.blit(
-                    self._grid_column_right,
-                    (x + self._grid_offset, grid_offset)
-                )
+    def _cover_view(self):
+        # makes sure the part of the back buffer the window shows has been
+        # drawn, for when the view moves faster than the margin is filled.
+        # a view past the edge of the back buffer scrolls it just enough to
+        # fit, and any of it outside of the valid rect is drawn now
+        view = self._view_rect()
+        if self._overscan_valid.contains(view):
+            return
 
-            x += self._cell_size
+        # the screen's position is a float, so a scroll can come out a
+        # pixel more or less than asked. the view is scrolled to a pixel
+        # inside the edge, so that it can't come up short
+        screen = self._screen.get_rect()
+        while not screen.contains(view):
+            fitted = view.clamp(screen.inflate(-2, -2))
+            if not self._scroll_back_buffer(
+                    view.x - fitted.x, view.y - fitted.y):
+                break
+            view = self._view_rect()
 
-    def _draw_partial_rows_grids(self, row_start, row_span,
-                                column_start, column_span):
-        # prob
-        if column_start == 0:
-            grid_offset = -self._row_grid_length + column_span \
-                * self._cell_size - self._left_offset
+        if self._overscan_valid.colliderect(view):
+            self._extend_valid(view)
         else:
-            grid_offset = self._width - (column_span - 1) * self._cell_size \
-                - (self._cell_size - self._right_offset)
-
-
-        y = -self._top_offset
-
-        for row in range(self._n_rows):
-            if row_start <= row < row_start + row_span:
-                self._screen.blit(
-                    self._grid_row_top,
-                    (-self._left_offset, y)
-                )
-                self._screen.blit(
-                    self._grid_row_bottom,
-                    (-self._left_offset, y + self._cell_size - (self._grid_thickness - self._grid_thickness // 2))
-                )
+            self._draw_area(view)
+            self._overscan_valid = view
+
+    def _scroll_back_buffer(self, x, y):
+        # scrolls the back buffer, and moves the view back by as much, so
+        # the window shows the same part of the grid.
+        # returns whether it scrolled at all
+        screen = self._screen.get_rect()
+        valid = self._overscan_valid
+        x_pan, y_pan = self._scroll(x, y)
+        self._view_x -= x
+        self._view_y -= y
+
+        # scrolling draws the rows and columns it brings in at the edges,
+        # but if the margin wasn't finished there may be a gap before them
+        if valid != screen:
+            self._overscan_valid = valid.move(-x_pan, -y_pan).clip(screen)
+        return bool(x_pan or y_pan)
+
+    def _extend_valid(self, rect):
+        # draws the parts of the back buffer between the valid rect and
+        # rect, so that the valid rect grows to cover both
+        screen = self._screen.get_rect()
+        valid = self._overscan_valid
+        extended = valid.union(rect).clip(screen)
+
+        if extended.left < valid.left:
+            self._draw_area((
+                extended.left, extended.top,
+                valid.left - extended.left, extended.height
+            ))
+        if extended.right > valid.right:
+            self._draw_area((
+                valid.right, extended.top,
+                extended.right - valid.right, extended.height
+            ))
+        if extended.top < valid.top:
+            self._draw_area((
+                valid.left, extended.top,
+                valid.width, valid.top - extended.top
+            ))
+        if extended.bottom > valid.bottom:
+            self._draw_area((
+                valid.left, valid.bottom,
+                valid.width, extended.bottom - valid.bottom
+            ))
+        self._overscan_valid = extended
+
+    def _fill_overscan(self):
+        # spends the frame time left over on the margin, after the draw
+        # queue has had what it needs. what is drawn there isn't shown yet,
+        # so it is never presented.
+        # replays and headless grids must do the same work every run, so
+        # they always finish the margin
+        start = time.perf_counter()
+        frame_work = max(
+            self._clock.get_rawtime() - self._overscan_time, 0
+        )
+        self._overscan_work = self._overscan_work * 0.9 + frame_work * 0.1
+        budget = max((self._frame_period - self._overscan_work) * 0.9, 1)
+        deadline = start + budget / 1000
+
+        dirty_rects = self._dirty_rects
+        self._overscan_filled = False
+        while self._fill_overscan_step():
+            if not self._synchronous_timers \
+                    and time.perf_counter() >= deadline:
+                break
+        else:
+            self._overscan_filled = True
+        self._dirty_rects = dirty_rects
+        self._overscan_time = (time.perf_counter() - start) * 1000
+
+    def _fill_overscan_step(self):
+        # draws one strip of the margin, returning False once there is
+        # nothing left to do.
+        # a margin left unfinished by a full redraw is finished first, with
+        # the side the grid is moving towards drawn first. then the back
+        # buffer is scrolled to move the view back to the middle, or as far
+        # behind the middle as the grid will slide before it stops, so that
+        # the margin ahead of it is as large as possible
+        screen = self._screen.get_rect()
+        valid = self._overscan_valid
+        step = self._overscan_step
+
+        if valid != screen:
+            gaps = (
+                valid.left, screen.right - valid.right,
+                valid.top, screen.bottom - valid.bottom
+            )
+            ahead = (-self._x_vel, self._x_vel, -self._y_vel, self._y_vel)
+            side = max(range(4), key=lambda i: (gaps[i] > 0, ahead[i], gaps[i]))
+            size = min(gaps[side], step)
+            if side == 0:
+                strip = (valid.left - size, valid.top, size, valid.height)
+            elif side == 1:
+                strip = (valid.right, valid.top, size, valid.height)
+            elif side == 2:
+                strip = (valid.left, valid.top - size, valid.width, size)
             else:
-                self._screen.blit(
-                    self._grid_row_top,
-                    (grid_offset, y)
-                )
-                self._screen.blit(
-                    self._grid_row_bottom,
-                    (grid_offset, y + self._cell_size - (self._grid_thickness - self._grid_thickness // 2))
-                )
-
-            y += self._cell_size
-
+                strip = (valid.left, valid.bottom, valid.width, size)
+            self._extend_valid(strip)
+            return True
+
+        # a flick slides vel / friction pixels before it stops.
+        # scrolls can be a pixel out, so the view is kept a pixel inside
+        # the edges, and the last pixel to the target isn't chased
+        margin = self._overscan
+        lead = max(margin - 1, 0)
+        target_x = margin - max(-lead, min(
+            lead, int(self._x_vel / self._friction)
+        ))
+        target_y = margin - max(-lead, min(
+            lead, int(self._y_vel / self._friction)
+        ))
+        view_x, view_y = self._view_origin()
+        x = view_x - target_x
+        y = view_y - target_y
+        if abs(x) <= 1 and abs(y) <= 1:
+            return False
+        return self._scroll_back_buffer(
+            max(-step, min(step, x)), max(-step, min(step, y))
+        )
 
     def _zoom(self, x, y, amount):
         pos_x, pos_y = self._get_pos_at_point(x, y)
 
         if amount > 1:
-            if self._cell_size == self._max_cell_size:
+            if self._lod_level:
+                self._lod_level -= 1
+                self._animations_enabled = not self._lod_level
+            elif self._cell_size == self._max_cell_size:
                 return
-            self._cell_size = math.ceil(self._cell_size * amount)
-            if self._cell_size > self._max_cell_size:
-                self._cell_size = self._max_cell_size
+            else:
+                self._cell_size = math.ceil(self._cell_size * amount)
+                if self._cell_size > self._max_cell_size:
+                    self._cell_size = self._max_cell_size
         else:
             if self._cell_size == self._min_cell_size:
+                # past the smallest cell size, each zoom step halves the
+                # scale by moving up a level of the pyramid
+                if self._lod_level == self._lod_levels:
+                    return
+                if not self._lod_level:
+                    self._finish_animations()
+                    self._animations_enabled = False
+                self._lod_level += 1
+
+                new_pos_x, new_pos_y = self._get_pos_at_point(x, y)
+                self._pos_x += pos_x - new_pos_x
+                self._pos_y += pos_y - new_pos_y
+                self._draw_lod()
                 return
             self._cell_size = math.floor(self._cell_size * amount)
             if self._cell_size < self._min_cell_size:
@@ -998,91 +2736,168 @@ class PyGrid:
         self._pan(pan_x, pan_y)
 
     def _finish_animations(self):
-        for (cell_x, cell_y), (_, _, target_color, _, _, _, deleting) in self._animated_cells.items():
-            self._draw_cell(cell_x, cell_y, target_color)
-            if deleting:
-                self._delete_cell(cell_x, cell_y)
-            else:
-                self._add_cell(cell_x, cell_y, target_color)
-        self._animated_cells = {}
+        if self._animated_cells:
+            self._complete_animations(*self._animated_cells.pop_all())
         self._screen_changed = True
 
-    def _grow_out_animation(self, cell_x, cell_y, original_color, color, perc):
-        x = (cell_x - math.floor(self._pos_x)) * \
-            self._cell_size - self._left_offset
-        y = (cell_y - math.floor(self._pos_y)) * \
-            self._cell_size - self._top_offset
-
-        size = int(self._cell_size * (1 - perc))
-        offset = (self._cell_size - size) // 2 
-
-        pygame.draw.rect(
-            self._screen,
-            color,
-            (x, y, self._cell_size, self._cell_size)
-        )
-        pygame.draw.rect(
-            self._screen,
-            original_color,
-            (x + offset, y + offset, size, size)
-        )
+    def _complete_animations(self, xs, ys, target_indices, deleting):
+        # draws finished animations in their target colors, and writes
+        # them to the store
+        self._draw_cells(xs, ys, target_indices)
+        if deleting.any():
+            self._delete_cells(xs[deleting], ys[deleting])
+        if not deleting.all():
+            adding = ~deleting
+            self._add_cells(
+                xs[adding], ys[adding],
+                target_indices[adding].astype(np.uint16)
+            )
 
-        self._screen.blit(self._cell_borders, (x, y))
-        return color
+    def _animate_cells(self, delta):
+        start = time.perf_counter()
+        animated = self._animated_cells
+        n_animated = len(animated)
+        perc = animated.fractions()
+        finished = animated.pop_finished(perc)
+        if finished is not None:
+            self._complete_animations(*finished)
+            perc = animated.fractions()
+
+        if animated:
+            # only animations in the render zone are drawn. the rest keep
+            # advancing, and are drawn again if they scroll back into view
+            n = len(animated)
+            rows = np.flatnonzero(self._render_zone_mask(
+                animated.xs[:n], animated.ys[:n]
+            ))
+            if len(rows):
+                perc = perc[rows]
+                colors = animated.blend(rows, perc)
+                self._draw_animation_frames(rows, perc, colors)
+            animated.advance(delta)
 
-    def _grow_in_animation(self, cell_x, cell_y, original_color, color, perc):
-        x = (cell_x - math.floor(self._pos_x)) * \
-            self._cell_size - self._left_offset
-        y = (cell_y - math.floor(self._pos_y)) * \
-            self._cell_size - self._top_offset
+        self._screen_changed = True
 
-        pygame.draw.rect(
-            self._screen,
-            original_color,
-            (x, y, self._cell_size, self._cell_size)
-        )
+        # replays and headless grids must do the same work every run, so
+        # only max_animations applies to them, never the measured times
+        if self._synchronous_timers:
+            return
 
-        size = int(self._cell_size * perc)
-        offset = (self._cell_size - size) // 2 
-        pygame.draw.rect(
-            self._screen,
-            color,
-            (x + offset, y + offset, size, size)
-        )
+        elapsed = (time.perf_counter() - start) * 1000
+        self._animation_time = self._animation_time * 0.9 + elapsed * 0.1
+        if n_animated >= self._animation_cost_sample:
+            cost = elapsed / n_animated
+            if self._animation_cost:
+                cost = self._animation_cost * 0.9 + cost * 0.1
+            self._animation_cost = cost
 
-        self._screen.blit(self._cell_borders, (x, y))
-        return color
+        if not animated:
+            return
+        if elapsed > self._animation_budget * 2:
+            self._animations_finished_early += len(animated)
+            self._count_degrade_event(len(animated))
+            self._finish_animations()
+            self._animation_time = 0
+        elif self._animation_time > self._animation_budget:
+            # the same fraction of the way through, in half the time left
+            self._animations_shortened += len(animated)
+            self._count_degrade_event(len(animated))
+            animated.shorten(0.5)
+
+    def _draw_animation_frames(self, rows, perc, colors):
+        # draws every animation at perc of the way through.
+        # each cell is filled with an outer color, then a centred square of
+        # an inner color: a fade shows its blended color with no square,
+        # growing in shows the target growing over the original, and growing
+        # out (a cell being erased) shows the original shrinking away.
+        # all the cells are written to the screen's pixels in one step
+        if self._lod_level:
+            return
 
-    def _fade_animation(self, cell_x, cell_y, original_color, color, perc):
-        color = color_mix(original_color, color, perc)
-        self._draw_cell(cell_x, cell_y, color)
-        return color
+        animated = self._animated_cells
+        cell_size = self._cell_size
+        original = animated.original_colors[rows]
+        growing = animated.types[rows] != FADE
+        shrinking = growing & animated.deleting[rows]
+
+        sizes = np.zeros(len(rows), dtype=np.int64)
+        sizes[growing] = (cell_size * np.where(
+            shrinking, 1 - perc, perc
+        )[growing]).astype(np.int64)
+        outer = np.where((growing & ~shrinking)[:, None], original, colors)
+        inner = np.where(shrinking[:, None], original, colors)
+
+        xs = (animated.xs[rows] - math.floor(self._pos_x)) * cell_size \
+            - self._left_offset
+        ys = (animated.ys[rows] - math.floor(self._pos_y)) * cell_size \
+            - self._top_offset
+        visible = (xs > -cell_size) & (xs < self._width) \
+            & (ys > -cell_size) & (ys < self._height)
+        if not visible.any():
+            return
 
-    def _animate_cells(self, delta):
-        for (cell_x, cell_y), anim in tuple(self._animated_cells.items()):
-            perc = anim[PROGRESS] / anim[DURATION]
+        xs = xs[visible]
+        ys = ys[visible]
+        sizes = sizes[visible]
+        outer = outer[visible]
+        inner = inner[visible]
+        offsets = (cell_size - sizes) // 2
 
-            if perc < 1:
-                anim_type = anim[ANIMATION_TYPE]
+        if self._screen.get_bytesize() == 4:
+            self._fill_animation_frames(xs, ys, outer, inner, offsets, sizes)
+        else:
+            # surfarray can't write to every pixel format
+            for x, y, outer_color, inner_color, offset, size in zip(
+                    xs.tolist(), ys.tolist(), outer.tolist(),
+                    inner.tolist(), offsets.tolist(), sizes.tolist()):
+                self._screen.fill(outer_color, (x, y, cell_size, cell_size))
+                if size:
+                    self._screen.fill(
+                        inner_color, (x + offset, y + offset, size, size)
+                    )
 
-                color = self._animation_funcs[anim[ANIMATION_TYPE]][anim[DELETING]](
-                    cell_x, cell_y,
-                    anim[ORIGINAL_COLOR],
-                    anim[TARGET_COLOR],
-                    perc
-                )
-                anim[PROGRESS] = anim[PROGRESS] + delta
-                anim[CURRENT_COLOR] = color
+        positions = list(zip(xs.tolist(), ys.tolist()))
+        if self._grid_thickness:
+            self._screen.blits(
+                [(self._cell_borders, position) for position in positions],
+                False
+            )
+        self._dirty_rects.extend(
+            (x, y, cell_size, cell_size) for x, y in positions
+        )
 
-            else:
-                del self._animated_cells[(cell_x, cell_y)]
-                self._draw_cell(cell_x, cell_y, anim[TARGET_COLOR])
-                if anim[DELETING]:
-                    self._delete_cell(cell_x, cell_y)
-                else:
-                    self._add_cell(cell_x, cell_y, anim[TARGET_COLOR])
+    def _fill_animation_frames(self, xs, ys, outer, inner, offsets, sizes):
+        cell_size = self._cell_size
+        outer = self._palette.map_rgb_array(outer)
+
+        # pixel coordinates of every cell, as (cells, cell_size) arrays
+        steps = np.arange(cell_size)
+        pixel_xs = xs[:, None] + steps
+        pixel_ys = ys[:, None] + steps
+
+        if sizes.any():
+            inner = self._palette.map_rgb_array(inner)
+            inside = (steps >= offsets[:, None]) \
+                & (steps < (offsets + sizes)[:, None])
+            values = np.where(
+                inside[:, :, None] & inside[:, None, :],
+                inner[:, None, None], outer[:, None, None]
+            )
+        else:
+            values = np.broadcast_to(
+                outer[:, None, None], (len(xs), cell_size, cell_size)
+            )
 
-        self._screen_changed = True
+        # cells hanging off the edge of the screen are clipped
+        on_screen = ((pixel_xs >= 0) & (pixel_xs < self._width))[:, :, None] \
+            & ((pixel_ys >= 0) & (pixel_ys < self._height))[:, None, :]
+        shape = values.shape
+        pixels = pygame.surfarray.pixels2d(self._screen)
+        pixels[
+            np.broadcast_to(pixel_xs[:, :, None], shape)[on_screen],
+            np.broadcast_to(pixel_ys[:, None, :], shape)[on_screen]
+        ] = values[on_screen]
+        del pixels
 
     def _calc_n_rows(self):
         # first, find out how many cells fit perfectly in the height
@@ -1092,27 +2907,48 @@ class PyGrid:
         height_no_padding = self._height - top_padding - bottom_padding
 
         # divide by cell size to get the exact number
-        self._n_rows = height_no_padding // self._cell_size
+        self._screen_rows = height_no_padding // self._cell_size
 
         # add on another row for cell(s) contained in top/bottom padding
         if self._top_offset:
-            self._n_rows += 1
+            self._screen_rows += 1
 
         if self._bottom_offset:
-            self._n_rows += 1
+            self._screen_rows += 1
+
+        self._calc_window_cells()
 
     def _calc_n_columns(self):
         left_padding = (self._cell_size - self._left_offset) % self._cell_size
         right_padding = (self._cell_size - self._right_offset) % self._cell_size
         width_no_padding = self._width - left_padding - right_padding
 
-        self._n_columns = width_no_padding // self._cell_size
+        self._screen_columns = width_no_padding // self._cell_size
 
         if self._left_offset:
-            self._n_columns += 1
+            self._screen_columns += 1
 
         if self._right_offset:
-            self._n_columns += 1
+            self._screen_columns += 1
+
+        self._calc_window_cells()
+
+    def _calc_window_cells(self):
+        # the rows and columns the window shows any part of. without
+        # overscan, those are the screen's
+        if not self._overscan:
+            self._n_rows = self._screen_rows
+            self._n_columns = self._screen_columns
+            return
+
+        view_x, view_y = self._view_origin()
+        left = view_x + self._left_offset
+        top = view_y + self._top_offset
+        cell_size = self._cell_size
+        self._n_columns = (left + self._window_width - 1) // cell_size \
+            - left // cell_size + 1
+        self._n_rows = (top + self._window_height - 1) // cell_size \
+            - top // cell_size + 1
 
     def _handle_mouse_motion(self):
         if not self._mouse_moved:
@@ -1120,12 +2956,12 @@ class PyGrid:
 
         x, y = self._mouse_position
 
-        dx, dy = pygame.mouse.get_rel()
+        dx, dy = self._get_mouse_rel()
 
         self._mouse_moved = False
 
         if self._panning:
-            t = pygame.time.get_ticks()
+            t = self._get_ticks()
 
             x_direction = math.copysign(1, dx)
             y_direction = math.copysign(1, dy)
@@ -1173,58 +3009,68 @@ class PyGrid:
             self._grid_alpha = self._grid_default_alpha
 
     def _create_grid_lines(self):
-        n_rows = self._height // self._cell_size + 2
-        n_columns = self._width // self._cell_size + 2
-
-        self._column_grid_length = n_rows * self._cell_size
-        self._row_grid_length = n_columns * self._cell_size
-
-        self._grid_offset = self._cell_size - \
-            (self._grid_thickness - self._grid_thickness // 2)
-
-        # column grid lines
-        self._grid_column = pygame.Surface(
-            (self._grid_thickness, self._column_grid_length)
-        )
-        self._grid_column_left = pygame.Surface(
-            (self._grid_thickness // 2, self._column_grid_length)
-        )
-        self._grid_column_right = pygame.Surface(
-            (self._grid_thickness - self._grid_thickness // 2, self._column_grid_length)
+        key = (
+            self._cell_size, self._grid_thickness, self._grid_alpha,
+            self._grid_color, self._width, self._height
         )
+        cache = self._grid_lines_cache
+        grid_lines = cache.get(key, None)
+        if grid_lines is None:
+            grid_lines = self._render_grid_lines()
+            cache[key] = grid_lines
+            self._grid_lines_bytes += self._grid_lines_size(grid_lines)
+            while len(cache) > 1 and \
+                    self._grid_lines_bytes > self._grid_lines_cache_bytes:
+                evicted = cache.popitem(last=False)[1]
+                self._grid_lines_bytes -= self._grid_lines_size(evicted)
+        else:
+            cache.move_to_end(key)
 
-        # row grid lines
-        self._grid_row_top = pygame.Surface(
-            (self._row_grid_length, self._grid_thickness // 2)
-        )
-        self._grid_row_bottom = pygame.Surface(
-            (self._row_grid_length, self._grid_thickness - self._grid_thickness // 2)
-        )
-        self._grid_row = pygame.Surface(
-            (self._row_grid_length, self._grid_thickness)
-        )
+        self._grid_overlay, self._cell_borders = grid_lines
+        self._cell_tiles = {}
 
-        # cell borders
-        self._cell_borders = pygame.Surface((self._cell_size, self._cell_size))
-
-        surfaces = (
-            self._grid_row,
-            self._grid_row_top,
-            self._grid_row_bottom,
-            self._grid_column,
-            self._grid_column_left,
-            self._grid_column_right,
-            self._cell_borders
+    @staticmethod
+    def _grid_lines_size(grid_lines):
+        return sum(
+            surface.get_width() * surface.get_height()
+            * surface.get_bytesize()
+            for surface in grid_lines if surface
         )
 
-        for surface in surfaces:
-            surface.fill(self._grid_color)
-            surface.set_colorkey(self._color_key)
-            surface.set_alpha(self._grid_alpha)
+    def _render_grid_lines(self):
+        # the overlay is the whole grid on one surface, a cell larger than
+        # the screen across and down, so that it can be drawn in one blit at
+        # any offset. everything but the lines is the color key
+        grid_overlay = None
+        if self._grid_thickness:
+            cell_size = self._cell_size
+            thickness = self._grid_thickness
+            width = self._width + cell_size
+            height = self._height + cell_size
+            grid_overlay = pygame.Surface((width, height), 0, self._screen)
+            grid_overlay.fill(self._color_key)
+
+            # lines are centred on the edges between cells, with the odd
+            # pixel of an odd thickness on the top/left side of the edge
+            # fill doesn't clip a rect that starts off the surface
+            below = thickness - thickness // 2
+            bounds = grid_overlay.get_rect()
+            for x in range(-below, width, cell_size):
+                grid_overlay.fill(
+                    self._grid_color,
+                    bounds.clip((x, 0, thickness, height))
+                )
+            for y in range(-below, height, cell_size):
+                grid_overlay.fill(
+                    self._grid_color,
+                    bounds.clip((0, y, width, thickness))
+                )
 
         # cell borders
+        cell_borders = pygame.Surface((self._cell_size, self._cell_size))
+        cell_borders.fill(self._grid_color)
         pygame.draw.rect(
-            self._cell_borders,
+            cell_borders,
             self._color_key,
             (
                 self._grid_thickness // 2,
@@ -1234,27 +3080,18 @@ class PyGrid:
             )
         )
 
-        # after every column, a dot is drawn in the color key
-        # this dot will be transparent when the grid line is blitted
-        # this avoids rows and columns grid lines overlapping
-        # TODO more efficient
-        for column in range(n_columns):
-            rect = (
-                column * self._cell_size - self._grid_thickness + self._grid_thickness // 2,
-                0, self._grid_thickness, self._grid_thickness
-            )
-            pygame.draw.rect(
-                self._grid_row_top,
-                self._color_key, rect
-            )
-            pygame.draw.rect(
-                self._grid_row_bottom,
-                self._color_key, rect
-            )
-            pygame.draw.rect(
-                self._grid_row,
-                self._color_key, rect
-            )
+        # run length encoding lets the overlay's blits skip the transparent
+        # runs between lines, rather than testing every pixel against the
+        # color key. cell borders aren't encoded, since they're also blitted
+        # onto cell tiles, and an encoded surface blitted to more than one
+        # surface can leak its color key into later blits
+        if grid_overlay:
+            grid_overlay.set_colorkey(self._color_key, pygame.RLEACCEL)
+            grid_overlay.set_alpha(self._grid_alpha, pygame.RLEACCEL)
+        cell_borders.set_colorkey(self._color_key)
+        cell_borders.set_alpha(self._grid_alpha)
+
+        return grid_overlay, cell_borders
 
 if __name__ == "__main__":
     test_grid = PyGrid()
@@ -0,0 +1,386 @@
+import multiprocessing
+import queue
+import traceback
+from multiprocessing import shared_memory
+import numpy as np
+
+from change_buffer import ChangeBuffer
+
+# timers whose work runs in a separate process, so that a heavy tick doesn't
+# hold the GIL the event loop needs to draw.
+# the state such a timer works on lives in a Simulation, rather than in the
+# grid. the simulation given to start_timer() is copied to the worker
+# process, ticked there, and copied back into the same object once the timer
+# ends, so between runs it can be read and changed like any other object.
+# the cells each tick changes are written to a ring of records in shared
+# memory, which the grid reads and applies when the tick comes due. the
+# worker runs ahead until every record is full, then waits for the grid to
+# free one. the last record of a tick is only freed once the tick has been
+# applied, so the worker is never more than n_records ticks ahead.
+# a record holds up to record_changes cell changes, so a larger tick is
+# split over several records, and the grid waits for the last of them.
+# colors are sent as ids into a palette of the simulation's own, with the
+# colors first used by a record sent along with it. id 0 erases a cell
+
+# record kinds
+TICK = 0
+END = 1
+
+HEADER_SIZE = 4
+MAX_RECORD_COLORS = 256
+
+
+class Simulation:
+    def on_timer(self, n_ticks):
+        # called in the worker process every time the timer ticks, with
+        # n_ticks always 1. the grid counts the ticks it couldn't apply in
+        # time as missed, rather than asking for a batch of them.
+        # headless grids and replays call it with the policy's n_ticks
+        pass
+
+    def draw_cell(self, cell_x, cell_y, color):
+        self._changes.add(cell_x, cell_y, self._color_id(color))
+
+    def erase_cell(self, cell_x, cell_y):
+        self._changes.add(cell_x, cell_y, 0)
+
+    def draw_cells(self, cells, color=None):
+        # the same as PyGrid.draw_cells, without animations
+        if color is None:
+            cells = list(cells)
+            ids = np.fromiter(
+                (self._color_id(cell[2]) for cell in cells),
+                np.uint16, len(cells)
+            )
+            cells = [cell[:2] for cell in cells]
+        else:
+            ids = self._color_id(color)
+
+        coords = np.asarray(cells, dtype=np.int64).reshape(-1, 2)
+        if len(coords):
+            self._changes.add_many(coords[:, 0], coords[:, 1], ids)
+
+    def erase_cells(self, cells):
+        coords = np.asarray(cells, dtype=np.int64).reshape(-1, 2)
+        if len(coords):
+            self._changes.add_many(coords[:, 0], coords[:, 1], 0)
+
+    def stop_timer(self):
+        # ends the timer from inside the simulation, after this tick
+        self._stopped = True
+
+    def _begin_run(self):
+        self._colors = {}
+        self._new_colors = []
+        self._changes = ChangeBuffer()
+        self._stopped = False
+
+    def _end_run(self):
+        for name in ("_colors", "_new_colors", "_changes", "_stopped"):
+            self.__dict__.pop(name, None)
+
+    def _color_id(self, color):
+        rgb = tuple(int(channel) for channel in tuple(color)[:3])
+        color_id = self._colors.get(rgb, None)
+        if color_id is None:
+            color_id = len(self._colors) + 1
+            self._colors[rgb] = color_id
+            self._new_colors.append(rgb)
+        return color_id
+
+    def _take_tick(self):
+        # the changes of the tick that just ran, and the colors they use
+        # that haven't been sent yet
+        changes = self._changes.arrays()
+        new_colors = self._new_colors
+        self._changes = ChangeBuffer()
+        self._new_colors = []
+        return changes, new_colors
+
+
+class _Ring:
+    # the records in shared memory, as numpy views
+    def __init__(self, buffer, n_records, record_changes):
+        record_size = HEADER_SIZE * 8 + MAX_RECORD_COLORS * 3 \
+            + record_changes * 18
+        self.records = []
+        for record in range(n_records):
+            offset = record * record_size
+            header = np.ndarray(
+                HEADER_SIZE, np.int64, buffer, offset
+            )
+            offset += HEADER_SIZE * 8
+            colors = np.ndarray(
+                (MAX_RECORD_COLORS, 3), np.uint8, buffer, offset
+            )
+            offset += MAX_RECORD_COLORS * 3
+            xs = np.ndarray(record_changes, np.int64, buffer, offset)
+            offset += record_changes * 8
+            ys = np.ndarray(record_changes, np.int64, buffer, offset)
+            offset += record_changes * 8
+            ids = np.ndarray(record_changes, np.uint16, buffer, offset)
+            self.records.append((header, colors, xs, ys, ids))
+
+    @staticmethod
+    def size(n_records, record_changes):
+        return n_records * (
+            HEADER_SIZE * 8 + MAX_RECORD_COLORS * 3 + record_changes * 18
+        )
+
+
+def _write_tick(ring, position, free, ready, changes, new_colors):
+    # writes a tick as one or more records, returning the next position.
+    # every tick writes at least one record, so that the grid can count
+    # ticks that changed nothing
+    xs, ys, ids = changes
+    n_records = len(ring.records)
+    capacity = len(ring.records[0][2])
+    start = 0
+    color_start = 0
+    while True:
+        end = min(start + capacity, len(xs))
+        color_end = min(color_start + MAX_RECORD_COLORS, len(new_colors))
+        last = end == len(xs) and color_end == len(new_colors)
+
+        free.acquire()
+        header, colors, record_xs, record_ys, record_ids = \
+            ring.records[position % n_records]
+        n = end - start
+        record_xs[:n] = xs[start:end]
+        record_ys[:n] = ys[start:end]
+        record_ids[:n] = ids[start:end]
+        n_colors = color_end - color_start
+        if n_colors:
+            colors[:n_colors] = new_colors[color_start:color_end]
+        header[:] = (TICK, n, n_colors, last)
+        ready.release()
+
+        position += 1
+        start = end
+        color_start = color_end
+        if last:
+            return position
+
+
+def _write_end(ring, position, free, ready):
+    free.acquire()
+    header = ring.records[position % len(ring.records)][0]
+    header[:] = (END, 0, 0, 1)
+    ready.release()
+    return position + 1
+
+
+def _worker(connection, memory_name, n_records, record_changes, free, ready,
+            stop):
+    memory = shared_memory.SharedMemory(name=memory_name)
+    ring = _Ring(memory.buf, n_records, record_changes)
+    position = 0
+
+    while True:
+        message = connection.recv()
+        if message[0] == "close":
+            break
+        if message[0] != "run":
+            # an update sent as the last run was ending
+            continue
+
+        simulation = message[1]
+        try:
+            simulation._begin_run()
+            while not stop.is_set() and not simulation._stopped:
+                # attributes changed with SimulationWorker.update() take
+                # effect from the next tick
+                while connection.poll():
+                    message = connection.recv()
+                    if message[0] == "update":
+                        simulation.__dict__.update(message[1])
+
+                simulation.on_timer(1)
+                changes, new_colors = simulation._take_tick()
+                position = _write_tick(
+                    ring, position, free, ready, changes, new_colors
+                )
+        except Exception:
+            # the grid finds the process has exited, and raises this
+            connection.send(("error", traceback.format_exc()))
+            break
+
+        position = _write_end(ring, position, free, ready)
+        simulation._end_run()
+        connection.send(("end", simulation))
+
+    # the views have to go before the memory can be closed
+    del ring
+    memory.close()
+
+
+class SimulationWorker:
+    # the grid's end of a worker process. it is started once, and reused by
+    # every run of a simulation until it is closed.
+    # it is read like a queue of ticks, each the xs, ys and palette indices
+    # of the cells it changed
+    def __init__(self, palette, n_records=4, record_changes=1 << 16):
+        self._palette = palette
+        self._n_records = n_records
+        self._record_changes = record_changes
+        self._process = None
+        self._simulation = None
+        self._ticks = []
+        self._parts = []
+        self.ended = False
+        # why the worker process exited during the last run, if it did
+        self.error = None
+
+    def start(self, simulation):
+        if self._process is None:
+            self._start_process()
+        else:
+            # ticks left over from the last run still hold their records
+            for tick in self._ticks:
+                self._free.release()
+
+        self._simulation = simulation
+        self._ticks = []
+        self._parts = []
+        self._lookup = [0]
+        self.ended = False
+        self.error = None
+        self._stop.clear()
+        self._connection.send(("run", simulation))
+
+    def _start_process(self):
+        # a fresh interpreter rather than a fork, since the grid's process
+        # has pygame and the timer thread's state in it
+        context = multiprocessing.get_context("spawn")
+        self._memory = shared_memory.SharedMemory(
+            create=True,
+            size=_Ring.size(self._n_records, self._record_changes)
+        )
+        self._ring = _Ring(
+            self._memory.buf, self._n_records, self._record_changes
+        )
+        self._position = 0
+        self._free = context.Semaphore(self._n_records)
+        self._ready = context.Semaphore(0)
+        self._stop = context.Event()
+        self._connection, worker_connection = context.Pipe()
+        self._process = context.Process(
+            target=_worker,
+            args=(
+                worker_connection, self._memory.name, self._n_records,
+                self._record_changes, self._free, self._ready, self._stop
+            ),
+            daemon=True
+        )
+        self._process.start()
+
+    def update(self, attributes):
+        # sets attributes of the running simulation, from its next tick
+        if not self.ended:
+            self._connection.send(("update", attributes))
+
+    def stop(self):
+        # the worker finishes its tick, and the simulation ends once the
+        # grid has read everything it wrote
+        self._stop.set()
+
+    def empty(self):
+        if not self._ticks:
+            self._read()
+        return not self._ticks
+
+    def qsize(self):
+        self._read()
+        return len(self._ticks)
+
+    def get_nowait(self):
+        self._read()
+        if not self._ticks:
+            raise queue.Empty
+        self._free.release()
+        return self._ticks.pop(0)
+
+    def _read(self):
+        # copies every record the worker has finished out of shared memory.
+        # a tick's last record is kept until get_nowait() takes the tick,
+        # so at most n_records ticks are ever read ahead.
+        # whether it is alive is checked first, so that whatever it wrote
+        # before it exited is read
+        alive = self.ended or self._process.is_alive()
+        while not self.ended and self._ready.acquire(False):
+            header, colors, xs, ys, ids = \
+                self._ring.records[self._position % self._n_records]
+            self._position += 1
+            kind, n, n_colors, last = header.tolist()
+
+            if kind == END:
+                self._free.release()
+                self._finish()
+                return
+
+            index = self._palette.index
+            self._lookup.extend(
+                index(tuple(color)) for color in colors[:n_colors].tolist()
+            )
+            self._parts.append((xs[:n].copy(), ys[:n].copy(), ids[:n].copy()))
+
+            if last:
+                self._ticks.append(self._join_parts())
+            else:
+                self._free.release()
+
+        if not alive and not self.ended:
+            self._fail()
+
+    def _join_parts(self):
+        parts = self._parts
+        self._parts = []
+        xs, ys, ids = (np.concatenate(arrays) for arrays in zip(*parts))
+        lookup = np.array(self._lookup, dtype=np.uint16)
+        return xs, ys, lookup[ids]
+
+    def _finish(self):
+        # the worker sends the simulation back once it ends, and it is
+        # copied into the object the timer was started with
+        final = self._connection.recv()[1]
+        self._simulation.__dict__.clear()
+        self._simulation.__dict__.update(final.__dict__)
+        self._stop.clear()
+        self.ended = True
+
+    def _fail(self):
+        # the worker exited without ending the run, most likely because the
+        # simulation raised. the simulation is left as it was when the run
+        # started, and the next run starts a new process
+        self.error = "the worker process exited with code " \
+            f"{self._process.exitcode}"
+        try:
+            if self._connection.poll():
+                self.error = self._connection.recv()[1]
+        except (EOFError, OSError):
+            # it was killed, rather than sending why
+            pass
+        self._parts = []
+        self.ended = True
+        self.close()
+
+    def close(self):
+        if self._process is None:
+            return
+
+        self._stop.set()
+        try:
+            self._connection.send(("close",))
+        except (BrokenPipeError, OSError):
+            # the process has already exited
+            pass
+        self._process.join(1)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._process = None
+        self._connection.close()
+
+        del self._ring
+        self._memory.close()
+        self._memory.unlink()
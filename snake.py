@@ -233,10 +233,12 @@ class SnakeGrid(PyGrid):
         self.start_timer()
         self.game_state = PLAYING
 
-if __name__ == "__main__":
+
+def create_grid():
+    # the grid as the program runs it, also used by the benchmarks
     from config import config
 
-    grid = SnakeGrid(
+    return SnakeGrid(
         background_color = config["background_color"],
         grid_color       = config["grid_color"],
         grid_percentage  = config["grid_percentage"],
@@ -246,4 +248,6 @@ if __name__ == "__main__":
         fps              = config["fps"]
     )
 
-    grid.start()
+
+if __name__ == "__main__":
+    create_grid().start()
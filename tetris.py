@@ -736,13 +736,15 @@ class TetrisGrid(PyGrid):
         self.start_timer()
         self.game_state = self.old_game_state
 
-if __name__ == "__main__":
+
+def create_grid():
+    # the grid as the program runs it, also used by the benchmarks
     from config import config
 
     orange = color_mix(config["red"], config["yellow"], 0.5)
     cell_color = color_mix(config["background_color"], config["cell_color"], 0.75)
 
-    grid = TetrisGrid(
+    return TetrisGrid(
         background_color = config["background_color"],
         cell_color       = cell_color,
         grid_color       = config["grid_color"],
@@ -757,4 +759,6 @@ if __name__ == "__main__":
         fps              = config["fps"]
     )
 
-    grid.start()
+
+if __name__ == "__main__":
+    create_grid().start()
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+
+# rendered chunk surfaces, kept in least recently used order.
+# the cache is bounded by the number of bytes its surfaces occupy,
+# the least recently used tiles are evicted once that is exceeded.
+# each tile remembers the version of the chunk it was rendered from,
+# so a tile whose chunk has since changed is treated as a miss.
+
+
+class TileCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._tiles = OrderedDict()
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def get(self, key, version):
+        entry = self._tiles.get(key, None)
+        if entry is None or entry[1] != version:
+            self.misses += 1
+            return None
+
+        self._tiles.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, version, surface):
+        size = surface.get_bytesize() * surface.get_width() \
+            * surface.get_height()
+
+        # a tile that doesn't fit isn't worth evicting everything for
+        if size > self.max_bytes:
+            return
+
+        old_entry = self._tiles.pop(key, None)
+        if old_entry is not None:
+            self.n_bytes -= old_entry[2]
+
+        self._tiles[key] = (surface, version, size)
+        self.n_bytes += size
+
+        while self.n_bytes > self.max_bytes:
+            _, (_, _, old_size) = self._tiles.popitem(last=False)
+            self.n_bytes -= old_size
+            self.evictions += 1
+
+    def clear(self):
+        self._tiles = OrderedDict()
+        self.n_bytes = 0
+
+    def stats(self):
+        return {
+            "tiles": len(self._tiles),
+            "bytes": self.n_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
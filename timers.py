@@ -0,0 +1,102 @@
+# fixed timestep timers. frame time is added to an accumulator, and a tick is
+# due for every whole period in it, so a timer keeps to its schedule however
+# the frames happen to line up with it.
+# when a timer falls behind, e.g. a slow frame or a busy timer thread, its
+# catch-up policy decides what happens to the ticks that piled up:
+#   DROP      runs one tick, and the rest are missed
+#   BATCH     runs them all in one call, as on_timer(n_ticks)
+#   CATCH_UP  calls on_timer(1) once per tick, up to max_ticks of them,
+#             and the rest are missed
+# missed ticks are never run later, so a timer that can't keep up doesn't
+# fall further and further behind.
+# periods and times are in milliseconds
+
+# catch-up policies
+DROP = 0
+BATCH = 1
+CATCH_UP = 2
+
+POLICY_NAMES = ("drop", "batch", "catch_up")
+
+
+class Timer:
+    def __init__(self, period, callback=None, catch_up=BATCH, max_ticks=4):
+        self.period = period
+        self.callback = callback
+        self.set_catch_up(catch_up, max_ticks)
+        self.accumulator = 0
+
+        # ticks run and missed, and how many calls ran them.
+        # drift is how long after it was due the timer got to a tick
+        self.ticks = 0
+        self.missed = 0
+        self.calls = 0
+        self.drift = 0
+        self.max_drift = 0
+
+    def set_catch_up(self, catch_up, max_ticks):
+        if catch_up not in (DROP, BATCH, CATCH_UP):
+            raise ValueError(f"unknown catch-up policy {catch_up!r}")
+        if max_ticks < 1:
+            raise ValueError("max_ticks must be at least 1")
+        self.catch_up = catch_up
+        self.max_ticks = max_ticks
+
+    def reset(self):
+        # starts the schedule again, e.g. when the timer is restarted
+        self.accumulator = 0
+
+    def advance(self, delta):
+        self.accumulator += delta
+
+    def due(self):
+        return self.accumulator >= self.period
+
+    def take(self):
+        # consumes every tick that is due, returning the n_ticks of each
+        # call to make, as the catch-up policy decides
+        due = int(self.accumulator // self.period)
+        if not due:
+            return []
+
+        drift = self.accumulator - self.period
+        if self.calls:
+            self.drift = self.drift * 0.9 + drift * 0.1
+        else:
+            self.drift = drift
+        self.max_drift = max(self.max_drift, drift)
+        self.accumulator -= due * self.period
+
+        if self.catch_up == DROP:
+            calls = [1]
+        elif self.catch_up == BATCH:
+            calls = [due]
+        else:
+            calls = [1] * min(due, self.max_ticks)
+
+        run = sum(calls)
+        self.ticks += run
+        self.missed += due - run
+        self.calls += len(calls)
+        return calls
+
+    def settle(self, calls, run):
+        # for ticks run ahead of time elsewhere, e.g. on a timer thread,
+        # each by its own on_timer(1) call. take() counted calls as run,
+        # but only run of their ticks were ready, and the rest are missed
+        requested = sum(calls)
+        self.ticks -= requested - run
+        self.missed += requested - run
+        self.calls += run - len(calls)
+
+    def stats(self):
+        return {
+            "period_ms": self.period,
+            "catch_up": POLICY_NAMES[self.catch_up],
+            "ticks": self.ticks,
+            "missed": self.missed,
+            "calls": self.calls,
+            "drift_ms": self.drift,
+            "max_drift_ms": self.max_drift,
+            "behind_ms": self.accumulator,
+        }
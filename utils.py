@@ -11,3 +11,41 @@ def color_mix(rgb_1, rgb_2, perc):
         int(rgb_1[1] * perc_alt + rgb_2[1] * perc),
         int(rgb_1[2] * perc_alt + rgb_2[2] * perc)
     )
+
+
+def merge_rects(rects, block_size):
+    # merges (x, y, w, h) rects into fewer, larger rects covering them.
+    # rects are snapped to a grid of block_size squares, and each row of
+    # blocks is turned into horizontal runs, so overlapping and neighbouring
+    # rects become one. sorting the blocks makes this O(n log n), unlike
+    # pairwise merging, which is O(n^2)
+    blocks = set()
+    for x, y, w, h in rects:
+        if w <= 0 or h <= 0:
+            continue
+        for block_y in range(y // block_size, (y + h - 1) // block_size + 1):
+            for block_x in range(x // block_size,
+                                 (x + w - 1) // block_size + 1):
+                blocks.add((block_y, block_x))
+
+    merged = []
+    run_y = run_start = run_end = None
+    for block_y, block_x in sorted(blocks):
+        if block_y == run_y and block_x == run_end:
+            run_end += 1
+            continue
+
+        if run_y is not None:
+            merged.append((
+                run_start * block_size, run_y * block_size,
+                (run_end - run_start) * block_size, block_size
+            ))
+        run_y, run_start, run_end = block_y, block_x, block_x + 1
+
+    if run_y is not None:
+        merged.append((
+            run_start * block_size, run_y * block_size,
+            (run_end - run_start) * block_size, block_size
+        ))
+
+    return merged